@@ -579,8 +579,8 @@ class BattleRoyale(BaseCog):
                 while announcement == self.br_last_ann:
                     announcement = random.choice(self.arena_init_texts).replace('[USER]', context.message.author.name)
 
-                await self.bot.post_message(context, self.bot.bot_channel, role_mention + '**[BATTLE ROYALE]** ' + announcement)
-                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** Type !joinbr (entry fee is ' + str(bet) + ') to join the ranks of the challengers.')
+                await self.bot.post_message(context, self.bot.bot_channel, role_mention + '**[BATTLE ROYALE]** ' + announcement, coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** Type !joinbr (entry fee is ' + str(bet) + ') to join the ranks of the challengers.', coalesce=True)
                 self.br_last_ann = announcement
                 self.br_closed = False
                 amount_asked = 0
@@ -710,14 +710,14 @@ class BattleRoyale(BaseCog):
                                         person.damage_bonus += self.br_skillbook_boost
                                         message = person.name + ' has found a skillbook! :book: Their weapon damage has increased by ' + str(self.br_skillbook_boost) + ' points.'
 
-                                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + message)
+                                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + message, coalesce=True)
                                 # Players may drink potions during events
                                 # NOTE: no probability check here on purpose
                                 if not suicide:
                                     while person.potions > 0 and person.health < self.br_health:
                                         person.health = min(person.health + self.br_potion_buff, self.br_health)
                                         person.potions -= 1
-                                        await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + person.name + ' uses ' + self.potion_emote + ' to get back to ' + str(person.health) + ' health!')
+                                        await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + person.name + ' uses ' + self.potion_emote + ' to get back to ' + str(person.health) + ' health!', coalesce=True)
                             else:
                                 # Calculate the amount of individual fights in this round:
                                 if len(survivors) > 3:
@@ -915,13 +915,13 @@ class BattleRoyale(BaseCog):
                                     if player2_display_block:
                                         player2_death_opt = ' :shield: '
                                     result = '**[BATTLE ROYALE]** ' + player1_display.name + ' ' + player1_weapon_display + player2_death_opt + ' ' + player2_display.name + ' *(~~' + str(player2_prev_health_display) + '~~ __**' + str(player2_health_display) + '**__)' + player1_display_opt + '*'
-                                    await self.bot.post_message(context, self.bot.bot_channel, result)
+                                    await self.bot.post_message(context, self.bot.bot_channel, result, coalesce=True)
 
                                     if player2_hits:
                                         if player1_display_block:
                                             player1_death_opt = ' :shield: '
                                         result = '**[BATTLE ROYALE]** ' + player2_display.name + ' ' + player2_weapon_display + player1_death_opt + ' ' + player1_display.name + ' *(~~' + str(player1_prev_health_display) + '~~ __**' + str(player1_health_display) + '**__)' + player2_display_opt + '*'
-                                        await self.bot.post_message(context, self.bot.bot_channel, result)
+                                        await self.bot.post_message(context, self.bot.bot_channel, result, coalesce=True)
 
                                     if len(survivors) > 1:
                                         # Players pick up items from defeated opponents:
@@ -950,7 +950,7 @@ class BattleRoyale(BaseCog):
                                                     list_pickup += self.potion_emote
 
                                             if list_pickup:
-                                                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + pickup_player.name + ' picks up ' + list_pickup + ' from ' + pickup_ded_player.name + '.')
+                                                await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + pickup_player.name + ' picks up ' + list_pickup + ' from ' + pickup_ded_player.name + '.', coalesce=True)
 
                                         # After the fight, surviving players may drink potions to get themselves back up:
                                         if not killed1:
@@ -958,13 +958,13 @@ class BattleRoyale(BaseCog):
                                                 while player1.potions > 0 and player1.health < self.br_health:
                                                     player1.health = min(player1.health + self.br_potion_buff, self.br_health)
                                                     player1.potions -= 1
-                                                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + player1.name + ' uses ' + self.potion_emote + ' to get back to ' + str(player1.health) + ' health!')
+                                                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + player1.name + ' uses ' + self.potion_emote + ' to get back to ' + str(player1.health) + ' health!', coalesce=True)
                                         if not killed2:
                                             if random.uniform(0, 1) < self.p_drink_potion:
                                                 while player2.potions > 0 and player2.health < self.br_health:
                                                     player2.health = min(player2.health + self.br_potion_buff, self.br_health)
                                                     player2.potions -= 1
-                                                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + player2.name + ' uses ' + self.potion_emote + ' to get back to ' + str(player2.health) + ' health!')
+                                                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** ' + player2.name + ' uses ' + self.potion_emote + ' to get back to ' + str(player2.health) + ' health!', coalesce=True)
 
                                         await asyncio.sleep(self.br_fight_message_delay)
                                     first_round = False
@@ -987,8 +987,8 @@ class BattleRoyale(BaseCog):
                     winner.points = self.br_pool
                     result += winner.name.ljust(indent) + '   ' + str(winner.points) + linesep + non_winners_result_part + '```'
 
-                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** :trumpet: ' + winner.name + ' wins, taking home the remaining pool of ' + str(winner.points) + ' ' + config.currency_name + 's! :trumpet:')
-                    await self.bot.post_message(context, self.bot.bot_channel, result)
+                    await self.bot.post_message(context, self.bot.bot_channel, '**[BATTLE ROYALE]** :trumpet: ' + winner.name + ' wins, taking home the remaining pool of ' + str(winner.points) + ' ' + config.currency_name + 's! :trumpet:', coalesce=True)
+                    await self.bot.post_message(context, self.bot.bot_channel, result, coalesce=True)
 
                     highest_total_owned = trivia_table.get(self.bot.query.name == 'highest_total_owned')['value']
                     for p in players:
@@ -2,11 +2,18 @@ import logging
 import discord
 import asyncio
 import copy
+import functools
+import io
+import os
+import tempfile
+import time
 import traceback
+from discord.ext import commands
 from os import linesep
 from conf import config
+from chunking import split_text
 from .base_cog import BaseCog
-from collections import deque
+from collections import deque, OrderedDict
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -29,6 +36,24 @@ class MessageCacheItem:
         # Note that we also keep the channel id for each message to know which webhook to delete or edit each message with.
         self.webhook_message_ids = []
 
+        # Last known pin status, needed to detect pins/unpins from raw gateway events that don't tell us the previous state
+        self.pinned = False
+
+        # Channel id -> CoalescedWebhookMessage for channels in which this message was merged into a shared webhook message.
+        self.coalesced = {}
+
+        # Webhook message id -> (content, list of embed dicts) as last sent or edited. Edits only touch webhook messages whose rendering actually changed.
+        self.rendered = {}
+
+        # Everything needed to re-render this message on edits without fetching the replied-to message or rebuilding unchanged attachment lists again.
+        self.reply_embeds = []
+        self.reference_author = None
+        self.source_embeds = None # Embed dicts of the original message at the time the embeds below were built
+        self.attachment_ids = None
+        self.rehosted_attachment_ids = [] # These are uploaded as files rather than linked
+        self.attachment_text = ''
+        self.embeds = []
+
     def find_message_for_reply(self, webhook_message_id):
         """Check if this message is the one the user is replying to."""
 
@@ -41,6 +66,340 @@ class MessageCacheItem:
         return self.message_id == message_id
 
 
+class ReplyAuthorInfo:
+    """Everything needed to quote a message in a reply embed, so that replies to recently bridged messages don't have to fetch them."""
+
+    __slots__ = ('author_name', 'avatar_url', 'quoted_content', 'created_at')
+
+    quote_size = 256 # This is not the actual character limit for embed descriptions, but we don't want the reply to become too bloated
+
+    def __init__(self, author_name, avatar_url, content, created_at):
+        self.author_name = author_name
+        self.avatar_url = avatar_url
+        self.created_at = created_at
+        self.set_content(content)
+
+    def set_content(self, content):
+        if len(content) <= ReplyAuthorInfo.quote_size:
+            self.quoted_content = content
+        else:
+            self.quoted_content = content[:ReplyAuthorInfo.quote_size - 3] + '...'
+
+    @staticmethod
+    def from_message(message):
+        # Use clean content to avoid mentions in the original message tagging people on replies
+        avatar_url = message.author.avatar.url if message.author.avatar is not None else None
+        return ReplyAuthorInfo(message.author.name, avatar_url, message.clean_content, message.created_at)
+
+
+class ReplyAuthorCache:
+    """A bounded LRU of ReplyAuthorInfo items by message id.
+
+    Both the original message and all of its forwarded webhook messages map to the same item, since users may reply to either of them.
+    """
+
+    def __init__(self, max_size: int, metrics):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+        self.hit_counter = metrics.counter('bridge_reply_cache_hits_total', 'Reply author cache hits')
+        self.miss_counter = metrics.counter('bridge_reply_cache_misses_total', 'Reply author cache misses')
+        self.fetches = 0 # Misses that were not even in discord.py's cache and had to be fetched from the API
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def hits(self):
+        return self.hit_counter.get()
+
+    @property
+    def misses(self):
+        return self.miss_counter.get()
+
+    def get(self, message_id):
+        info = self.items.get(message_id)
+        if info is None:
+            self.miss_counter.inc()
+        else:
+            self.hit_counter.inc()
+            self.items.move_to_end(message_id)
+        return info
+
+    def put(self, message_id, info):
+        self.items[message_id] = info
+        self.items.move_to_end(message_id)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def update_content(self, message_id, content):
+        info = self.items.get(message_id)
+        if info is not None:
+            info.set_content(content)
+
+    def mark_deleted(self, message_id):
+        self.update_content(message_id, '_<This message was deleted>_')
+
+
+class CoalescedWebhookMessage:
+    """A single webhook message that carries the contents of several consecutive short messages by the same author.
+
+    Every part remembers the id of the original message it belongs to, so that edits and deletes of one part can be mirrored by re-rendering the shared webhook message.
+    Only messages without embeds are merged, but an edit can add some (e.g. link previews); those are shown on the shared webhook message, in the order of their parts.
+    """
+
+    max_embeds = 10
+
+    def __init__(self, webhook_message_id: int, channel_id: int):
+        self.webhook_message_id = webhook_message_id
+        self.channel_id = channel_id
+        self.parts = [] # List of [original message id, content] pairs in the order they were posted
+        self.embeds = {} # Original message id -> embeds of that part, for parts that have any
+
+    def render(self):
+        return '\n'.join(content for message_id, content in self.parts)
+
+    def render_embeds(self):
+        return [embed for message_id, content in self.parts for embed in self.embeds.get(message_id, [])][:self.max_embeds]
+
+    def set_embeds(self, message_id, embeds):
+        if embeds:
+            self.embeds[message_id] = embeds
+        else:
+            self.embeds.pop(message_id, None)
+
+    def update_part(self, message_id, content):
+        for part in self.parts:
+            if part[0] == message_id:
+                part[1] = content
+                return True
+        return False
+
+    def remove_part(self, message_id):
+        self.parts = [part for part in self.parts if part[0] != message_id]
+        self.embeds.pop(message_id, None)
+
+
+class RehostedAttachment:
+    """An attachment that is downloaded once and re-uploaded as a file to every destination channel, so that forwarded files survive the deletion of the original message.
+
+    The download is kept in memory up to a threshold and written to a temporary file beyond, which is deleted once every destination has sent it. Destinations upload concurrently, so each gets a reader of its own on the same content instead of a copy.
+    """
+
+    def __init__(self, attachment, users: int):
+        self.attachment = attachment
+        self.users = users # Number of destination channels that still need this file
+        self.content = None # The downloaded bytes if they fit in memory
+        self.path = None # Else the temporary file holding them
+        self.task = None
+
+    async def download(self, session, semaphore, max_size, spool_size):
+        async with semaphore:
+            chunks = []
+            file = None
+            try:
+                size = 0
+                async with session.get(self.attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        size += len(chunk)
+                        if size > max_size:
+                            raise ValueError('Attachment ' + str(self.attachment.id) + ' exceeds the maximum size for re-hosting')
+                        if file is None and size > spool_size:
+                            file = tempfile.NamedTemporaryFile(prefix='rehost_', delete=False)
+                            file.writelines(chunks)
+                            chunks = None
+                        if file is not None:
+                            file.write(chunk)
+                        else:
+                            chunks.append(chunk)
+            except BaseException:
+                if file is not None:
+                    file.close()
+                    os.remove(file.name)
+                raise
+
+            if file is not None:
+                file.close()
+                self.path = file.name
+            else:
+                self.content = b''.join(chunks)
+
+            # Every destination may have given up on this file already
+            if self.users <= 0:
+                self.discard()
+
+    async def get_file(self):
+        """Returns a new discord.File for one destination, or None if the download failed (callers fall back to the attachment URL)."""
+
+        try:
+            await self.task
+        except Exception as e:
+            log.warning('Failed to re-host attachment ' + str(self.attachment.url) + ': ' + str(e))
+            return None
+
+        if self.path is not None:
+            # discord.File opens the path itself, so every upload reads through its own file handle
+            return discord.File(self.path, filename=self.attachment.filename, spoiler=self.attachment.is_spoiler(), description=self.attachment.description)
+        if self.content is not None:
+            # A BytesIO shares the bytes it is created from until it is written to
+            return discord.File(io.BytesIO(self.content), filename=self.attachment.filename, spoiler=self.attachment.is_spoiler(), description=self.attachment.description)
+        return None
+
+    def release(self):
+        self.users -= 1
+        if self.users <= 0:
+            self.discard()
+
+    def discard(self):
+        self.content = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                log.warning('Failed to remove re-hosted attachment file ' + self.path + ': ' + str(e))
+            self.path = None
+
+
+class QueuedWebhookSend:
+    """A forwarded message waiting in the send queue of one destination channel."""
+
+    def __init__(self, message, message_cache_item, username, avatar_url, embeds, gen_text, coalescible, rehosted_attachments):
+        self.message = message
+        self.message_cache_item = message_cache_item
+        self.username = username
+        self.avatar_url = avatar_url
+        self.embeds = embeds
+        self.gen_text = gen_text
+        self.coalescible = coalescible # Only plain text messages without embeds, attachments or replies may be merged with others
+        self.rehosted_attachments = rehosted_attachments # Shared with the sends to all other channels
+        self.enqueued_at = time.monotonic()
+
+
+class WebhookSendQueue:
+    """An ordered send queue with its own worker task for a single destination channel (i.e. a single webhook).
+
+    Gateway handlers only put jobs into this queue and return immediately, so a webhook that is being rate limited only stalls its own worker instead of the whole bot.
+    Jobs are either QueuedWebhookSend items or callables returning a coroutine (used for edits and deletes), and they are executed strictly in the order they were queued.
+    This way, an edit or delete of a message can never overtake the send of that same message.
+    """
+
+    def __init__(self, bridge, channel_id: int, bridge_index: int):
+        self.bridge = bridge
+        self.channel_id = channel_id
+        self.labels = (str(bridge_index), str(channel_id)) # Label values of this destination in the bridge metrics
+        self.jobs = deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+        # Backpressure metric; everything else is counted in the bridge metrics
+        self.max_depth = 0
+
+    def start(self, loop):
+        if self.task is None:
+            self.task = loop.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def put(self, job):
+        self.jobs.append(job)
+        self.max_depth = max(self.max_depth, len(self.jobs))
+        if len(self.jobs) == self.bridge.send_queue_warn_depth:
+            log.warning('Send queue for channel ' + str(self.channel_id) + ' has reached a depth of ' + str(len(self.jobs)) + ' jobs.')
+        self.wakeup.set()
+
+    def depth(self):
+        return len(self.jobs)
+
+    def take_coalescible(self, first):
+        """Pop all queued sends directly following _first_ that can be merged into the same webhook message. The merged message stays coalesce_max_length characters below the limit, so that it still fits when one of its parts is edited to be longer."""
+
+        batch = [first]
+        length = len(first.message.clean_content)
+        max_length = self.bridge.chunk_size - self.bridge.coalesce_max_length
+        while self.jobs:
+            candidate = self.jobs[0]
+            if not isinstance(candidate, QueuedWebhookSend) or not candidate.coalescible or candidate.message.author.id != first.message.author.id:
+                break
+            length += 1 + len(candidate.message.clean_content)
+            if length > max_length:
+                break
+            batch.append(self.jobs.popleft())
+        return batch
+
+    async def run(self):
+        """Worker loop. Never raises; errors are logged per job."""
+
+        while True:
+            while not self.jobs:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            job = self.jobs.popleft()
+            try:
+                if isinstance(job, QueuedWebhookSend):
+                    batch = [job]
+                    if self.bridge.coalesce_messages and job.coalescible:
+                        batch = self.take_coalescible(job)
+
+                    now = time.monotonic()
+                    for item in batch:
+                        self.bridge.send_wait.observe(*self.labels, value=now - item.enqueued_at)
+
+                    await self.send_batch(batch)
+
+                    done = time.monotonic()
+                    self.bridge.forwarded_counter.inc(*self.labels, amount=len(batch))
+                    for item in batch:
+                        self.bridge.forward_latency.observe(*self.labels, value=done - item.enqueued_at)
+                else:
+                    await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.bridge.failure_counter.inc(*self.labels)
+                log.exception(e)
+                self.bridge.bot.post_log('**[ERROR]** A critical error occurred in the send queue of channel ' + str(self.channel_id) + '. Check logs. ' + config.additional_error_message)
+
+    async def send_batch(self, batch):
+        webhook = self.bridge.webhooks.get(self.channel_id)[0]
+
+        if len(batch) == 1:
+            item = batch[0]
+            try:
+                # Wait for the shared downloads; attachments that could not be re-hosted are forwarded as links instead
+                files = []
+                gen_text = item.gen_text
+                for rehosted_attachment in item.rehosted_attachments:
+                    file = await rehosted_attachment.get_file()
+                    if file is not None:
+                        files.append(file)
+                    else:
+                        gen_text += rehosted_attachment.attachment.url + '\n'
+
+                await self.bridge.send_with_webhook(webhook, True, item.username, item.avatar_url, False, item.embeds, self.bridge.allowed_mentions, gen_text, item.message, item.message_cache_item, files)
+            finally:
+                for rehosted_attachment in item.rehosted_attachments:
+                    rehosted_attachment.release()
+            return
+
+        # Several consecutive messages by the same author are merged into one webhook message
+        first = batch[0]
+        coalesced_message = CoalescedWebhookMessage(None, self.channel_id)
+        coalesced_message.parts = [[item.message.id, item.message.clean_content] for item in batch]
+        sent_webhook_messages = []
+        await self.bridge.send_with_webhook_internal(webhook=webhook, content=coalesced_message.render(), wait=True, username=first.username, avatar_url=first.avatar_url, tts=False, embed=None, embeds=[], allowed_mentions=self.bridge.allowed_mentions, sent_webhook_messages=sent_webhook_messages, message=first.message)
+
+        if sent_webhook_messages:
+            coalesced_message.webhook_message_id = sent_webhook_messages[0][0]
+            for item in batch:
+                item.message_cache_item.webhook_message_ids.extend(sent_webhook_messages)
+                item.message_cache_item.coalesced[self.channel_id] = coalesced_message
+
+
 class ServerBridge(BaseCog):
     """A cog for forwarding messages between servers. Multiple servers can be involved in a bridge, but every server can only have one channel per bridge. You can, however, have multiple bridges per server."""
 
@@ -61,20 +420,67 @@ class ServerBridge(BaseCog):
 
         self.cache_size_per_bridge = int(config.get('ServerBridge', 'cache_size_per_bridge', fallback='100'))
 
+        # Consecutive short messages by the same author that pile up in a send queue (e.g. during bursts) may be merged into a single webhook message
+        self.coalesce_messages = config.get('ServerBridge', 'coalesce_messages', fallback='false').lower() == 'true'
+        self.coalesce_max_length = int(config.get('ServerBridge', 'coalesce_max_length', fallback='400'))
+        self.send_queue_warn_depth = int(config.get('ServerBridge', 'send_queue_warn_depth', fallback='50'))
+
+        # Optionally, attachments are downloaded once and re-uploaded to all channels instead of being forwarded as links that break once the original message is deleted
+        self.rehost_attachments = config.get('ServerBridge', 'rehost_attachments', fallback='false').lower() == 'true'
+        self.rehost_max_size = int(config.get('ServerBridge', 'rehost_max_size', fallback=str(8 * 1024 * 1024)))
+        self.rehost_spool_size = int(config.get('ServerBridge', 'rehost_spool_size', fallback=str(1024 * 1024)))
+        self.rehost_semaphore = asyncio.Semaphore(int(config.get('ServerBridge', 'rehost_max_concurrent_downloads', fallback='4')))
+        self.max_files = 10 # Discord's limit of files per message
+
+        self.chunk_size = 2000
+        self.allowed_mentions = discord.AllowedMentions(everyone=False, users=True, roles=False, replied_user=False)
+
         # This will be filled with (channel id, (webhook, bridge index)) pairs.
         self.webhooks = {}
 
+        # Ids of all webhooks in self.webhooks, so that messages from our own webhooks can be recognized in constant time. Rebuilt whenever webhooks change.
+        self.webhook_ids = frozenset()
+
+        # This will be filled with (channel id, WebhookSendQueue) pairs, one per destination webhook.
+        self.send_queues = {}
+
         # This is a runtime cache that associates messages sent by users with webhook messages of the forwarded post.
         # This is needed to be able to edit, delete or reply to webhook messages to mirror user actions.
         # I considered a dictionary from webhook message Id to message Ids, but we would have to keep an additional timestamp and purge the table periodically via a timed task. This seems a little complex for such an easy problem. Therefore, a double-ended queue is used to solve the timestamping problem "naturally" since older messages will be removed first from the deque once it is full. This makes finding messages O(n*m) in the reply case, and O(n) in the edit/delete case. This is not optimal, but we usually limit these deques to 100 elements per bridge, which should be reasonably few to iterate a linked list (and a regular one of <10 elements within). I reckon the message fetch is much more likely to be a bottleneck in practice (though I haven't done any measurements). By appending to the left, we can find recent elements more quickly.
         self.message_cache = []
 
+        # Recently seen bridged messages (original and webhook messages) for building reply embeds without fetching the replied-to message
+        self.reply_cache = ReplyAuthorCache(int(config.get('ServerBridge', 'reply_cache_size', fallback='1000')), bot.metrics)
+
+        # Message id -> (bridge index, MessageCacheItem) for every message in the deques above, so that events which only carry a message id (raw gateway events) can be resolved in O(1) without fetching anything.
+        self.message_index = {}
+
+        # (message id, pinned) -> (count, deadline) for pins and unpins done by the bridge itself, since every one of them comes back as an edit event
+        self.pin_echoes = OrderedDict()
+        self.pin_echo_timeout = 30
+        self.max_pin_echoes = 1000
+
+        # Forwarding metrics per bridge and destination channel, exported with all other metrics of the bot and shown by !bridgestats
+        labels = ('bridge', 'channel')
+        self.forwarded_counter = bot.metrics.counter('bridge_messages_forwarded_total', 'Messages forwarded to a destination channel', labels)
+        self.chunk_counter = bot.metrics.counter('bridge_chunks_sent_total', 'Webhook messages sent to a destination channel, including every chunk of split messages', labels)
+        self.edit_counter = bot.metrics.counter('bridge_edits_total', 'Edits mirrored to a destination channel', labels)
+        self.delete_counter = bot.metrics.counter('bridge_deletes_total', 'Deletes mirrored to a destination channel', labels)
+        self.failure_counter = bot.metrics.counter('bridge_failures_total', 'Failed sends, edits and deletes in a destination channel', labels)
+        self.rate_limit_counter = bot.metrics.counter('bridge_rate_limited_total', 'Webhook requests to a destination channel that got a 429 response discord.py did not handle by itself', labels)
+        self.forward_latency = bot.metrics.histogram('bridge_forward_latency_seconds', 'Time from receiving a message until it was forwarded to a destination channel', labels)
+        self.send_wait = bot.metrics.histogram('bridge_send_wait_seconds', 'Time a message waited in the send queue of a destination channel before its send started', labels)
+        bot.metrics.gauge('bridge_queue_depth', 'Jobs waiting in the send queue of a destination channel', labels, callback=lambda: {send_queue.labels: send_queue.depth() for send_queue in self.send_queues.values()})
+        bot.metrics.gauge('bridge_queue_max_depth', 'Largest number of jobs that were waiting in the send queue of a destination channel at once', labels, callback=lambda: {send_queue.labels: send_queue.max_depth for send_queue in self.send_queues.values()})
+        bot.metrics.gauge('bridge_cached_messages', 'Messages in the cache of a bridge that can still be edited, deleted and replied to', ('bridge',), callback=lambda: {(str(bridge_index),): len(cache) for bridge_index, cache in enumerate(self.message_cache) if cache is not None})
+        bot.metrics.gauge('bridge_reply_cache_items', 'Messages in the reply author cache', callback=lambda: {(): len(self.reply_cache)})
+
 
     async def on_ready(self):
-        """Called by bot client's on_ready()."""
+        """Called once at startup by the bot client (see lifecycle.py): finds or creates the webhooks of all bridges and checks their consistency."""
 
         try:
-            # Check for re-entry after connecting to discord servers:
+            # Guard against being started twice, which would create duplicate caches and send queues
             if len(self.message_cache) == len(self.bridges):
                 log.info('bridge on_ready(): message cache is already populated, early exit.')
                 return
@@ -113,25 +519,29 @@ class ServerBridge(BaseCog):
                                 break
                         except Exception as e:
                             log.exception(e)
-                            await self.bot.log_channel.send('**[ERROR]** Error during startup consistency check of bridge ' + str(bridge_index) + '! ' + config.additional_error_message)
+                            self.bot.post_log('**[ERROR]** Error during startup consistency check of bridge ' + str(bridge_index) + '! ' + config.additional_error_message)
                 except discord.Forbidden as e:
                     print('Missing manage webhooks permission on channel ' + str(channel.name))
-                    await self.bot.log_channel.send('**[ERROR]** Missing manage webhooks permission on channel ' + str(channel.name) + '. ' + config.additional_error_message)
+                    self.bot.post_log('**[ERROR]** Missing manage webhooks permission on channel ' + str(channel.name) + '. ' + config.additional_error_message)
                 except Exception as e:
                     log.exception(e)
                     print('Encountered error during bridge startup on bridge ' + str(bridge_index) + '. Check logs')
-                    await self.bot.log_channel.send('**[ERROR]** Encountered error during bridge startup on bridge ' + str(bridge_index) + '. Check logs. ' + config.additional_error_message)
+                    self.bot.post_log('**[ERROR]** Encountered error during bridge startup on bridge ' + str(bridge_index) + '. Check logs. ' + config.additional_error_message)
                 else:
                     if len(loc_webhooks) == len(bridge):
                         # Successfully validated this bridge: Every channel has a webhook that exists in our dictionary.
                         for channel_id, webhook in loc_webhooks:
                             self.webhooks[channel_id] = (webhook, bridge_index)
+                            if channel_id not in self.send_queues:
+                                self.send_queues[channel_id] = WebhookSendQueue(self, channel_id, bridge_index)
+                            self.send_queues[channel_id].start(self.bot.loop)
+                        self.update_webhook_ids()
                         if bridge_str:
                             bridge_str = bridge_str[:-2]
                         self.message_cache[bridge_index] = deque(maxlen=self.cache_size_per_bridge)
                     else:
                         print('Invalid bridge has ' + str(len(bridge)) + ' channels, but ' + str(len(loc_webhooks)) + ' webhooks. ')
-                        await self.bot.log_channel.send('**[ERROR]** Invalid bridge has ' + str(len(bridge)) + ' channels, but ' + str(len(loc_webhooks)) + ' webhooks. ' + config.additional_error_message)
+                        self.bot.post_log('**[ERROR]** Invalid bridge has ' + str(len(bridge)) + ' channels, but ' + str(len(loc_webhooks)) + ' webhooks. ' + config.additional_error_message)
 
                     print(bridge_str)
 
@@ -167,75 +577,198 @@ class ServerBridge(BaseCog):
             print('=== END SERVER BRIDGE ===')
         except Exception as e:
             print('Failed to initialize bridges. Check logs')
-            await self.bot.log_channel.send('**[ERROR]** Failed to initialize bridges. Check logs. ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** Failed to initialize bridges. Check logs. ' + config.additional_error_message)
             traceback.print_exception(type(e), e, e.__traceback__)
             log.fatal(e)
             self.webhooks = {} # Make sure we never attempt to do anything
+            self.update_webhook_ids()
+
+
+    def update_webhook_ids(self):
+        """Rebuild the set of our own webhook ids. Must be called whenever self.webhooks changes."""
+        self.webhook_ids = frozenset(webhook.id for webhook, bridge_index in self.webhooks.values())
+
+
+    async def recreate_webhook(self, deleted_webhook):
+        """Replace the webhook of a bridged channel after it has been deleted (e.g. by a moderator). Returns the new webhook, which may already have been created by an earlier call."""
+
+        channel_id = deleted_webhook.channel_id
+        webhook, bridge_index = self.webhooks[channel_id]
+        if webhook.id != deleted_webhook.id:
+            return webhook
+
+        channel = self.bot.get_channel(channel_id)
+        new_webhook = await channel.create_webhook(name='_bridge')
+        self.webhooks[channel_id] = (new_webhook, bridge_index)
+        self.update_webhook_ids()
+        log.warning('Re-created deleted webhook for channel ' + str(channel_id) + '.')
+        return new_webhook
+
+
+    def cog_unload(self):
+        """Stop all send queue workers on cog unload."""
+        for send_queue in self.send_queues.values():
+            send_queue.stop()
+
+
+    def count(self, counter, channel_id, amount=1):
+        """Count an event of a destination channel in one of the bridge metrics."""
+        send_queue = self.send_queues.get(channel_id)
+        if send_queue is not None:
+            counter.inc(*send_queue.labels, amount=amount)
+
+
+    @commands.command()
+    async def bridgestats(self, context):
+        """Displays forwarding metrics and the health of every server bridge."""
+
+        BaseCog.check_not_private(self, context)
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+
+        await self.bot.post_message(context, self.bot.bot_channel, '```' + self.render_stats() + '```')
+
+
+    def render_stats(self):
+        """Render the bridge metrics as a table per bridge."""
+
+        def format_latency(histogram, fraction, labels):
+            latency = histogram.quantile(fraction, *labels)
+            if latency is None:
+                return '-'
+            if latency == float('inf'):
+                return '>' + '{:g}'.format(histogram.buckets[-1]) + 's'
+            return '<' + '{:g}'.format(latency) + 's'
+
+        result = ''
+        for bridge_index, bridge in enumerate(self.bridges):
+            cache = self.message_cache[bridge_index] if bridge_index < len(self.message_cache) else None
+            if cache is None:
+                result += 'Bridge ' + str(bridge_index) + ': inactive' + linesep + linesep
+                continue
+
+            result += 'Bridge ' + str(bridge_index) + ' (' + str(len(cache)) + '/' + str(cache.maxlen) + ' messages cached)' + linesep
+            result += 'Channel          Sent  Chunks  Edits  Deletes  Failed  429s  Latency p50/p99   Wait p50/p99  Queue (max)' + linesep
+            for channel_id in bridge:
+                send_queue = self.send_queues.get(channel_id)
+                if send_queue is None:
+                    continue
+                labels = send_queue.labels
+                channel = self.bot.get_channel(channel_id)
+                channel_name = channel.name if channel is not None else str(channel_id)
+                result += channel_name[:15].ljust(15) + ' ' + str(self.forwarded_counter.get(*labels)).rjust(5) + ' ' + str(self.chunk_counter.get(*labels)).rjust(7) + ' ' + str(self.edit_counter.get(*labels)).rjust(6) + ' ' + str(self.delete_counter.get(*labels)).rjust(8) + ' ' + str(self.failure_counter.get(*labels)).rjust(7) + ' ' + str(self.rate_limit_counter.get(*labels)).rjust(5) + ' ' + (format_latency(self.forward_latency, 0.5, labels) + '/' + format_latency(self.forward_latency, 0.99, labels)).rjust(16) + ' ' + (format_latency(self.send_wait, 0.5, labels) + '/' + format_latency(self.send_wait, 0.99, labels)).rjust(14) + ' ' + (str(send_queue.depth()) + ' (' + str(send_queue.max_depth) + ')').rjust(12) + linesep
+            result += linesep
+
+        lookups = self.reply_cache.hits + self.reply_cache.misses
+        result += 'Reply cache: ' + str(len(self.reply_cache)) + '/' + str(self.reply_cache.max_size) + ' messages, ' + str(self.reply_cache.hits) + '/' + str(lookups) + ' hits, ' + str(self.reply_cache.fetches) + ' fetches'
+        return result
 
 
     async def on_message(self, message):
         """React to messages. Called by bot client."""
 
         # NOTE: exceptions are caught by calling function
+        # Most messages are not in bridged channels, so reject those before doing anything else
+        webhook_entry = self.webhooks.get(message.channel.id)
+        if webhook_entry is None:
+            return
+
+        # Make sure this is not one of our connected webhooks posting (else we'd endlessly ping-pong the same message)
+        if message.webhook_id in self.webhook_ids:
+            return
+
         if message.type not in [discord.MessageType.default, discord.MessageType.reply]:
             # Ignore system messages
             return
 
         if int(message.author.id) != int(self.bot_id) or self.inconsistency_text not in message.content:
-            webhook_entry = self.webhooks.get(message.channel.id)
-            if webhook_entry:
-                # Make sure this is not one of our connected webhooks posting (else we'd endlessly ping-pong the same message)
-                if message.webhook_id:
-                    for channel_id, (webhook, bridge_index) in self.webhooks.items():
-                        if message.webhook_id == webhook.id:
-                            return
+            # This channel is bridged, so we broadcast the message to all linked channels
+            try:
+                await self.broadcast_message(message, webhook_entry[1])
+            except Exception as e:
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** A critical error occurred while broadcasting a message on server bridge (top level). Check logs. ' + config.additional_error_message)
 
-                # This channel is bridged, so we broadcast the message to all linked channels
-                try:
-                    await self.broadcast_message(message, webhook_entry[1])
-                except Exception as e:
-                    log.exception(e)
-                    await self.bot.log_channel.send('**[ERROR]** A critical error occurred while broadcasting a message on server bridge (top level). Check logs. ' + config.additional_error_message)
 
+    def expect_pin_echo(self, message_id, pinned):
+        """Remember that we are about to pin or unpin a message so that the resulting edit event can be ignored."""
 
-    async def pin_or_unpin_message(self, message_id, channel_id, original_message):
-        """Pin or unpin a message in a specific channel."""
-        try:
-            channel = self.bot.get_channel(channel_id)
-            if not channel:
-                raise ValueError('Failed to find channel with id ' + str(channel_id))
-
-            message = await channel.fetch_message(message_id)
-            if not message:
-                raise ValueError('Failed to find webhook message with id ' + str(message_id))
-
-            if original_message.pinned and not message.pinned:
-                await message.pin()
-            elif not original_message.pinned and message.pinned:
-                await message.unpin()
-        except Exception as e:
-            log.exception(e)
-            await self.bot.log_channel.send('**[ERROR]** Critical error trying to pin/unpin message in channel ' + str(channel_id) + ' ' + config.additional_error_message)
+        key = (message_id, pinned)
+        count, deadline = self.pin_echoes.pop(key, (0, 0))
+        self.pin_echoes[key] = (count + 1, time.monotonic() + self.pin_echo_timeout)
+        while len(self.pin_echoes) > self.max_pin_echoes:
+            self.pin_echoes.popitem(last=False)
+
+
+    def consume_pin_echo(self, message_id, pinned):
+        """Check whether a pin status change was caused by the bridge itself. Echoes that never arrived (e.g. because the pin failed or didn't change anything) expire."""
+
+        key = (message_id, pinned)
+        count, deadline = self.pin_echoes.get(key, (0, 0))
+        if count == 0:
+            return False
+
+        if count == 1:
+            del self.pin_echoes[key]
+        else:
+            self.pin_echoes[key] = (count - 1, deadline)
+        return time.monotonic() < deadline
+
+
+    async def pin_or_unpin_messages(self, message_ids, channel_id, pinned):
+        """Pin or unpin messages in a specific channel. Partial messages are used, so only one request per message is made."""
+
+        channel = self.bot.get_channel(channel_id)
+        if not channel:
+            self.bot.post_log('**[ERROR]** Failed to find channel with id ' + str(channel_id) + ' to pin/unpin messages. ' + config.additional_error_message)
+            return
+
+        for message_id in message_ids:
+            self.expect_pin_echo(message_id, pinned)
+            try:
+                message = channel.get_partial_message(message_id)
+                if pinned:
+                    await message.pin()
+                else:
+                    await message.unpin()
+            except discord.errors.NotFound:
+                # Deleted in the meantime, or unpinning a message that isn't pinned
+                self.consume_pin_echo(message_id, pinned)
+            except Exception as e:
+                self.consume_pin_echo(message_id, pinned)
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** Critical error trying to pin/unpin message in channel ' + str(channel_id) + ' ' + config.additional_error_message)
 
 
     async def handle_changed_pin_status(self, message, bridge_index):
-        """Pin or unpin a message in all channels of a server bridge."""
+        """Pin or unpin a message in all channels of a server bridge. Channels are handled concurrently."""
 
         # NOTE: top-level exceptions are caught by calling function
 
-        for i, cached_message in enumerate(self.message_cache[bridge_index]):
-            if cached_message.find_message(message.id) or cached_message.find_message_for_reply(message.id):
-                index = i
+        if self.consume_pin_echo(message.id, message.pinned):
+            return
 
-                # Found message in our cache, now pin/unpin all webhook messages associated with this:
-                for (webhook_message_id, channel_id) in cached_message.webhook_message_ids:
-                    await self.pin_or_unpin_message(webhook_message_id, channel_id, message)
+        # Pins can be done on the original message or any of the webhook messages forwarding it
+        entry = self.message_index.get(message.id)
+        cached_message = entry[1] if entry is not None else None
+        if cached_message is None:
+            for item in self.message_cache[bridge_index]:
+                if item.find_message_for_reply(message.id):
+                    cached_message = item
+                    break
 
-                # Also try to pin or unpin the message itself it the pin/unpin was done on a webhook message:
-                await self.pin_or_unpin_message(cached_message.message_id, cached_message.channel_id, message)
+        if cached_message is None or cached_message.pinned == message.pinned:
+            return
+        cached_message.pinned = message.pinned
 
-                # Found and handled the message, we are done
-                break
+        # Pin or unpin all other messages associated with this, including the original message if the pin/unpin was done on a webhook message
+        message_ids_per_channel = {}
+        for message_id, channel_id in [(cached_message.message_id, cached_message.channel_id)] + cached_message.webhook_message_ids:
+            if message_id != message.id:
+                message_ids_per_channel.setdefault(channel_id, []).append(message_id)
+
+        await asyncio.gather(*[self.pin_or_unpin_messages(message_ids, channel_id, message.pinned) for channel_id, message_ids in message_ids_per_channel.items()])
 
     async def broadcast_message(self, message, bridge_index):
         """Broadcast a message to all subscribers in a server bridge."""
@@ -243,14 +776,12 @@ class ServerBridge(BaseCog):
         bridge = self.bridges[bridge_index]
         
         # NOTE: exceptions are caught by calling function
-        wait = True
-        tts = False
-        embeds = []
-        allowed_mentions = discord.AllowedMentions(everyone=False, users=True, roles=False, replied_user=False)
+        message_cache_item = MessageCacheItem(message.id, message.channel.id)
+        self.reply_cache.put(message.id, ReplyAuthorInfo.from_message(message))
 
-        # Images are just pasted after the message contents to show up via discord's built-in expansion
-        # NOTE: gen_text is actually abused by fallback error messages and reply mentions as well
-        gen_text = ''
+        # Start downloading attachments right away so that the send queues don't have to wait as long; one download is shared by all channels
+        rehosted_attachments = self.start_rehosting(message, len(bridge) - 1)
+        message_cache_item.rehosted_attachment_ids = [rehosted_attachment.attachment.id for rehosted_attachment in rehosted_attachments]
 
         # =====
         # NOTE: Since pinging replies are disabled, these should stay None throughout this function!
@@ -259,15 +790,24 @@ class ServerBridge(BaseCog):
         # =====
 
         # NOTE: We build the reply embed before collecting attachments since we might add the @<author> bit towards the end of the message contents, so the quote has to come first if it exists
-        reference_author = await self.get_reference_author_with_reply_embeds(message, embeds, reference_author_mention, channel_with_mention)
-        embeds.extend(message.embeds)
+        # The reply embed is kept with the cached message since a reply can never change its reference, so edits can re-use it.
+        reference_author = await self.get_reference_author_with_reply_embeds(message, message_cache_item.reply_embeds, reference_author_mention, channel_with_mention)
+        message_cache_item.reference_author = reference_author
 
         # Assemble a list of URLs and embeds to represent images and other attachments
-        gen_text += await self.collect_attachments(message, embeds)
+        # Images are just pasted after the message contents to show up via discord's built-in expansion
+        # NOTE: gen_text is actually abused by fallback error messages and reply mentions as well
+        embeds, gen_text = await self.collect_embeds(message, message_cache_item)
 
-        message_cache_item = MessageCacheItem(message.id, message.channel.id)
+        # Only plain short text messages may be merged with other messages in the send queues
+        coalescible = not embeds and not gen_text and not message.attachments and not (message.reference and message.reference.message_id) and len(message.clean_content) <= self.coalesce_max_length
 
-        # Broadcast the message.
+        if message.author.display_avatar is not None:
+            avatar_url = message.author.display_avatar.url
+        else:
+            avatar_url = None
+
+        # Broadcast the message. This only queues the message for every channel, the actual sending is done by the send queue workers.
         for channel_id in bridge:
             try:
                 # This is the channel the message was posted in, skip
@@ -288,27 +828,62 @@ class ServerBridge(BaseCog):
                 else:
                     gen_text_with_reference = gen_text
 
-                channel_webhook = self.webhooks.get(channel_id)[0]
-                if message.author.display_avatar is not None:
-                    await self.send_with_webhook(channel_webhook, wait, message.author.display_name, message.author.display_avatar.url, tts, embeds, allowed_mentions, gen_text_with_reference, message, message_cache_item)
-                else:
-                    await self.send_with_webhook(channel_webhook, wait, message.author.display_name, None, tts, embeds, allowed_mentions, gen_text_with_reference, message, message_cache_item)
+                self.send_queues[channel_id].put(QueuedWebhookSend(message, message_cache_item, message.author.display_name, avatar_url, embeds, gen_text_with_reference, coalescible, rehosted_attachments))
             except Exception as e:
                 log.exception(e)
-                await self.bot.log_channel.send('**[ERROR]** A critical error occurred while forwarding a message on server bridge (low level) to channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                self.bot.post_log('**[ERROR]** A critical error occurred while forwarding a message on server bridge (low level) to channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
             # Now keep trying to send this message to the other channels if any remain
 
         try:
-            # Record any messages that we were able to send. Even if any of the above calls threw, we still want to be able to work with other messages that were sent successfully so those can be deleted, edited or replied to
-            if message_cache_item.webhook_message_ids:
-                self.message_cache[bridge_index].appendleft(message_cache_item)
-                # Debug code:
-                #print('================== POST SEND ' + str(bridge_index))
-                #for mci in self.message_cache[bridge_index]:
-                #    print(str(mci.message_id) + ', ' + str(mci.channel_id) + ', ' + str(mci.webhook_message_ids))
+            # Record the message right away. The webhook message ids are filled in by the send queues once the message was actually sent, and since edits and deletes go through the same queues, they will always see them.
+            self.cache_message(bridge_index, message_cache_item)
+            # Debug code:
+            #print('================== POST SEND ' + str(bridge_index))
+            #for mci in self.message_cache[bridge_index]:
+            #    print(str(mci.message_id) + ', ' + str(mci.channel_id) + ', ' + str(mci.webhook_message_ids))
         except Exception as e:
             log.exception(e)
-            await self.bot.log_channel.send('**[ERROR]** Failed to cache message ' + str(message.id) + ' in channel ' + str(message.channel.name) + ' ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** Failed to cache message ' + str(message.id) + ' in channel ' + str(message.channel.name) + ' ' + config.additional_error_message)
+
+
+    def start_rehosting(self, message, users):
+        """Start downloading all attachments of _message_ that can be re-hosted. Returns a list of RehostedAttachment items, one per attachment, to be shared by _users_ destination channels."""
+
+        rehosted_attachments = []
+        if not self.rehost_attachments or users < 1:
+            return rehosted_attachments
+
+        for attachment in message.attachments:
+            # Too large files are not even attempted; like everything beyond the per-message file limit, they are forwarded as links
+            if len(rehosted_attachments) >= self.max_files or attachment.size > self.rehost_max_size:
+                continue
+
+            rehosted_attachment = RehostedAttachment(attachment, users)
+            rehosted_attachment.task = self.bot.loop.create_task(rehosted_attachment.download(self.bot.http_session, self.rehost_semaphore, self.rehost_max_size, self.rehost_spool_size))
+            rehosted_attachments.append(rehosted_attachment)
+
+        return rehosted_attachments
+
+
+    def cache_message(self, bridge_index, message_cache_item):
+        """Add a message to the cache of a bridge, keeping the id index in sync with the deque (which silently drops its oldest element once full)."""
+
+        cache = self.message_cache[bridge_index]
+        if len(cache) == cache.maxlen:
+            evicted = cache.pop()
+            self.message_index.pop(evicted.message_id, None)
+
+        cache.appendleft(message_cache_item)
+        self.message_index[message_cache_item.message_id] = (bridge_index, message_cache_item)
+
+
+    def uncache_message(self, bridge_index, message_cache_item):
+        # O(n) again, but we don't do this too often
+        try:
+            self.message_cache[bridge_index].remove(message_cache_item)
+        except ValueError:
+            pass
+        self.message_index.pop(message_cache_item.message_id, None)
 
 
     async def get_reference_author_with_reply_embeds(self, message, embeds, reference_author_mention, channel_with_mention):
@@ -321,9 +896,14 @@ class ServerBridge(BaseCog):
             created_at = None
 
             try:
-                reference_message = message.reference.cached_message
-                if not reference_message:
-                    reference_message = await message.channel.fetch_message(message.reference.message_id)
+                reference_info = self.reply_cache.get(message.reference.message_id)
+                reference_message = None
+                if reference_info is None:
+                    # Not a recently bridged message; try discord.py's cache before asking the API
+                    reference_message = message.reference.cached_message
+                    if not reference_message:
+                        self.reply_cache.fetches += 1
+                        reference_message = await message.channel.fetch_message(message.reference.message_id)
 
                 if reference_message:
                     # User is replying to a forwarded message, hence we should ping the actual author of the original one (but only in the respective channel...)
@@ -345,27 +925,23 @@ class ServerBridge(BaseCog):
                                     #break
                         #except Exception as e:
                             #log.exception(e)
-                            #await self.bot.log_channel.send('**[WARNING]** Failed to mention author on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                            #self.bot.post_log('**[WARNING]** Failed to mention author on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
                             ## NOTE: reference_author_mention is now None, so we use the default one that doesn't ping
 
-                    if reference_message.author.name:
-                        reference_author = reference_message.author.name
-                    if reference_message.author.avatar.url:
-                        avatar_url = reference_message.author.avatar.url
-                    created_at = reference_message.created_at
-                    if reference_message.content:
-                        chunk_size = 256 # This is not the actual character limit for embed descriptions, but we don't want the reply to become too bloated
-
-                        # Use clean content to avoid mentions in the original message tagging people on replies
-                        if len(reference_message.content) <= chunk_size:
-                            quoted_content = reference_message.clean_content
-                        else:
-                            quoted_content = reference_message.clean_content[:chunk_size - 3] + '...'
+                    reference_info = ReplyAuthorInfo.from_message(reference_message)
+                    self.reply_cache.put(reference_message.id, reference_info)
+
+                if reference_info:
+                    if reference_info.author_name:
+                        reference_author = reference_info.author_name
+                    avatar_url = reference_info.avatar_url
+                    created_at = reference_info.created_at
+                    quoted_content = reference_info.quoted_content
             except discord.errors.NotFound as e:
                 quoted_content = '_<This message was deleted>_'
             except Exception as e:
                 log.exception(e)
-                await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to collect info for reply embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                self.bot.post_log('**[ERROR]** A critical error occurred while trying to collect info for reply embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
                 quoted_content = '_<The message referenced by this reply could not be forwarded due to an internal error>_'
             finally:
                 try:
@@ -380,12 +956,32 @@ class ServerBridge(BaseCog):
                     embeds.append(quote_embed)
                 except Exception as e:
                     log.exception(e)
-                    await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to build reply embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                    self.bot.post_log('**[ERROR]** A critical error occurred while trying to build reply embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
 
         return reference_author
 
-    async def collect_attachments(self, message, embeds):
-        """Utility function re-used by edits. Returns generated text containing links to append to the message when being forwarded. _embeds_ is also an OUTPUT."""
+    async def collect_embeds(self, message, message_cache_item):
+        """Returns the full list of embeds (reply, original embeds, attachments) and the generated text to forward _message_ with. The result is stored in _message_cache_item_ and re-used as long as the embeds and attachments of the message do not change, which is the usual case for edits."""
+
+        source_embeds = [embed.to_dict() for embed in message.embeds]
+        attachment_ids = [attachment.id for attachment in message.attachments]
+
+        if message_cache_item.attachment_ids == attachment_ids and message_cache_item.source_embeds == source_embeds:
+            return message_cache_item.embeds, message_cache_item.attachment_text
+
+        embeds = list(message_cache_item.reply_embeds)
+        embeds.extend(message.embeds)
+        gen_text = await self.collect_attachments(message, embeds, message_cache_item.rehosted_attachment_ids)
+
+        message_cache_item.source_embeds = source_embeds
+        message_cache_item.attachment_ids = attachment_ids
+        message_cache_item.attachment_text = gen_text
+        message_cache_item.embeds = embeds
+        return embeds, gen_text
+
+
+    async def collect_attachments(self, message, embeds, rehosted_attachment_ids=()):
+        """Utility function re-used by edits. Returns generated text containing links to append to the message when being forwarded. _embeds_ is also an OUTPUT. Attachments in _rehosted_attachment_ids_ are uploaded as files and therefore skipped."""
 
         auto_generated = ''
         gen_text = ''
@@ -394,6 +990,9 @@ class ServerBridge(BaseCog):
         try:
             if message.attachments:
                 for attachment in message.attachments:
+                    if attachment.id in rehosted_attachment_ids:
+                        continue
+
                     # Images can be embedded by discord
                     if attachment.content_type and attachment.content_type.startswith('image'):
                         gen_text += attachment.url + '\n'
@@ -402,14 +1001,14 @@ class ServerBridge(BaseCog):
                         auto_generated += attachment.url + '\n'
         except Exception as e:
             log.exception(e)
-            await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to build list of attachment URLs on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** A critical error occurred while trying to build list of attachment URLs on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
             try:
                 error_embed = discord.Embed()
                 error_embed.description = '_<The original message contains attachments that could not be forwarded due to an internal error>_'
                 embeds.append(error_embed)
             except Exception as e:
                 log.exception(e)
-                await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to build attachment error embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                self.bot.post_log('**[ERROR]** A critical error occurred while trying to build attachment error embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
                 gen_text += '_<The original message contains attachments that could not be forwarded due to an internal error>_\n'
 
         # Build the URL embeds
@@ -436,7 +1035,7 @@ class ServerBridge(BaseCog):
                             # We don't know where the next url starts so just abort and tell everyone that the rest of the attachments is missing
                             attachments_embed.add_field(name='Attachments (auto-generated, pt. ' + str(j+1) + '):', value='<missing some attachments due to an internal error>', inline=True)
                             embeds.append(attachments_embed)
-                            await self.bot.log_channel.send('**[WARNING]** Attachment URL is longer than maximum size of an embed field! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+                            self.bot.post_log('**[WARNING]** Attachment URL is longer than maximum size of an embed field! ' + str(message.channel.name) + ' ' + config.additional_error_message)
                             break
                         if newline < i+chunk_size-1:
                             # We are trying to split in the middle of an url, don't do that
@@ -453,20 +1052,20 @@ class ServerBridge(BaseCog):
                         embeds.append(attachments_embed)
         except Exception as e:
             log.exception(e)
-            await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to build attachment list embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** A critical error occurred while trying to build attachment list embed on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
             try:
                 error_embed = discord.Embed()
                 error_embed.description = '_<The original message contains attachments that could not be forwarded due to an internal error>_'
                 embeds.append(error_embed)
             except Exception as e:
                 log.exception(e)
-                await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to build attachment error embed (non-image) on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                self.bot.post_log('**[ERROR]** A critical error occurred while trying to build attachment error embed (non-image) on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
                 gen_text += '_<The original message contains attachments that could not be forwarded due to an internal error>_\n'
 
         # Discord has a hard limit of 10 embeds per message
         max_embeds = 10
         if len(embeds) > max_embeds:
-            await self.bot.log_channel.send('**[WARNING]** Someone sent a message that resulted in more than ' + str(max_embeds) + ' embeds! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+            self.bot.post_log('**[WARNING]** Someone sent a message that resulted in more than ' + str(max_embeds) + ' embeds! ' + str(message.channel.name) + ' ' + config.additional_error_message)
             try:
                 #embeds = embeds[:max_embeds-1] # NOTE: This ceased to work when I moved this whole logic into a function, see alternative below:
                 while len(embeds) > max_embeds:
@@ -479,14 +1078,14 @@ class ServerBridge(BaseCog):
                 embeds.append(error_embed)
             except Exception as e:
                 log.exception(e)
-                await self.bot.log_channel.send('**[ERROR]** A critical error occurred while trying to cut down embeds to max length on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
+                self.bot.post_log('**[ERROR]** A critical error occurred while trying to cut down embeds to max length on channel ' + str(message.channel.name) + '. Check logs. ' + config.additional_error_message)
                 gen_text += '_<Warning: This message is incomplete due to an internal error>_\n'
 
         return gen_text
 
 
-    async def send_with_webhook(self, webhook, wait, username, avatar_url, tts, embeds, allowed_mentions, gen_text, message, message_cache_item):
-        """Forward a message using a webhook."""
+    async def send_with_webhook(self, webhook, wait, username, avatar_url, tts, embeds, allowed_mentions, gen_text, message, message_cache_item, files=None):
+        """Forward a message using a webhook. Re-hosted attachment _files_ are uploaded with the last message."""
         out_messages = []
         posted_anything = False
 
@@ -496,286 +1095,480 @@ class ServerBridge(BaseCog):
             if out_messages:
                 if len(out_messages) > 1:
                     for msg in out_messages[:-1]:
-                        await self.send_with_webhook_internal(webhook=webhook, content=msg, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=embeds, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message)
+                        await self.send_with_webhook_internal(webhook=webhook, content=msg, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=[], allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message, rendered=message_cache_item.rendered)
                         posted_anything = True
 
                 # Last message carries the embeds
-                await self.send_with_webhook_internal(webhook=webhook, content=out_messages[-1], wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=embeds, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message)
+                await self.send_with_webhook_internal(webhook=webhook, content=out_messages[-1], wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=embeds, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message, rendered=message_cache_item.rendered, files=files)
                 posted_anything = True # Not strictly necessary, but probably good practice
             elif embeds:
-                await self.send_with_webhook_internal(webhook=webhook, content=message.clean_content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=embeds, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message)
+                await self.send_with_webhook_internal(webhook=webhook, content=message.clean_content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=None, embeds=embeds, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message, rendered=message_cache_item.rendered, files=files)
                 posted_anything = True # Not strictly necessary, but probably good practice
             else:
                 raise ValueError('No messages and embeds to send after splitting!')
 
         # Catch exceptions here to let people know that the message was incomplete; if this fails (i.e. throws), we still get the log
         except Exception as e:
+            self.count(self.failure_counter, webhook.channel_id)
             log.exception(e)
-            await self.bot.log_channel.send('**[ERROR]** Critical error occurred while posting messages! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** Critical error occurred while posting messages! ' + str(message.channel.name) + ' ' + config.additional_error_message)
             error_embed = discord.Embed()
             error_embed.description = '_<The original message contains some content that could not be forwarded due to an internal error>_'
             # If we sent nothing due to an exception, we should still send the original content together with the error embed so that at least the message itself is forwarded.
             except_message_content = message.clean_content if not posted_anything else ''
-            await self.send_with_webhook_internal(webhook=webhook, content=except_message_content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=error_embed, embeds=None, allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message)
+            await self.send_with_webhook_internal(webhook=webhook, content=except_message_content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=error_embed, embeds=[], allowed_mentions=allowed_mentions, sent_webhook_messages=message_cache_item.webhook_message_ids, message=message, rendered=message_cache_item.rendered)
 
 
     async def split_message(self, embeds, gen_text, message, out_messages):
-        """Split a message in case it has too many characters."""
+        """Split a message in case it has too many characters. Only the last chunk will be sent with the embeds."""
 
         # NOTE: exceptions are caught by calling function
+        out_messages.extend(split_text(message.clean_content + '\n' + gen_text, self.chunk_size))
 
-        chunk_size = 2000
-        final_content = message.clean_content + '\n' + gen_text
 
-        if len(final_content) <= chunk_size:
-            # No splitting required, this message will be sent with all the embeds
-            out_messages.append(final_content)
-        else:
-            # Too large, has to be split
-            increment = chunk_size
-            i = 0
-            while i < len(final_content):
-                chunk = final_content[i:i+increment]
-                newline = chunk.rfind('\n')
-                if newline == -1 or newline >= i+chunk_size-1:
-                    # len(final_content) - 1 = x + i
-                    increment = min(chunk_size, len(final_content) - 1 - i)
-                else:
-                    # We are trying to split in the middle of an url, don't do that
-                    chunk = final_content[i:i+newline]
-                    increment = newline + 1
-                i += increment
-                if chunk:
-                    out_messages.append(chunk)
+    async def send_webhook_message(self, webhook, **kwargs):
+        """Send a message with a webhook. discord.py already waits out regular 429s internally; if it gives up, wait for the advertised time and try again. If our webhook was deleted, it is re-created. Since this is only ever called from a send queue worker, this stalls the queue of this webhook only."""
+
+        attempts = 0
+        while True:
+            try:
+                # Files may have been read by a previous attempt
+                for file in kwargs.get('files', []):
+                    file.reset()
+                return await webhook.send(**kwargs)
+            except discord.errors.NotFound as e:
+                # 10015: Unknown Webhook, i.e. someone deleted our webhook. Replace it once, then give up.
+                if e.code != 10015 or attempts >= config.repost_attempts:
+                    raise e
+
+                attempts += 1
+                webhook = await self.recreate_webhook(webhook)
+            except discord.errors.HTTPException as e:
+                if e.status != 429 or attempts >= config.repost_attempts:
+                    raise e
+
+                attempts += 1
+                send_queue = self.send_queues.get(webhook.channel_id)
+                if send_queue:
+                    self.rate_limit_counter.inc(*send_queue.labels)
+
+                retry_after = 1.0
+                try:
+                    retry_after = float(e.response.headers.get('Retry-After', retry_after))
+                except Exception:
+                    pass
+                log.warning('Webhook in channel ' + str(webhook.channel_id) + ' is rate limited, retrying in ' + str(retry_after) + ' seconds.')
+                await asyncio.sleep(retry_after)
 
 
-    async def send_with_webhook_internal(self, webhook, content, wait, username, avatar_url, tts, embed, embeds, allowed_mentions, sent_webhook_messages, message):
-        """Sends a message with a webhook. No splicing of content to handle oversized messages."""
+    async def send_with_webhook_internal(self, webhook, content, wait, username, avatar_url, tts, embed, embeds, allowed_mentions, sent_webhook_messages, message, rendered=None, files=None):
+        """Sends a message with a webhook. No splicing of content to handle oversized messages. If _rendered_ is given, the content and embeds of the sent message are recorded there for diffing later edits."""
+        sent_embeds = None
         try:
             if len(embeds) == 0 and embed is not None:
                 embeds = [embed]
-            webhook_message = await webhook.send(content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embeds=embeds, allowed_mentions=allowed_mentions)
+            sent_embeds = embeds
+            webhook_message = await self.send_webhook_message(webhook, content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embeds=embeds, allowed_mentions=allowed_mentions, files=files or [])
         except discord.errors.HTTPException as e:
+            sent_embeds = None # We don't know exactly what we ended up sending, so the next edit must overwrite the embeds in any case
+
             # Discord has a hard limit of 6000 characters across all embeds (including title, description, ...)
             if 'Invalid Form Body' in str(e):
                 log.exception(e)
-                await self.bot.log_channel.send('**[WARNING]** Someone sent a message that resulted in a 400 invalid form body! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+                self.bot.post_log('**[WARNING]** Someone sent a message that resulted in a 400 invalid form body! ' + str(message.channel.name) + ' ' + config.additional_error_message)
 
                 # If this message had embeds, try sending without them but post an error (since this is likely due to the 6000 character across all embeds limit)
                 if embeds is not None and len(embeds) > 0:
                     error_embed = discord.Embed()
                     error_embed.description = '_<The original message contains some additional non-text elements that could not be forwarded due to an internal error>_'
                     try:
-                        webhook_message = await webhook.send(content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=error_embed, allowed_mentions=allowed_mentions)
+                        webhook_message = await self.send_webhook_message(webhook, content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, embed=error_embed, allowed_mentions=allowed_mentions, files=files or [])
                     except Exception as e:
                         log.exception(e)
-                        await self.bot.log_channel.send('**[ERROR]** Critical error occurred while trying to send invalid form body error message! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+                        self.bot.post_log('**[ERROR]** Critical error occurred while trying to send invalid form body error message! ' + str(message.channel.name) + ' ' + config.additional_error_message)
                         # Tough luck, try without any embeds
-                        webhook_message = await webhook.send(content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, allowed_mentions=allowed_mentions)
+                        webhook_message = await self.send_webhook_message(webhook, content=content, wait=wait, username=username, avatar_url=avatar_url, tts=tts, allowed_mentions=allowed_mentions, files=files or [])
             else:
                 raise e
 
         # Not sure if this can actually happen
         if not webhook_message:
-            await self.bot.log_channel.send('**[ERROR]** Sent message via webhook without exception, but the message is NONE! ' + str(message.channel.name) + ' ' + config.additional_error_message)
+            self.bot.post_log('**[ERROR]** Sent message via webhook without exception, but the message is NONE! ' + str(message.channel.name) + ' ' + config.additional_error_message)
         else:
             sent_webhook_messages.append((webhook_message.id, webhook_message.channel.id))
+            self.count(self.chunk_counter, webhook_message.channel.id)
+
+            # Replies to the forwarded message quote the original one
+            reference_info = self.reply_cache.items.get(message.id)
+            if reference_info is not None:
+                self.reply_cache.put(webhook_message.id, reference_info)
+
+            if rendered is not None:
+                rendered[webhook_message.id] = (content, [e.to_dict() for e in sent_embeds] if sent_embeds is not None else None)
 
 
     async def on_message_edit(self, before, after):
         """React to edited messages. Called by bot client."""
 
         # NOTE: exceptions are caught by calling function
+        await self.handle_message_edit(after, before.pinned != after.pinned)
+
+
+    async def on_raw_message_edit(self, payload):
+        """React to edited messages that are not in discord.py's message cache (e.g. older ones), as long as our own cache still knows them. Called by bot client."""
+
+        # NOTE: exceptions are caught by calling function
+        if payload.cached_message is not None:
+            # Already handled by on_message_edit
+            return
+
+        if payload.channel_id not in self.webhooks:
+            return
+
+        entry = self.message_index.get(payload.message_id)
+        if entry is None:
+            return
+
+        after = await self.message_from_raw_edit(payload)
+        if after is not None:
+            await self.handle_message_edit(after, after.pinned != entry[1].pinned or (after.id, after.pinned) in self.pin_echoes)
+
+
+    async def message_from_raw_edit(self, payload):
+        """Build the edited message from the gateway payload. The message is only fetched if the payload is incomplete."""
+
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel is None:
+            return None
+
+        try:
+            return discord.Message(state=channel._state, channel=channel, data=payload.data)
+        except KeyError:
+            return await channel.fetch_message(payload.message_id)
+
+
+    async def handle_message_edit(self, after, pin_changed):
+        """Mirror an edit (or pin/unpin) of a bridged message."""
+
         if int(after.author.id) != int(self.bot_id):
             webhook_entry = self.webhooks.get(after.channel.id)
             if webhook_entry:
                 author_name = str(after.author.display_name)
                 if not author_name:
-                    await self.bot.log_channel.send('**[ERROR]** Unknown author, rejecting edit on message in ' + str(after.channel.name) + ' ' + config.additional_error_message)
+                    self.bot.post_log('**[ERROR]** Unknown author, rejecting edit on message in ' + str(after.channel.name) + ' ' + config.additional_error_message)
                     return
 
                 bridge_index = webhook_entry[1]
 
                 # This is a pin/unpin event, handle only this aspect of it
-                if before.pinned != after.pinned:
+                if pin_changed:
                     try:
                         await self.handle_changed_pin_status(after, bridge_index)
                     except Exception as e:
                         log.exception(e)
-                        await self.bot.log_channel.send('**[ERROR]** Failed to pin/unpin message in channel ' + str(after.channel.name) + ' ' + config.additional_error_message)
+                        self.bot.post_log('**[ERROR]** Failed to pin/unpin message in channel ' + str(after.channel.name) + ' ' + config.additional_error_message)
 
                     return
 
                 # Make sure this is not one of our connected webhooks editing
-                if after.webhook_id:
-                    for channel_id, (webhook, bridge_index) in self.webhooks.items():
-                        if after.webhook_id == webhook.id:
-                            return
-
-                gen_text = ''
-                embeds = []
-
-                # =====
-                # NOTE: Since pinging replies are disabled, these should stay None throughout this function!
-                reference_author_mention = None
-                channel_with_mention = None # If we should ping a user in a channel, this will be set to the channel id
-                # =====
-
-                # NOTE: We build the reply embed before collecting attachments since we might add the @<author> bit towards the end of the message contents, so the quote has to come first if it exists
-                reference_author = await self.get_reference_author_with_reply_embeds(after, embeds, reference_author_mention, channel_with_mention)
-                embeds.extend(after.embeds)
-                gen_text += await self.collect_attachments(after, embeds)
-
-                # Try to find the cached message so that we know which webhook messages we need to edit
-                for cached_message in self.message_cache[bridge_index]:
-                    if cached_message.find_message(after.id):
-                        out_messages = []
-
-                        # Replies prepend the original author's name similar to Matrix bridge
-                        # The only time we want to include an actual mention is when a user replies to the bot (indicated by reference_author_mention being something other than None) - NOTE: This behavior is currently DISABLED! TODO: If there is ever a way to find out if a reply is pinging or not, this needs to be adjusted to work like the code in broadcast_message!
-                        if after.reference and after.reference.message_id:
-                            gen_text += '\n(@' + reference_author + ')\n'
-
-                        # Found this message in the cache, so we know we can edit its counterparts.
-                        await self.split_message(embeds, gen_text, after, out_messages)
-
-                        if not out_messages:
-                            await self.bot.log_channel.send('**[ERROR]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' is empty, rejecting. ' + config.additional_error_message)
-                            return
-
-                        allowed_mentions = discord.AllowedMentions(everyone=False, users=True, roles=False, replied_user=False)
-
-                        # Go through all channels in this bridge, collect all messages posted in each respective channel, and try to fill them with the new content
-                        for channel_id in self.bridges[bridge_index]:
-                            if channel_id == after.channel.id:
-                                continue
-
-                            try:
-                                message_list = [y[0] for y in list(filter(lambda x: (x[1] == channel_id), cached_message.webhook_message_ids))]
-
-                                if not message_list:
-                                    await self.bot.log_channel.send('**[ERROR]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' found no messages, rejecting. ' + config.additional_error_message)
-                                    continue
-
-                                channel_webhook = self.webhooks.get(channel_id)[0]
-
-                                if len(out_messages) != len(message_list):
-                                    await self.bot.log_channel.send('**[WARNING]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' has ' + str(len(out_messages)) + ' to edit but ' + str(len(message_list)) + ' messages available. ' + config.additional_error_message)
-
-                                if len(out_messages) > len(message_list):
-                                    # We cannot insert new messages into the timeline in hindsight and if we just went with the message content we would lose some attachments.
-                                    # Therefore, we send an error embed to notify the user.
-                                    await self.bot.log_channel.send('**[ERROR]** Edit by ' + author_name + ' resulted in more messages than before! ' + str(after.channel.name) + ' ' + config.additional_error_message)
-
-                                    # Embed array needs to be copied so that the error embed is not duplicated for other channels.
-                                    embeds_copy = copy.copy(embeds)
-                                    error_embed = discord.Embed()
-                                    error_embed.description = '_<This message was edited and now exceeds the character limit. Please ask the original author to resend the text contents.>_'
-                                    embeds_copy.append(error_embed)
-
-                                    for index, webhook_message_id in enumerate(message_list[:-1]):
-                                        # We have more messages to send than messages to edit, so this needs to be checked
-                                        if index < len(out_messages):
-                                            updated_content = out_messages[index]
-
-                                            # Try to edit these but don't throw so that we can try getting the embeds through with the last message
-                                            try:
-                                                await channel_webhook.edit_message(webhook_message_id, content=updated_content, allowed_mentions=allowed_mentions)
-                                            finally:
-                                                pass
-
-                                    updated_content = out_messages[len(message_list)-1] # Last message that we can send...
-                                    webhook_message_id = message_list[-1] # Last webhook message we can use to edit in content
-
-                                    # Last message carries the embeds.
-                                    await channel_webhook.edit_message(webhook_message_id, content=updated_content, embeds=embeds_copy, allowed_mentions=allowed_mentions)
-                                else:
-                                    # Check if we need to delete any obsolete messages (text shrinked due to edit)
-                                    message_index = len(message_list) - 1
-
-                                    while len(out_messages) < len(message_list):
-                                        webhook_message_id = None
-                                        try:
-                                            webhook_message_id = message_list.pop()
-                                            cached_message.webhook_message_ids = [x for x in cached_message.webhook_message_ids if x[0] != webhook_message_id]
-                                            await channel_webhook.delete_message(webhook_message_id)
-                                        except Exception as e:
-                                            log.exception(e)
-                                            await self.bot.log_channel.send('**[ERROR]** Failed to delete message edited by ' + author_name + ' in channel ' + str(after.channel.name) + ' ' + config.additional_error_message)
-                                            if webhook_message_id:
-                                                error_embed = discord.Embed()
-                                                error_embed.description = '_<This message was edited out but could not be deleted.>_'
-                                                await channel_webhook.edit_message(webhook_message_id, content='', allowed_mentions=allowed_mentions, embed=error_embed)
-                                                # If anything here threw, we don't continue editing since we have too many messages
-
-                                    if len(out_messages) > 1:
-                                        for index, webhook_message_id in enumerate(message_list[:-1]):
-                                            # We might have more messages to send than messages to edit, so this needs to be checked
-                                            if index < len(out_messages):
-                                                updated_content = out_messages[index]
-                                                await channel_webhook.edit_message(webhook_message_id, content=updated_content, allowed_mentions=allowed_mentions)
-
-                                    # Last message carries the embeds
-                                    updated_content = out_messages[-1]
-                                    webhook_message_id = message_list[-1]
-                                    await channel_webhook.edit_message(webhook_message_id, content=updated_content, embeds=embeds, allowed_mentions=allowed_mentions)
-
-                            except Exception as e:
-                                log.exception(e)
-                                await self.bot.log_channel.send('**[ERROR]** Failed to edit message from channel ' + str(after.channel.name) + ' (author: ' + author_name + ') in channel ' + str(channel_id) + '. ' + config.additional_error_message)
-
-                        # Debug code:
-                        #print('================== POST EDIT ' + str(bridge_index))
-                        #for mci in self.message_cache[bridge_index]:
-                        #    print(str(mci.message_id) + ', ' + str(mci.channel_id) + ', ' + str(mci.webhook_message_ids))
-
-                        # Found our message, no need to search further
-                        break
+                if after.webhook_id in self.webhook_ids:
+                    return
+
+                # Keep quotes of this message in future replies up to date
+                self.reply_cache.update_content(after.id, after.clean_content)
+
+                # Try to find the cached message so that we know which webhook messages we need to edit. There is nothing to do for messages we don't know.
+                entry = self.message_index.get(after.id)
+                if entry is None:
+                    return
+                cached_message = entry[1]
+
+                # A reply can't change its reference, so the reply embed is always re-used. Embeds and attachment lists are only rebuilt if they changed.
+                embeds, gen_text = await self.collect_embeds(after, cached_message)
+                embed_dicts = [embed.to_dict() for embed in embeds]
+                out_messages = []
+
+                # Replies prepend the original author's name similar to Matrix bridge
+                # The only time we want to include an actual mention is when a user replies to the bot (indicated by reference_author_mention being something other than None) - NOTE: This behavior is currently DISABLED! TODO: If there is ever a way to find out if a reply is pinging or not, this needs to be adjusted to work like the code in broadcast_message!
+                if after.reference and after.reference.message_id:
+                    gen_text += '\n(@' + str(cached_message.reference_author) + ')\n'
+
+                # Found this message in the cache, so we know we can edit its counterparts.
+                await self.split_message(embeds, gen_text, after, out_messages)
+
+                if not out_messages:
+                    self.bot.post_log('**[ERROR]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' is empty, rejecting. ' + config.additional_error_message)
+                    return
+
+                # Go through all channels in this bridge and queue the edit of all messages posted in each respective channel
+                for channel_id in self.bridges[bridge_index]:
+                    if channel_id == after.channel.id:
+                        continue
+
+                    self.send_queues[channel_id].put(functools.partial(self.edit_forwarded_messages, cached_message, channel_id, out_messages, embeds, embed_dicts, after, author_name))
+
+
+    async def edit_forwarded_messages(self, cached_message, channel_id, out_messages, embeds, embed_dicts, after, author_name):
+        """Fill all webhook messages forwarded to one channel with the new contents of an edited message. Executed by the send queue of that channel."""
+
+        allowed_mentions = self.allowed_mentions
+        self.count(self.edit_counter, channel_id)
+
+        coalesced_message = cached_message.coalesced.get(channel_id)
+        if coalesced_message:
+            # This message shares its webhook message with others; re-render the shared one instead
+            try:
+                channel_webhook = self.webhooks.get(channel_id)[0]
+                coalesced_message.update_part(after.id, after.clean_content)
+                coalesced_message.set_embeds(after.id, embeds)
+                content = coalesced_message.render()
+                merged_embeds = coalesced_message.render_embeds()
+
+                if len(content) > self.chunk_size:
+                    # A merged message cannot be split in hindsight either, so send what fits and notify the user like for other messages
+                    self.bot.post_log('**[ERROR]** Edit by ' + author_name + ' made a merged message exceed the character limit! ' + str(after.channel.name) + ' ' + config.additional_error_message)
+                    error_embed = discord.Embed()
+                    error_embed.description = '_<This message was edited and now exceeds the character limit. Please ask the original author to resend the text contents.>_'
+                    content = content[:self.chunk_size]
+                    merged_embeds = merged_embeds[:CoalescedWebhookMessage.max_embeds - 1] + [error_embed]
+
+                await channel_webhook.edit_message(coalesced_message.webhook_message_id, content=content, embeds=merged_embeds, allowed_mentions=allowed_mentions)
+            except Exception as e:
+                self.count(self.failure_counter, channel_id)
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** Failed to edit merged message from channel ' + str(after.channel.name) + ' (author: ' + author_name + ') in channel ' + str(channel_id) + '. ' + config.additional_error_message)
+            return
+
+        try:
+            message_list = [y[0] for y in list(filter(lambda x: (x[1] == channel_id), cached_message.webhook_message_ids))]
+
+            if not message_list:
+                self.bot.post_log('**[ERROR]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' found no messages, rejecting. ' + config.additional_error_message)
+                return
+
+            channel_webhook = self.webhooks.get(channel_id)[0]
+
+            if len(out_messages) != len(message_list):
+                self.bot.post_log('**[WARNING]** Message edited by ' + author_name + ' on channel ' + str(after.channel.name) + ' has ' + str(len(out_messages)) + ' to edit but ' + str(len(message_list)) + ' messages available. ' + config.additional_error_message)
+
+            if len(out_messages) > len(message_list):
+                # We cannot insert new messages into the timeline in hindsight and if we just went with the message content we would lose some attachments.
+                # Therefore, we send an error embed to notify the user.
+                self.bot.post_log('**[ERROR]** Edit by ' + author_name + ' resulted in more messages than before! ' + str(after.channel.name) + ' ' + config.additional_error_message)
+
+                # Embed array needs to be copied so that the error embed is not duplicated for other channels.
+                embeds_copy = copy.copy(embeds)
+                error_embed = discord.Embed()
+                error_embed.description = '_<This message was edited and now exceeds the character limit. Please ask the original author to resend the text contents.>_'
+                embeds_copy.append(error_embed)
+
+                for index, webhook_message_id in enumerate(message_list[:-1]):
+                    # Try to edit these but don't throw so that we can try getting the embeds through with the last message
+                    try:
+                        await self.edit_webhook_message_if_changed(channel_webhook, cached_message, webhook_message_id, out_messages[index], [], [])
+                    except Exception as e:
+                        log.exception(e)
+
+                updated_content = out_messages[len(message_list)-1] # Last message that we can send...
+                webhook_message_id = message_list[-1] # Last webhook message we can use to edit in content
+
+                # Last message carries the embeds.
+                await self.edit_webhook_message_if_changed(channel_webhook, cached_message, webhook_message_id, updated_content, embeds_copy, [embed.to_dict() for embed in embeds_copy])
+            else:
+                # Check if we need to delete any obsolete messages (text shrinked due to edit)
+                while len(out_messages) < len(message_list):
+                    webhook_message_id = None
+                    try:
+                        webhook_message_id = message_list.pop()
+                        cached_message.webhook_message_ids[:] = [x for x in cached_message.webhook_message_ids if x[0] != webhook_message_id]
+                        cached_message.rendered.pop(webhook_message_id, None)
+                        await channel_webhook.delete_message(webhook_message_id)
+                    except Exception as e:
+                        log.exception(e)
+                        self.bot.post_log('**[ERROR]** Failed to delete message edited by ' + author_name + ' in channel ' + str(after.channel.name) + ' ' + config.additional_error_message)
+                        if webhook_message_id:
+                            error_embed = discord.Embed()
+                            error_embed.description = '_<This message was edited out but could not be deleted.>_'
+                            await channel_webhook.edit_message(webhook_message_id, content='', allowed_mentions=allowed_mentions, embed=error_embed)
+                            # If anything here threw, we don't continue editing since we have too many messages
+
+                # Only chunks whose content actually changed are edited; usually that is just one of them
+                for index, webhook_message_id in enumerate(message_list[:-1]):
+                    await self.edit_webhook_message_if_changed(channel_webhook, cached_message, webhook_message_id, out_messages[index], [], [])
+
+                # Last message carries the embeds
+                await self.edit_webhook_message_if_changed(channel_webhook, cached_message, message_list[-1], out_messages[-1], embeds, embed_dicts)
+
+        except Exception as e:
+            self.count(self.failure_counter, channel_id)
+            log.exception(e)
+            self.bot.post_log('**[ERROR]** Failed to edit message from channel ' + str(after.channel.name) + ' (author: ' + author_name + ') in channel ' + str(channel_id) + '. ' + config.additional_error_message)
+
+
+    async def edit_webhook_message_if_changed(self, channel_webhook, cached_message, webhook_message_id, content, embeds, embed_dicts):
+        """Edit a single forwarded webhook message, but only the parts that differ from what we sent last time. Unchanged embeds are left alone. Returns whether an edit was necessary."""
+
+        old_content, old_embed_dicts = cached_message.rendered.get(webhook_message_id, (None, None))
+
+        changes = {}
+        if content != old_content:
+            changes['content'] = content
+        if embed_dicts != old_embed_dicts:
+            changes['embeds'] = embeds
+
+        if not changes:
+            return False
+
+        await channel_webhook.edit_message(webhook_message_id, allowed_mentions=self.allowed_mentions, **changes)
+        cached_message.rendered[webhook_message_id] = (content, embed_dicts)
+        return True
 
 
     async def on_message_delete(self, message):
         """React to deleted messages. Called by bot client."""
 
         # NOTE: exceptions are caught by calling function
-        if int(message.author.id) != int(self.bot_id):
-            webhook_entry = self.webhooks.get(message.channel.id)
-            if webhook_entry:
-                # Make sure this is not one of our connected webhooks deleting
-                if message.webhook_id:
-                    for channel_id, (webhook, bridge_index) in self.webhooks.items():
-                        if message.webhook_id == webhook.id:
-                            return
+        if message.channel.id not in self.webhooks:
+            return
 
-                bridge_index = webhook_entry[1]
-                index = -1
-
-                # Try to find the cached message so that we know which webhook messages we need to delete
-                for i, cached_message in enumerate(self.message_cache[bridge_index]):
-                    if cached_message.find_message(message.id):
-                        index = i
-
-                        # This is the one, now delete all webhook messages associated with this:
-                        for (webhook_message_id, channel_id) in cached_message.webhook_message_ids:
-                            try:
-                                channel_webhook = self.webhooks.get(channel_id)[0]
-                                await channel_webhook.delete_message(webhook_message_id)
-                            except Exception as e:
-                                log.exception(e)
-                                await self.bot.log_channel.send('**[ERROR]** Critical error trying to delete content webhook message in channel ' + str(channel_id) + ' deleted by ' + str(message.author.display_name) + ' ' + config.additional_error_message)
+        # Make sure this is not one of our connected webhooks deleting
+        if message.webhook_id in self.webhook_ids or int(message.author.id) == int(self.bot_id):
+            return
+
+        # Try to find the cached message so that we know which webhook messages we need to delete
+        entry = self.message_index.get(message.id)
+        if entry is not None:
+            await self.forward_delete(entry[0], entry[1], str(message.author.display_name))
+
+
+    async def on_raw_message_delete(self, payload):
+        """React to deleted messages that are not in discord.py's message cache, as long as our own cache still knows them. Called by bot client."""
+
+        # NOTE: exceptions are caught by calling function
+        # This is called for every delete, cached or not, so this is the place to keep future reply quotes accurate
+        self.reply_cache.mark_deleted(payload.message_id)
+
+        if payload.cached_message is not None:
+            # Already handled by on_message_delete
+            return
+
+        if payload.channel_id not in self.webhooks:
+            return
 
+        # Only original messages are indexed, so deletes of our own webhook messages are ignored here
+        entry = self.message_index.get(payload.message_id)
+        if entry is not None:
+            await self.forward_delete(entry[0], entry[1], '<uncached author>')
+
+
+    async def on_raw_bulk_message_delete(self, payload):
+        """Mirror bulk deletes (e.g. by moderation bots). discord.py does not call on_message_delete for these at all. Called by bot client."""
+
+        # NOTE: exceptions are caught by calling function
+        webhook_entry = self.webhooks.get(payload.channel_id)
+        if not webhook_entry:
+            return
+
+        bridge_index = webhook_entry[1]
+        cached_messages = []
+        for message_id in payload.message_ids:
+            self.reply_cache.mark_deleted(message_id)
+            entry = self.message_index.get(message_id)
+            if entry is not None:
+                cached_messages.append(entry[1])
+                self.uncache_message(bridge_index, entry[1])
+
+        if not cached_messages:
+            return
+
+        for channel_id in self.bridges[bridge_index]:
+            if channel_id == payload.channel_id:
+                continue
+
+            self.send_queues[channel_id].put(functools.partial(self.bulk_delete_forwarded_messages, cached_messages, channel_id))
+
+
+    async def forward_delete(self, bridge_index, cached_message, author_name):
+        """Queue the deletion of all webhook messages associated with a deleted message in every channel and forget about it."""
+
+        # NOTE: The forwarded messages may still be waiting in the send queues, so which ones to delete is only decided once the queue gets to this job.
+        for channel_id in self.bridges[bridge_index]:
+            if channel_id == cached_message.channel_id:
+                continue
+
+            self.send_queues[channel_id].put(functools.partial(self.delete_forwarded_messages, cached_message, channel_id, author_name))
+
+        try:
+            self.uncache_message(bridge_index, cached_message)
+        except Exception as e:
+            # Failed, too bad but not critical
+            log.exception(e)
+            self.bot.post_log('**[WARNING]** Failed to delete message from cache ' + config.additional_error_message)
+
+
+    async def bulk_delete_forwarded_messages(self, cached_messages, channel_id):
+        """Delete the webhook messages of several deleted messages in one channel, in batches of up to 100 messages per API call. Executed by the send queue of that channel."""
+
+        webhook_message_ids = []
+        for cached_message in cached_messages:
+            if channel_id in cached_message.coalesced:
+                # Parts of merged messages have to be cut out one by one
+                await self.delete_forwarded_messages(cached_message, channel_id, '<bulk delete>')
+            else:
+                self.count(self.delete_counter, channel_id)
+                webhook_message_ids.extend(webhook_message_id for (webhook_message_id, webhook_channel_id) in cached_message.webhook_message_ids if webhook_channel_id == channel_id)
+
+        channel = self.bot.get_channel(channel_id)
+        channel_webhook = self.webhooks.get(channel_id)[0]
+        batch_size = 100 # Discord's limit for bulk deletes
+
+        for i in range(0, len(webhook_message_ids), batch_size):
+            batch = webhook_message_ids[i:i+batch_size]
+            try:
+                # NOTE: This needs the manage messages permission (and only works for messages younger than two weeks), deleting via the webhook does not
+                await channel.delete_messages([discord.Object(id=webhook_message_id) for webhook_message_id in batch])
+            except Exception as e:
+                log.warning('Bulk delete in channel ' + str(channel_id) + ' failed (' + str(e) + '), falling back to deleting webhook messages one by one.')
+                for webhook_message_id in batch:
+                    try:
+                        await channel_webhook.delete_message(webhook_message_id)
+                    except discord.errors.NotFound:
+                        pass
+                    except Exception as e:
+                        self.count(self.failure_counter, channel_id)
+                        log.exception(e)
+                        self.bot.post_log('**[ERROR]** Critical error trying to delete content webhook message in channel ' + str(channel_id) + ' (bulk delete) ' + config.additional_error_message)
+
+
+    async def delete_forwarded_messages(self, cached_message, channel_id, author_name):
+        """Delete all webhook messages forwarded to one channel for a deleted message. Executed by the send queue of that channel."""
+
+        channel_webhook = self.webhooks.get(channel_id)[0]
+        self.count(self.delete_counter, channel_id)
+
+        coalesced_message = cached_message.coalesced.pop(channel_id, None)
+        if coalesced_message:
+            # Other messages still live in the shared webhook message, so only cut out this part unless it was the last one
+            coalesced_message.remove_part(cached_message.message_id)
+            if coalesced_message.parts:
                 try:
-                    # O(n) again, but we don't do this too often
-                    if index != -1:
-                        del self.message_cache[bridge_index][index]
+                    await channel_webhook.edit_message(coalesced_message.webhook_message_id, content=coalesced_message.render(), embeds=coalesced_message.render_embeds(), allowed_mentions=self.allowed_mentions)
                 except Exception as e:
-                    # Failed, too bad but not critical
+                    self.count(self.failure_counter, channel_id)
                     log.exception(e)
-                    await self.bot.log_channel.send('**[WARNING]** Failed to delete message from cache ' + config.additional_error_message)
+                    self.bot.post_log('**[ERROR]** Critical error trying to edit merged webhook message in channel ' + str(channel_id) + ' deleted by ' + author_name + ' ' + config.additional_error_message)
+                return
 
-                # Debug code:
-                #print('================== POST DELETE ' + str(bridge_index))
-                #for mci in self.message_cache[bridge_index]:
-                #    print(str(mci.message_id) + ', ' + str(mci.channel_id) + ', ' + str(mci.webhook_message_ids))
+        for (webhook_message_id, webhook_channel_id) in cached_message.webhook_message_ids:
+            if webhook_channel_id != channel_id:
+                continue
+
+            try:
+                await channel_webhook.delete_message(webhook_message_id)
+            except Exception as e:
+                self.count(self.failure_counter, channel_id)
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** Critical error trying to delete content webhook message in channel ' + str(channel_id) + ' deleted by ' + author_name + ' ' + config.additional_error_message)
 
 
 
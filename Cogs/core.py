@@ -2,6 +2,7 @@ import logging
 import discord
 import datetime
 import json
+import io
 from operator import itemgetter
 from discord.ext import commands
 from os import linesep
@@ -101,6 +102,23 @@ class Core(BaseCog):
             await self.bot.post_error(context, 'The shortcut \'' + shortcut + '\' does not exist, ' + context.message.author.name + '.')
 
 
+    @commands.command()
+    async def commandstats(self, context, command_name = None):
+        """Displays wall time, discord API calls and database accesses per command. Use '!commandstats <command>' for the details of a single command and '!commandstats json' to get everything as a JSON file in a private message."""
+
+        BaseCog.check_not_private(self, context)
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+
+        if command_name == 'json':
+            dump = json.dumps(self.bot.instrumentation.dump(), indent=2)
+            await context.message.author.send(file=discord.File(io.BytesIO(dump.encode('utf-8')), filename='commandstats.json'))
+            return
+
+        await self.bot.post_message(context, self.bot.bot_channel, '```' + self.bot.instrumentation.render(command_name) + '```')
+
+
 
 async def setup(bot):
     """Core cog load."""
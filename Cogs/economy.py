@@ -29,7 +29,8 @@ class Economy(BaseCog):
         self.max_loan =  int(config.get('Economy', 'max_loan', fallback='14'))
 
         timed_events_cog = BaseCog.load_dependency(self, 'TimedTasks')
-        timed_events_cog.register_timed_event(self.refill_free_points)
+        # Resets rather than adds, so it is safe to retry
+        timed_events_cog.register_timed_event(self.refill_free_points, retries=2)
         timed_events_cog.register_timed_event(self.pay_back_loans)
 
 
@@ -30,7 +30,9 @@ class Holidays(BaseCog):
         self.minigames = []
 
         timed_events_cog = BaseCog.load_dependency(self, 'TimedTasks')
-        timed_events_cog.register_timed_event(self.print_holiday)
+        # Holiday free points come on top of the daily ones
+        timed_events_cog.register_timed_event(self.print_holiday, after=['refill_free_points'])
+        self.bot.lifecycle.register_connect(self.get_announcement_channel)
 
         self.bot.info_text += 'Holidays:' + linesep + '  The bot will post a description of holidays on appropriate days. We celebrate these holidays by gambling a random minigame for free and also by giving away more free points.' + linesep + linesep
 
@@ -51,9 +53,12 @@ class Holidays(BaseCog):
     #==============================================
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """Get holiday announcement channel. Holidays will be posted in that space."""
+    def cog_unload(self):
+        self.bot.lifecycle.unregister(self.get_announcement_channel)
+
+
+    async def get_announcement_channel(self):
+        """Get holiday announcement channel. Holidays will be posted in that space. Done on every connect, since a new gateway session replaces the channel objects."""
         self.holiday_announcement_channel = self.bot.get_channel(self.holiday_announcement_channel_id)
         print('Holiday cog is ready. Holiday announcement channel: ' + str(self.holiday_announcement_channel))
 
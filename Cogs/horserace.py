@@ -23,7 +23,8 @@ class Horserace(BaseCog):
         self.race_participants = {}
         self.race_closed = True
         self.race_last_ann = ''
-        self.horse_table = self.bot.database.table('horses')
+        self._horse_table = self.bot.database.table('horses')
+        self.horse_table_checked = False
 
         with open(config.cogs_data_path + '/gambling.json', 'r') as gambling_config:
             data = json.load(gambling_config)
@@ -39,9 +40,6 @@ class Horserace(BaseCog):
         self.uninvited_chance = float(config.get('Horserace', 'uninvited_chance', fallback=0.15))
         self.max_interwoven_messages = int(config.get('Horserace', 'max_interwoven_messages', fallback=5))
 
-        if len(self.horse_table) < 1:
-            self.reset_horses()
-
         # Register horseraces to be a possible minigame for holiday points
         holidays = self.bot.get_cog('Holidays')
 
@@ -49,6 +47,17 @@ class Horserace(BaseCog):
             holidays.minigames.append('Horseraces')
 
 
+    @property
+    def horse_table(self):
+        """The horse table, filled with the configured horses on first use rather than on load since checking it means reading the whole database."""
+
+        if not self.horse_table_checked:
+            self.horse_table_checked = True
+            if len(self._horse_table) < 1:
+                self.reset_horses()
+        return self._horse_table
+
+
     def reset_horses(self):
         self.horse_table.truncate()
         for horse_name in self.horse_names:
@@ -535,13 +544,13 @@ class Horserace(BaseCog):
                     await self.bot.post_error(context, 'Something went wrong subtracting the bet from your account balance! Horse race is therefore canceled.')
                     log.exception(e)
                     return
-                await self.bot.post_message(context, self.bot.bot_channel, role_mention + '**[HORSE RACE]** ' + announcement)
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** Type !bet <bet> <horse> to place a bet on your favourite breed.')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** Type !unbet to remove your current bet.')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]**' + linesep + linesep)
-                await self.bot.post_message(context, self.bot.bot_channel, horse_list + linesep)
+                await self.bot.post_message(context, self.bot.bot_channel, role_mention + '**[HORSE RACE]** ' + announcement, coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** Type !bet <bet> <horse> to place a bet on your favourite breed.', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** Type !unbet to remove your current bet.', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]**' + linesep + linesep, coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, horse_list + linesep, coalesce=True)
                 self.race_participants[context.message.author.name] = (bet, min(holiday, bet), horse)
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '!') # first index is 0
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '!', coalesce=True) # first index is 0
                 self.race_last_ann = announcement
                 self.race_closed = False
 
@@ -711,16 +720,16 @@ class Horserace(BaseCog):
                 amnt_fourth = sum(1 for p, (b, f, h) in self.race_participants.items() if h == fourth_index)
                 amnt_fifth = sum(1 for p, (b, f, h) in self.race_participants.items() if h == fifth_index)
 
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** The race is over, valued spectators, and all placements are decided. What a divine spectacle!')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In fifth place is ' + fifth + ', anticipated by ' + str(amnt_fifth) + ' users.')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In fourth place is ' + fourth + ', anticipated by ' + str(amnt_fourth) + ' users.')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In third place is ' + third + ', anticipated by ' + str(amnt_third) + ' users.')
-                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In second place is ' + second + ', anticipated by ' + str(amnt_second) + ' users.')
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** The race is over, valued spectators, and all placements are decided. What a divine spectacle!', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In fifth place is ' + fifth + ', anticipated by ' + str(amnt_fifth) + ' users.', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In fourth place is ' + fourth + ', anticipated by ' + str(amnt_fourth) + ' users.', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In third place is ' + third + ', anticipated by ' + str(amnt_third) + ' users.', coalesce=True)
+                await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** In second place is ' + second + ', anticipated by ' + str(amnt_second) + ' users.', coalesce=True)
 
                 if amnt_first == 0:
-                    await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + '! Looks like nobody saw this coming. What a surprise!')
+                    await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + '! Looks like nobody saw this coming. What a surprise!', coalesce=True)
                 else:
-                    await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + ', anticipated by ' + str(amnt_first) + ' users! Congratulations!')
+                    await self.bot.post_message(context, self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + ', anticipated by ' + str(amnt_first) + ' users! Congratulations!', coalesce=True)
 
                 # Add winnings and update some trivia
                 try:
@@ -774,7 +783,7 @@ class Horserace(BaseCog):
 
                     if payout:
                         payout_message = '**[HORSE RACE]** The payouts are:' + linesep + linesep + payout_message
-                        await self.bot.post_message(context, self.bot.bot_channel, payout_message)
+                        await self.bot.post_message(context, self.bot.bot_channel, payout_message, coalesce=True)
                 except Exception as e:
                     await self.bot.post_error(context, 'Something went wrong handing out the cash! Balances and stats might be inconsistent now.', config.additional_error_message)
                     log.exception(e)
@@ -2,70 +2,263 @@ import logging
 import discord
 from discord.ext import commands
 import asyncio
+import heapq
+import time
 from datetime import timedelta
 from datetime import datetime
+from datetime import timezone
 from conf import config
+from recurrence import parse_recurrence
 from .base_cog import BaseCog
-from tinydb import Query
 from os import linesep
-from concurrent.futures import CancelledError
 
 log = logging.getLogger(__name__)
 
+TIME_FORMAT = '%m/%d/%y %H:%M:%S'
+
 class Reminders(BaseCog):
-    """A cog for timed reminders."""
+    """A cog for timed reminders.
+
+    Reminders are stored with their TinyDB document id and the UTC timestamp they are due at. A single scheduler task sleeps until the earliest one is due, using a min-heap of (due, id), so pending reminders cost no task of their own and adding one is O(log n).
+    Recurring reminders additionally store their rule (see recurrence.py). Only their next occurrence is kept; the one after is computed when it is sent.
+    """
+
+    # Upper bound for a single sleep of the scheduler, so that it notices changes of the system clock
+    max_sleep = 3600
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
         self.reminder_table = self.bot.database.table('reminder_table')
-        self.users = Query()
-        self.bot.info_text += 'Reminders:' + linesep + '  Using the command !remind, users may set custom reminders for the bot to send at specific points in time. Type !help remind for details on how to use this feature.' + linesep + linesep
-        self.tasks = {}
+        self.bot.info_text += 'Reminders:' + linesep + '  Using the command !remind, users may set custom reminders for the bot to send at specific points in time. Type !help remind for details on how to use this feature. With !remindevery, reminders repeat daily, weekly, every few hours or on a cron schedule.' + linesep + linesep
+        self.reminders = {} # Document id -> pending reminder
+        self.author_index = {} # Author id -> ids of their reminders, in the order they were set (dicts keep insertion order and remove in O(1))
+        self.heap = [] # (due, document id); may contain reminders that were cleared in the meantime, see pop_due_reminders
+        self.wakeup = asyncio.Event()
+        self.scheduler_task = None
+        self.min_recurrence_minutes = int(config.get('Reminders', 'min_recurrence_minutes', fallback='10'))
+        bot.metrics.gauge('reminders_scheduled', 'Reminders waiting to be sent', callback=lambda: {(): len(self.reminders)})
+        # Only once: the scheduler keeps running across reconnects
+        self.bot.lifecycle.register_startup(self.schedule_stored_reminders)
+
+
+    def cog_unload(self):
+        self.bot.lifecycle.unregister(self.schedule_stored_reminders)
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+            self.scheduler_task = None
+
+
+    @staticmethod
+    def format_time(due):
+        """Format the UTC timestamp _due_ in the bot's local time, as shown to users."""
+        return datetime.fromtimestamp(due).strftime(TIME_FORMAT)
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    async def schedule_stored_reminders(self):
+        """Load the reminders in the database, e.g. after a restart, and start the scheduler."""
+
         for item in self.reminder_table:
             try:
-                timed_until_execute = (datetime.strptime(item['time_then'], "%m/%d/%y %H:%M:%S") - datetime.now()).seconds
-                author = self.bot.get_user(item['author_id'])
-                if author is not None:
-                    if item['channel'] == 0:
-                        self.tasks[item['time_then']] = self.bot.loop.create_task(self.timed_task(None, author, author.name, item['message'], timed_until_execute, item['time_then']))
-                    else:
-                        channel = self.bot.get_channel(item['channel'])
-                        if channel is not None:
-                            self.tasks[item['time_then']] = self.bot.loop.create_task(self.timed_task(None, channel, author.name, item['message'], timed_until_execute, item['time_then']))
-                        else:
-                            log.fatal('Failed to retrieve channel with id ' + str(item['channel']))
-                else:
-                    log.fatal('Failed to retrieve author with id ' + str(item['author_id']))
+                if 'due' not in item:
+                    # Stored before reminders had ids and UTC timestamps: time_then is in the bot's local time
+                    due = datetime.strptime(item['time_then'], TIME_FORMAT).timestamp()
+                    self.reminder_table.update({'due': due}, doc_ids=[item.doc_id])
+                    item['due'] = due
+                self.reminders[item.doc_id] = item
+                self.author_index.setdefault(item['author_id'], {})[item.doc_id] = None
+                self.heap.append((item['due'], item.doc_id))
             except Exception as e:
                 log.fatal('EXCEPTION OCCURRED WHILE RUNNING REMINDER SETUP')
                 log.exception(e)
 
+        heapq.heapify(self.heap)
+
+        # Catch up on what fell due while the bot was offline before the scheduler takes over. The heap is the index here: overdue reminders are at its top.
+        overdue = self.pop_due_reminders()
+        if overdue:
+            log.info('Sending ' + str(len(overdue)) + ' reminders that fell due while the bot was offline')
+            await self.send_reminders(overdue, overdue=True)
+
+        self.scheduler_task = self.bot.loop.create_task(self.run_scheduler())
+
+
+    def schedule(self, reminder_id, reminder):
+        self.reminders[reminder_id] = reminder
+        self.author_index.setdefault(reminder['author_id'], {})[reminder_id] = None
+        heapq.heappush(self.heap, (reminder['due'], reminder_id))
+        if self.heap[0][1] == reminder_id:
+            # Due earlier than what the scheduler is sleeping for
+            self.wakeup.set()
+
+
+    def forget(self, reminder_id, reminder):
+        # The heap entry is skipped once it comes up
+        del self.reminders[reminder_id]
+        author_reminders = self.author_index[reminder['author_id']]
+        del author_reminders[reminder_id]
+        if not author_reminders:
+            del self.author_index[reminder['author_id']]
+
+
+    def unschedule(self, reminder_id):
+        self.forget(reminder_id, self.reminders[reminder_id])
+        self.reminder_table.remove(doc_ids=[reminder_id])
+
+
+    def author_reminders(self, author_id):
+        """The (id, reminder) of all reminders set by _author_id_, in the order they were set. Since that order doesn't change when recurring reminders advance, the indices of !reminders and !clearreminder stay the same."""
+        return [(reminder_id, self.reminders[reminder_id]) for reminder_id in self.author_index.get(author_id, ())]
+
+
+    @staticmethod
+    def next_due(reminder, now):
+        """The next occurrence of the recurring _reminder_ after _now_, or None if its rule has no more."""
+        try:
+            return parse_recurrence(reminder['rule']).next_after(now, reminder['due'])
+        except ValueError as e:
+            log.exception(e)
+            return None
+
+
+    def occurrences(self, reminder, count):
+        """The next _count_ occurrences of the recurring _reminder_ after the one it is scheduled for."""
+        result = []
+        due = reminder['due']
+        for _ in range(count):
+            due = self.next_due(dict(reminder, due=due), due)
+            if due is None:
+                break
+            result.append(due)
+        return result
+
+
+    def pop_due_reminders(self):
+        """Take the reminders that are due from the schedule. One-time reminders are removed from the database, recurring ones are scheduled for their next occurrence. Returns them as they were due, ordered by due time."""
+
+        now = time.time()
+        due_ids = []
+        recurring = []
+        due_reminders = []
+        while self.heap and self.heap[0][0] <= now:
+            due, reminder_id = heapq.heappop(self.heap)
+            reminder = self.reminders.get(reminder_id)
+            # Skip cleared reminders and entries outdated by an earlier occurrence of a recurring one
+            if reminder is not None and reminder['due'] == due:
+                due_reminders.append(dict(reminder))
+                next_due = self.next_due(reminder, now) if 'rule' in reminder else None
+                if next_due is None:
+                    self.forget(reminder_id, reminder)
+                    due_ids.append(reminder_id)
+                else:
+                    reminder['due'] = next_due
+                    recurring.append((reminder_id, reminder))
+
+        for reminder_id, reminder in recurring:
+            self.schedule(reminder_id, reminder)
+        if recurring:
+            # All in one write; next_due gives the same results for the stored documents
+            def advance(document):
+                document['due'] = self.next_due(document, now)
+            self.reminder_table.update(advance, doc_ids=[reminder_id for reminder_id, reminder in recurring])
+
+        # Drop the entries of cleared reminders once they make up most of the heap
+        if len(self.heap) > 2 * len(self.reminders) + 64:
+            self.heap = [(reminder['due'], reminder_id) for reminder_id, reminder in self.reminders.items()]
+            heapq.heapify(self.heap)
+
+        if due_ids:
+            self.reminder_table.remove(doc_ids=due_ids)
+        return due_reminders
+
+
+    async def wait_for_next_reminder(self):
+        self.wakeup.clear()
+        delay = self.heap[0][0] - time.time() if self.heap else self.max_sleep
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), min(delay, self.max_sleep))
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def run_scheduler(self):
+        """Asynchronous timer loop that sends reminders when they are due."""
+
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.wait_for_next_reminder()
+                await self.send_reminders(self.pop_due_reminders())
+            except Exception as e:
+                self.bot.post_log('**[ERROR]** Oh no, something went wrong in the reminder scheduler. ' + config.additional_error_message)
+                log.fatal('EXCEPTION OCCURRED WHILE RUNNING REMINDER SCHEDULER:')
+                log.exception(e)
+                await asyncio.sleep(1)
+
+
+    async def send_reminders(self, reminders, overdue=False):
+        """Send _reminders_ with one message per channel (or author, for reminders set in private messages) listing all of its reminders. With _overdue_, each says when it was due."""
+
+        groups = {} # (channel id, author id for private messages) -> reminders
+        for reminder in reminders:
+            groups.setdefault((reminder['channel'], reminder['author_id'] if reminder['channel'] == 0 else 0), []).append(reminder)
+
+        for (channel_id, author_id), channel_reminders in groups.items():
+            try:
+                if channel_id == 0:
+                    channel = self.bot.get_user(author_id) or await self.bot.fetch_user(author_id)
+                else:
+                    channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    log.fatal('Failed to retrieve channel with id ' + str(channel_id))
+                    continue
+
+                lines = []
+                for reminder in channel_reminders:
+                    author = self.bot.get_user(reminder['author_id'])
+                    author_name = reminder.get('author_name') or (author.name if author is not None else str(reminder['author_id']))
+                    line = '**[REMINDER]** ' + author_name + ': ' + reminder['message'] + '.'
+                    if overdue:
+                        line += ' (due ' + self.format_time(reminder['due']) + ')'
+                    lines.append(line)
+                await self.bot.post_message(None, channel, linesep.join(lines))
+            except Exception as e:
+                self.bot.post_log('**[ERROR]** Oh no, something went wrong while sending reminders. ' + config.additional_error_message)
+                log.fatal('EXCEPTION OCCURRED WHILE SENDING REMINDERS:')
+                log.exception(e)
+
+
     @commands.command()
     async def reminders(self, context):
         """Shows all reminders created by you."""
 
         BaseCog.check_forbidden_characters(self, context)
-        reminders = self.reminder_table.search(self.users.author_id == context.message.author.id)
+        reminders = [reminder for reminder_id, reminder in self.author_reminders(context.message.author.id)]
         if len(reminders) > 0:
             result = '```Reminders ' + linesep + linesep
 
-            channel_indent = max(len(self.bot.get_channel(reminder['channel']).name) if self.bot.get_channel(reminder['channel']) is not None else len('Channel') for reminder in reminders)
-            time_indent = max(len(reminder['time_then']) for reminder in reminders)
+            channel_names = {}
+            for reminder in reminders:
+                if reminder['channel'] not in channel_names:
+                    channel_obj = self.bot.get_channel(reminder['channel'])
+                    channel_names[reminder['channel']] = channel_obj.name if channel_obj is not None else 'PM'
 
-            result += 'Index  ' + 'Channel'.ljust(channel_indent) + '  ' + 'Time'.ljust(time_indent) + '  ' + 'Message' + linesep + linesep
+            channel_indent = max([len('Channel')] + [len(channel_name) for channel_name in channel_names.values()])
+            time_indent = max(len(self.format_time(reminder['due'])) for reminder in reminders)
+            rule_indent = max([len('Repeats')] + [len(reminder['rule']) for reminder in reminders if 'rule' in reminder])
+
+            result += 'Index  ' + 'Channel'.ljust(channel_indent) + '  ' + 'Time'.ljust(time_indent) + '  ' + 'Repeats'.ljust(rule_indent) + '  ' + 'Message' + linesep + linesep
             ctr = 1
 
             for reminder in reminders:
-                channel_obj = self.bot.get_channel(reminder['channel'])
-                channel_name = channel_obj.name if channel_obj is not None else 'PM'
-                time = reminder['time_then']
+                channel_name = channel_names[reminder['channel']]
+                time = self.format_time(reminder['due'])
+                rule = reminder.get('rule', 'never')
                 message = reminder['message']
 
-                result += str(ctr).ljust(len('Index')) + '  ' + str(channel_name).ljust(channel_indent) + '  ' + time.ljust(time_indent) + '  ' + str(message) + linesep
+                result += str(ctr).ljust(len('Index')) + '  ' + str(channel_name).ljust(channel_indent) + '  ' + time.ljust(time_indent) + '  ' + rule.ljust(rule_indent) + '  ' + str(message) + linesep
+                if 'rule' in reminder:
+                    result += ''.ljust(len('Index') + channel_indent + 4) + 'then ' + ', '.join(self.format_time(due) for due in self.occurrences(reminder, 2)) + linesep
                 ctr += 1
 
             result += '```'
@@ -86,16 +279,14 @@ class Reminders(BaseCog):
             await self.bot.post_error(context, 'Index must be a valid integer.')
             return
 
-        reminders = self.reminder_table.search(self.users.author_id == context.message.author.id)
+        reminders = self.author_reminders(context.message.author.id)
         if len(reminders) > 0:
             if index < 1 or index > len(reminders):
                 await self.bot.post_error(context, 'Invalid index. Please choose a number between 1 and ' + str(len(reminders)))
+                return
 
-            reminder = reminders[index - 1]
-            time_then = reminder['time_then']
-            self.tasks[time_then].cancel()
-            del self.tasks[time_then]
-            self.reminder_table.remove(self.users.time_then == time_then)
+            reminder_id, _ = reminders[index - 1]
+            self.unschedule(reminder_id)
 
             await self.bot.send_private_message(context, '**[INFO]** You have removed a reminder at index ' + str(index) + '.')
         else:
@@ -110,7 +301,7 @@ class Reminders(BaseCog):
             message_combined = message #'`{}`'.format(message)
 
             BaseCog.check_forbidden_characters(self, context)
-            time_now = datetime.now()
+            time_now = datetime.now(timezone.utc)
             try:
                 minutes = int(minutes)
             except ValueError:
@@ -133,44 +324,42 @@ class Reminders(BaseCog):
 
             time_then = time_now + timedelta(minutes = minutes, hours = hours)
             time_until_execute = (time_then - time_now).total_seconds()
-            time_formatted = time_then.strftime('%m/%d/%y %H:%M:%S')
-            self.reminder_table.insert({'channel': channel_id, 'author_id': context.message.author.id, 'message': message_combined, 'time_then': time_formatted})
-            self.tasks[time_formatted] = self.bot.loop.create_task(self.timed_task(context, context.message.channel, context.message.author.name, message_combined, time_until_execute, time_formatted))
+            due = time_then.timestamp()
+            time_formatted = self.format_time(due)
+            reminder = {'channel': channel_id, 'author_id': context.message.author.id, 'author_name': context.message.author.name, 'message': message_combined, 'due': due}
+            self.schedule(self.reminder_table.insert(reminder), reminder)
             await self.bot.post_message(context, context.message.channel, context.message.author.name + ' has set a reminder at ' + time_formatted + ' (' + "{:.2f}".format(time_until_execute / 3600) + ' hours from now)')
         except Exception as e:
             await self.bot.post_error(context, 'Oh no, something went wrong.', config.additional_error_message)
             log.exception(e)
 
 
-    async def timed_task(self, context, channel, author_name, message, time_until_execute, time_formatted):
-        """Asynchronous timer loop that executes a task at a specific time."""
+    @commands.command()
+    async def remindevery(self, context, schedule, *, message):
+        """Sends a recurring reminder to the author of this command in the current channel. _schedule_ is one of hourly, daily HH:MM, weekly DAY HH:MM, every N(m|h|d) or a cron expression (minute hour day-of-month month day-of-week), in the bot's local time. Put it in quotes if it has spaces: !remindevery "weekly mon 18:30" Weekly meeting. Clear it with !clearreminder."""
 
         try:
-            await self.bot.wait_until_ready()
-            while True:
-                await asyncio.sleep(time_until_execute)
-                try:
-                    self.reminder_table.remove(self.users.message == message)
-                    del self.tasks[time_formatted]
-                    await self.bot.post_message(None, channel, '**[REMINDER]** ' + author_name + ': ' + message + '.')
-                    break
-                except Exception as e:
-                    if context is None:
-                        await self.bot.post_message(None, self.bot.log_channel, '**[ERROR]** Oh no, something went wrong in a timed task loop.')
-                    else:
-                        await self.bot.post_error(context,'Oh no, something went wrong. ' + config.additional_error_message) 
-                    log.fatal('EXCEPTION OCCURRED WHILE EXECUTING TIMED EVENT:')
-                    log.exception(e)
-                    break
-        except CancelledError as e:
-            log.exception(e)
-            pass
+            BaseCog.check_forbidden_characters(self, context)
+
+            now = time.time()
+            try:
+                rule = parse_recurrence(schedule)
+                due = rule.next_after(now)
+                following = rule.next_after(due, due)
+            except ValueError as e:
+                await self.bot.post_error(context, 'Invalid schedule: ' + str(e))
+                return
+
+            if following - due < self.min_recurrence_minutes * 60:
+                await self.bot.post_error(context, 'Recurring reminders can repeat at most every ' + str(self.min_recurrence_minutes) + ' minutes.')
+                return
+
+            channel_id = 0 if context.message.guild is None else context.message.channel.id
+            reminder = {'channel': channel_id, 'author_id': context.message.author.id, 'author_name': context.message.author.name, 'message': message, 'due': due, 'rule': rule.text}
+            self.schedule(self.reminder_table.insert(reminder), reminder)
+            await self.bot.post_message(context, context.message.channel, context.message.author.name + ' has set a reminder repeating ' + rule.text + ', next at ' + self.format_time(due) + ', then ' + self.format_time(following))
         except Exception as e:
-            if context is None:
-                await self.bot.post_message(None, self.bot.log_channel, '**[ERROR]** Oh no, something went wrong in a timed task loop.')
-            else:
-                await self.bot.post_error(context,'Oh no, something went wrong. ' + config.additional_error_message) 
-            log.fatal('EXCEPTION OCCURRED WHILE RUNNING TIMED EVENTS LOOP:')
+            await self.bot.post_error(context, 'Oh no, something went wrong.', config.additional_error_message)
             log.exception(e)
 
 
@@ -6,6 +6,8 @@ from os import linesep, listdir
 import os
 from .base_cog import BaseCog
 from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+from instrumentation import InstrumentedStorage
 from conf import config
 
 log = logging.getLogger(__name__)
@@ -15,27 +17,43 @@ class Stats(BaseCog):
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
-        self.trivia_table = bot.database.table('trivia_table')
+        self._trivia_table = bot.database.table('trivia_table')
+        self.trivia_table_checked = False
         self.seasons_path = config.get('Private', 'seasons_path', fallback='seasons')
 
-        # Past seasons, if available
-        self.season_tables = []
+        # Past seasons, if available. Opened on first use by !season.
+        self._season_tables = None
+
+
+    @property
+    def trivia_table(self):
+        """The trivia table, reset on first use rather than on load since checking it means reading the whole database (and resetting it needs all cogs)."""
+
+        if not self.trivia_table_checked:
+            self.trivia_table_checked = True
+            try:
+                if len(self._trivia_table) < 1:
+                    self.reset_trivia()
+            except Exception as e:
+                print('Stats: Error while resetting trivia table!')
+                log.exception(e)
+        return self._trivia_table
 
-        try:
-            if len(self.trivia_table) < 1:
-                self.reset_trivia()
-        except Exception as e:
-            print('Stats::__init__: Error while resetting trivia table!')
-            log.exception(e)
 
-        for i in range(1, 20):
-            filename = self.seasons_path + '/' + 'season' + str(i) + '.json'
-            if os.path.isfile(filename):
-                season_db = TinyDB(filename)
-                self.season_tables.append((season_db.table('main_db'), season_db.table('trivia_table')))
+    @property
+    def season_tables(self):
+        """(main_db, trivia_table) of every previous season."""
 
+        if self._season_tables is None:
+            self._season_tables = []
+            for i in range(1, 20):
+                filename = self.seasons_path + '/' + 'season' + str(i) + '.json'
+                if os.path.isfile(filename):
+                    season_db = TinyDB(filename, storage=InstrumentedStorage(JSONStorage, self.bot.metrics))
+                    self._season_tables.append((season_db.table('main_db'), season_db.table('trivia_table')))
 
-        log.info('Loaded ' + str(len(self.season_tables)) + ' season tables')
+            log.info('Loaded ' + str(len(self._season_tables)) + ' season tables')
+        return self._season_tables
 
 
     def reset_trivia(self):
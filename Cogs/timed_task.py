@@ -3,74 +3,257 @@ import discord
 from discord.ext import commands
 import asyncio
 import datetime
+import functools
+import time
+from os import linesep
+from zoneinfo import ZoneInfo
 from conf import config
+from recurrence import parse_recurrence
 from .base_cog import BaseCog
 
 log = logging.getLogger(__name__)
 
+
+class TimedEvent:
+    """A registered event with its schedule, how it is run and when it last ran successfully (a UTC timestamp, None if never)."""
+
+    def __init__(self, name, event, rule, after, timeout, retries, last_run, doc_id):
+        self.name = name
+        self.event = event
+        self.rule = rule
+        self.after = after # Names of events that have to finish first when due at the same time
+        self.timeout = timeout
+        self.retries = retries
+        self.last_run = last_run
+        self.doc_id = doc_id # Of its row in the timed_tasks table
+        self.next_run = None
+        self.task = None # While running, so that a run never overlaps the previous one
+        self.last_duration = None
+        self.last_outcome = None
+
+
 class TimedTasks(BaseCog):
-    """A cog for (daily) timed events; e.g. holidays, free points, paying back loans."""
+    """A cog for (daily) timed events; e.g. holidays, free points, paying back loans.
+
+    Every event runs on a schedule of its own (see recurrence.py), by default daily at timed_task_hour:timed_task_minute. Schedules are evaluated in wall clock time of the configured timezone, and next runs are computed from the clock rather than by sleeping a fixed day, so they neither drift nor shift with daylight saving time.
+    The last successful run of every event is stored in the database. An event that should have run while the bot was down is run once at startup.
+    Due events run in the background, concurrently, except for those declared to run after others. Every event runs with a timeout and is retried as often as registered, so a slow or failing event neither delays nor aborts the others. An event that is still running when it is due again skips that run.
+    """
+
+    # Upper bound for a single sleep of the scheduler, so that it notices changes of the system clock
+    max_sleep = 3600
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
 
-        self.hour = int(config.get('TimedTasks', 'timed_task_hour', fallback='5'))
-        self.minute = int(config.get('TimedTasks', 'timed_task_minute', fallback='0'))
-        self.second = int(config.get('TimedTasks', 'timed_task_second', fallback='0'))
+        hour = int(config.get('TimedTasks', 'timed_task_hour', fallback='5'))
+        minute = int(config.get('TimedTasks', 'timed_task_minute', fallback='0'))
+        self.default_schedule = str(minute) + ' ' + str(hour) + ' * * *'
+        self.default_timeout = float(config.get('TimedTasks', 'timed_event_timeout', fallback='600'))
+        self.retry_delay = float(config.get('TimedTasks', 'timed_event_retry_delay', fallback='60'))
+        timezone = config.get('TimedTasks', 'timezone', fallback='')
+        self.timezone = ZoneInfo(timezone) if timezone else None # None: the system's local time
+
+        self.timed_task = None
+        self.timed_events = {} # Name -> TimedEvent; cogs register their tasks here that should be executed
+        self.wakeup = asyncio.Event()
+
+        self.table = self.bot.database.table('timed_tasks')
+        self.last_runs = {row['name']: (row.doc_id, row['last_run']) for row in self.table}
+
+        labels = ('event',)
+        self.duration_histogram = bot.metrics.histogram('timed_event_duration_seconds', 'Time a timed event took to run, per attempt', labels, buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0))
+        self.run_counter = bot.metrics.counter('timed_event_runs_total', 'Attempts to run a timed event by outcome (success, failure, timeout)', ('event', 'outcome'))
+
+        # Catch up and start once all cogs have registered their events
+        self.bot.lifecycle.register_startup(self.start)
+
+
+    def register_timed_event(self, event, schedule=None, name=None, after=(), timeout=None, retries=0):
+        """Run the coroutine function _event_ on _schedule_ (daily at the default time if None). A schedule set for _name_ (the function's name by default) in the [TimedTasks] section of the config takes precedence. Registering a name again replaces the event.
+
+        When due while the events named in _after_ run (e.g. when due at the same time), _event_ starts once they are done, whether they succeeded or not. It is cancelled after _timeout_ seconds (timed_event_timeout by default) and retried up to _retries_ times after failing or timing out, so only pass retries for events that are safe to run twice.
+        """
+
+        name = name or event.__name__
+        if self.depends_on(after, name):
+            raise ValueError('Timed event ' + name + ' would depend on itself')
+        rule = parse_recurrence(config.get('TimedTasks', name, fallback=schedule or self.default_schedule))
+        doc_id, last_run = self.last_runs.get(name, (None, None))
+        timed_event = self.timed_events[name] = TimedEvent(name, event, rule, list(after), timeout or self.default_timeout, retries, last_run, doc_id)
+
+        if self.timed_task is not None:
+            timed_event.next_run = self.next_run(timed_event, time.time())
+            self.wakeup.set()
+
+
+    def depends_on(self, names, name):
+        """Whether any of the events _names_ is _name_ or runs after it, directly or indirectly."""
+        seen = set()
+        pending = list(names)
+        while pending:
+            current = pending.pop()
+            if current == name:
+                return True
+            if current not in seen and current in self.timed_events:
+                seen.add(current)
+                pending.extend(self.timed_events[current].after)
+        return False
+
+
+    def next_run(self, timed_event, now):
+        return timed_event.rule.next_after(now, timed_event.last_run, self.timezone)
 
-        # If the bot dies during the day and is restarted, self.time_until_execute will be set correctly
-        # HOWEVER, if the bot is dead in that moment when it should execute its tasks and is restarted subsequently it will not execute the timed tasks.
-        # This is a known issue but 'fixed' e.g. by running a cronjob to restart the bot 5 minutes before the timed events should be executed.
 
-        self.timed_task = bot.loop.create_task(self.timed_task())
-        self.timed_events = [] # Cogs register their tasks here that should be executed
+    def format_time(self, timestamp):
+        return datetime.datetime.fromtimestamp(timestamp, self.timezone).strftime('%Y-%m-%d %H:%M %Z').strip()
 
-        # Figure out number of seconds until next time we need to execute our events
-        tomorrow = datetime.datetime.now() + datetime.timedelta(1)
 
-        execute_time = datetime.datetime(
-            year=tomorrow.year,
-            month=tomorrow.month,
-            day=tomorrow.day,
-            hour=self.hour,
-            minute=self.minute,
-            second=self.second
-        )
+    def store_last_run(self, timed_event, last_run):
+        timed_event.last_run = last_run
+        if timed_event.doc_id is None:
+            timed_event.doc_id = self.table.insert({'name': timed_event.name, 'last_run': last_run})
+        else:
+            self.table.update({'last_run': last_run}, doc_ids=[timed_event.doc_id])
+        self.last_runs[timed_event.name] = (timed_event.doc_id, last_run)
 
-        self.time_until_execute = (execute_time - datetime.datetime.now()).seconds
-        print(self.time_until_execute)
 
+    async def start(self):
+        """Start the timer loop. Events whose last scheduled run was missed while the bot was down are due right away, so they run in the background rather than holding up startup."""
 
-    def register_timed_event(self, event):
-        self.timed_events.append(event)
+        now = time.time()
+        for timed_event in self.timed_events.values():
+            if timed_event.last_run is None:
+                # Nothing to catch up on yet: from now on, missed runs will be noticed
+                self.store_last_run(timed_event, now)
+            if self.next_run(timed_event, timed_event.last_run) <= now:
+                log.info('Catching up on timed event ' + timed_event.name + ', last run at ' + self.format_time(timed_event.last_run))
+                timed_event.next_run = now
+            else:
+                timed_event.next_run = self.next_run(timed_event, now)
+                log.info('Next run of timed event ' + timed_event.name + ' (' + timed_event.rule.text + '): ' + self.format_time(timed_event.next_run))
 
+        self.timed_task = self.bot.loop.create_task(self.run_timed_events())
 
-    async def timed_task(self):
-        """Asynchronous timer loop that executes a set of tasks at a specific time. Examples are paying back loans, resetting free points, or printing holidays."""
+
+    def start_events(self, timed_events):
+        """Start running _timed_events_ in the background, each after those running events it is registered to run after."""
+
+        async def run_after(timed_event):
+            dependencies = [self.timed_events[name].task for name in timed_event.after if name in self.timed_events and self.timed_events[name].task is not None]
+            if dependencies:
+                await asyncio.wait(dependencies)
+            await self.run_event(timed_event)
+
+        def finished(timed_event, task):
+            if timed_event.task is task:
+                timed_event.task = None
+
+        # All tasks exist before the first one runs, so every dependency can be looked up
+        for timed_event in timed_events:
+            timed_event.task = self.bot.loop.create_task(run_after(timed_event))
+            timed_event.task.add_done_callback(functools.partial(finished, timed_event))
+
+
+    async def run_event(self, timed_event):
+        """Run _timed_event_ with its timeout and retries. Never raises."""
+
+        start = time.perf_counter()
+        for attempt in range(timed_event.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+            attempt_start = time.perf_counter()
+            try:
+                await asyncio.wait_for(timed_event.event(), timed_event.timeout)
+                outcome = 'success'
+            except asyncio.TimeoutError:
+                outcome = 'timeout'
+                log.error('Timed event ' + timed_event.name + ' timed out after ' + str(timed_event.timeout) + 's (attempt ' + str(attempt + 1) + ' of ' + str(timed_event.retries + 1) + ')')
+            except Exception as e:
+                outcome = 'failure'
+                log.fatal('EXCEPTION OCCURRED WHILE EXECUTING TIMED EVENT ' + timed_event.name + ' (attempt ' + str(attempt + 1) + ' of ' + str(timed_event.retries + 1) + '):')
+                log.exception(e)
+
+            self.duration_histogram.observe(timed_event.name, value=time.perf_counter() - attempt_start)
+            self.run_counter.inc(timed_event.name, outcome)
+            if outcome == 'success':
+                break
+
+        timed_event.last_duration = time.perf_counter() - start
+        timed_event.last_outcome = outcome if attempt == 0 else outcome + ' after ' + str(attempt + 1) + ' attempts'
+        if outcome == 'success':
+            self.store_last_run(timed_event, time.time())
+        else:
+            self.bot.post_log('**[ERROR]** Timed event ' + timed_event.name + ' ended with ' + timed_event.last_outcome + '. Check logs. ' + config.additional_error_message)
+
+
+    async def run_timed_events(self):
+        """Asynchronous timer loop that executes the registered events when they are due. Examples are paying back loans, resetting free points, or printing holidays."""
 
         try:
             await self.bot.wait_until_ready()
 
             while True:
-                await asyncio.sleep(self.time_until_execute)
-                self.time_until_execute = 86400  # 1 day
-
-                try:
-                    # Execute all registered events:
-                    for event in self.timed_events:
-                        await event()
-                except Exception as e:
-                    await self.bot.post_message(None, self.bot.bot_channel, '**[ERROR]** Oh no, something went wrong. ' + config.additional_error_message)
-                    log.fatal('EXCEPTION OCCURRED WHILE EXECUTING TIMED EVENT:')
-                    log.exception(e)
+                self.wakeup.clear()
+                next_run = min((timed_event.next_run for timed_event in self.timed_events.values()), default=time.time() + self.max_sleep)
+                delay = next_run - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), min(delay, self.max_sleep))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                # Start all due events and schedule their next runs right away, so this loop is free for whatever is due next
+                now = time.time()
+                due_events = [timed_event for timed_event in self.timed_events.values() if timed_event.next_run <= now]
+                for timed_event in due_events:
+                    timed_event.next_run = self.next_run(timed_event, now)
+                    if timed_event.task is not None:
+                        log.warning('Timed event ' + timed_event.name + ' is still running, skipping this run. Next run: ' + self.format_time(timed_event.next_run))
+                self.start_events([timed_event for timed_event in due_events if timed_event.task is None])
         except Exception as e:
             await self.bot.post_message(None, self.bot.bot_channel, '**[ERROR]** Oh no, something went wrong. ' + config.additional_error_message)
             log.fatal('EXCEPTION OCCURRED WHILE RUNNING TIMED EVENTS LOOP:')
             log.exception(e)
 
+    @commands.command()
+    async def timedtasks(self, context):
+        """Lists the timed events with their schedules, next and last runs, and how long their last run took and how it ended."""
+
+        BaseCog.check_not_private(self, context)
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+
+        rows = [('Event', 'Schedule', 'Next run', 'Last run', 'Took', 'Outcome')]
+        for timed_event in self.timed_events.values():
+            rows.append((
+                timed_event.name,
+                timed_event.rule.text,
+                self.format_time(timed_event.next_run) if timed_event.next_run is not None else '-',
+                self.format_time(timed_event.last_run) if timed_event.last_run is not None else '-',
+                '{:.1f}s'.format(timed_event.last_duration) if timed_event.last_duration is not None else '-',
+                'running' if timed_event.task is not None else timed_event.last_outcome or 'not run yet',
+            ))
+
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        result = '```Timed events' + linesep + linesep
+        for row in rows:
+            result += '  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + linesep
+        result += '```'
+        await self.bot.post_message(context, self.bot.bot_channel, result)
+
+
     def cog_unload(self):
-        """Cancel timed task on cog unload."""
-        self.timed_task.cancel()
+        """Cancel timed task and running events on cog unload."""
+        self.bot.lifecycle.unregister(self.start)
+        if self.timed_task is not None:
+            self.timed_task.cancel()
+        for timed_event in self.timed_events.values():
+            if timed_event.task is not None:
+                timed_event.task.cancel()
 
 
 async def setup(bot):
@@ -0,0 +1,97 @@
+"""Micro-benchmark of the per-message cost of the server bridge's on_message dispatch.
+
+Runs entirely offline against minimal stand-ins for discord objects. Run from the bot's root directory:
+
+    python -m benchmarks.bridge_dispatch [iterations]
+
+For a growing number of bridges and channels per bridge, this reports the time spent in ServerBridge.on_message for a message in a non-bridged channel and for an echo of one of our own webhooks (the message that would otherwise ping-pong), next to the linear webhook scan that used to be done for the latter.
+"""
+
+import asyncio
+import itertools
+import sys
+import time
+import types
+
+import discord
+from benchmarks.fake_discord import prepare_config
+from metrics import MetricsRegistry
+
+prepare_config()
+
+from Cogs.bridge import ServerBridge
+
+ids = itertools.count(1)
+
+
+class FakeBot:
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.log_channel = None
+        self.info_text = ''
+        self.metrics = MetricsRegistry()
+
+    def get_channel(self, channel_id):
+        return None
+
+    def post_log(self, text):
+        pass
+
+
+def make_message(channel_id, webhook_id=None):
+    """Build the few message attributes on_message looks at."""
+    return types.SimpleNamespace(
+        id=next(ids),
+        type=discord.MessageType.default,
+        channel=types.SimpleNamespace(id=channel_id),
+        author=types.SimpleNamespace(id=next(ids)),
+        webhook_id=webhook_id,
+        content='benchmark')
+
+
+def make_bridge(bridge_count, channels_per_bridge):
+    """Build a ServerBridge with all webhooks already resolved, as after on_ready()."""
+    bridge = ServerBridge(FakeBot())
+    bridge.bridges = [[next(ids) for _ in range(channels_per_bridge)] for _ in range(bridge_count)]
+    for bridge_index, channel_ids in enumerate(bridge.bridges):
+        for channel_id in channel_ids:
+            bridge.webhooks[channel_id] = (types.SimpleNamespace(id=next(ids), channel_id=channel_id), bridge_index)
+    bridge.update_webhook_ids()
+    return bridge
+
+
+async def legacy_is_own_webhook(bridge, message):
+    """The loop over all webhooks that on_message used before webhook ids were kept in a set."""
+    if bridge.webhooks.get(message.channel.id):
+        if message.webhook_id:
+            for channel_id, (webhook, bridge_index) in bridge.webhooks.items():
+                if message.webhook_id == webhook.id:
+                    return True
+    return False
+
+
+async def time_per_call(function, bridge, message, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await function(bridge, message)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+async def main(iterations):
+    print('bridges  channels/bridge  webhooks  unbridged (ns)  own echo (ns)  own echo, linear scan (ns)')
+    for bridge_count, channels_per_bridge in itertools.product([1, 4, 16, 64], [2, 4, 8]):
+        bridge = make_bridge(bridge_count, channels_per_bridge)
+
+        # The echo of the last webhook is the worst case for the linear scan
+        last_channel_id = bridge.bridges[-1][-1]
+        unbridged = make_message(next(ids))
+        echo = make_message(last_channel_id, bridge.webhooks[last_channel_id][0].id)
+
+        unbridged_ns = await time_per_call(ServerBridge.on_message, bridge, unbridged, iterations)
+        echo_ns = await time_per_call(ServerBridge.on_message, bridge, echo, iterations)
+        legacy_ns = await time_per_call(legacy_is_own_webhook, bridge, echo, iterations)
+        print('{:>7}  {:>15}  {:>8}  {:>14.0f}  {:>13.0f}  {:>26.0f}'.format(bridge_count, channels_per_bridge, len(bridge.webhooks), unbridged_ns, echo_ns, legacy_ns))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,322 @@
+"""Throughput and latency benchmark of the server bridge against fake discord channels and webhooks.
+
+Runs entirely offline. Run from the bot's root directory, e.g.:
+
+    python -m benchmarks.bridge_throughput --messages 2000 --channels 4 --latency 0.05 --rate-limit 5
+
+Synthetic traffic (short and long messages, replies, attachments, edits and deletes) is driven through ServerBridge.on_message, on_message_edit and on_message_delete, just like the bot client would. REST calls of the fake webhooks and channels take --latency seconds and are rate limited per webhook/channel if --rate-limit is given.
+Reported are the rate of forwarded messages, the forward/edit/delete latencies (from the gateway event until the first webhook request for it completes in a destination channel), the time spent in the event handlers and the memory held by the bridge caches.
+With --worker, the events are passed through the LocalTransport of bridge_worker.py instead, the way a separate bridge worker process receives them; handler times then only cover handing the event over.
+With the same arguments, the traffic is identical between runs, so results can be compared run to run; --json writes them to a file for that purpose.
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import copy
+import io
+import json
+import logging
+import random
+import sys
+import time
+import types
+
+from benchmarks.fake_discord import prepare_config, FakeRest, FakeBot, FakeChannel, FakeGuild, FakeUser, FakeMessage, FakeAttachment
+
+prepare_config()
+
+# Queue depth warnings would flood the output when running without a rate; errors and warnings posted to the log channel are counted instead
+logging.disable(logging.WARNING)
+
+from Cogs.bridge import ServerBridge
+from bridge_worker import LocalTransport
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'points', 'bridge', 'horse', 'duel', 'season', '**bold**', '_italic_', 'https://example.com/some/page']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def deep_size(obj, seen):
+    """Approximate memory held by _obj_, not counting anything in _seen_ (e.g. shared objects)."""
+
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif not isinstance(obj, (str, bytes, int, float)):
+        if hasattr(obj, '__dict__'):
+            size += deep_size(vars(obj), seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+class Recorder:
+    """Observes all webhook requests and measures how long each gateway event took to show up in every destination channel."""
+
+    def __init__(self):
+        self.sent_at = {} # original message id -> time of on_message
+        self.edited_at = {} # (original message id, edit number) -> time of on_message_edit
+        self.deleted_at = {} # original message id -> time of on_message_delete
+        self.seen = set()
+        self.forward_latencies = []
+        self.edit_latencies = []
+        self.delete_latencies = []
+        self.forwarded = set()
+        self.sampled_edits = set() # Keys of edited_at that showed up in at least one destination channel
+        self.last_request = 0.0
+
+    def record(self, latencies, key, started, now):
+        if key not in self.seen:
+            self.seen.add(key)
+            latencies.append(now - started)
+
+    def observe(self, action, message, now):
+        self.last_request = now
+
+        # Every original message starts with its id as a marker (#id, #id/edit number once edited), so its first chunk can be recognized (also when coalesced)
+        for line in message.content.split('\n'):
+            marker = line.split(' ', 1)[0]
+            if not marker.startswith('#') or not marker[1:].replace('/', '', 1).isdigit():
+                continue
+            original_id, _, edit = marker[1:].partition('/')
+            original_id = int(original_id)
+            if action == 'send' and original_id in self.sent_at:
+                self.forwarded.add(original_id)
+                self.record(self.forward_latencies, ('send', original_id, message.channel.id), self.sent_at[original_id], now)
+            elif action == 'edit' and (original_id, edit) in self.edited_at:
+                self.sampled_edits.add((original_id, edit))
+                self.record(self.edit_latencies, ('edit', original_id, edit, message.channel.id), self.edited_at[original_id, edit], now)
+            elif action == 'delete' and original_id in self.deleted_at:
+                self.record(self.delete_latencies, ('delete', original_id, message.channel.id), self.deleted_at[original_id], now)
+
+
+class Traffic:
+    """Generates reproducible synthetic traffic in the bridged channels."""
+
+    def __init__(self, dispatch, recorder, channels, seed):
+        self.dispatch = dispatch # Coroutine function taking the event name and its arguments
+        self.recorder = recorder
+        self.channels = channels
+        self.random = random.Random(seed)
+        self.users = [FakeUser('user' + str(i)) for i in range(20)]
+        self.originals = [] # Latest versions of the messages that can still be edited or deleted
+        self.edits = 0
+        self.handler_times = collections.defaultdict(list)
+        self.counts = collections.Counter()
+
+    def text(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def new_message(self, kind):
+        channel = self.random.choice(self.channels)
+        reference = None
+        attachments = []
+        if kind == 'long':
+            text = '\n\n'.join(self.text(self.random.randint(20, 120)) for _ in range(self.random.randint(5, 30)))
+        elif kind == 'reply' and channel.messages:
+            recent = list(channel.messages.values())[-50:]
+            reference = self.random.choice(recent)
+            text = self.text(self.random.randint(1, 30))
+        elif kind == 'attachment':
+            text = self.text(self.random.randint(0, 10))
+            for _ in range(self.random.randint(1, 3)):
+                if self.random.random() < 0.7:
+                    attachments.append(FakeAttachment('image.png', 'image/png', self.random.randint(10000, 5000000)))
+                else:
+                    attachments.append(FakeAttachment('notes.txt', 'text/plain', self.random.randint(100, 100000)))
+        else:
+            text = self.text(self.random.randint(1, 30))
+
+        message = FakeMessage(channel, self.random.choice(self.users), '', reference=reference, attachments=attachments)
+        message.content = '#' + str(message.id) + ' ' + text
+        channel.messages[message.id] = message
+        return message
+
+    async def timed(self, name, coroutine):
+        start = time.perf_counter()
+        await coroutine
+        self.handler_times[name].append(time.perf_counter() - start)
+        self.counts[name] += 1
+
+    async def step(self):
+        roll = self.random.random()
+        now = asyncio.get_running_loop().time
+        if roll < 0.06 and self.originals:
+            message = self.originals.pop(self.random.randrange(len(self.originals)))
+            message.channel.messages.pop(message.id, None)
+            self.recorder.deleted_at[message.id] = now()
+            await self.timed('delete', self.dispatch('on_message_delete', message))
+        elif roll < 0.16 and self.originals:
+            # The bridge may still hold the previous version in a send queue, so the edited message is a new object like with discord.py
+            index = self.random.randrange(len(self.originals))
+            before = self.originals[index]
+            after = copy.copy(before)
+            self.edits += 1
+            edit = str(self.edits)
+            after.content = '#' + str(after.id) + '/' + edit + ' ' + self.text(self.random.randint(1, 30)) + ' (edited)'
+            self.originals[index] = after.channel.messages[after.id] = after
+            self.recorder.edited_at[after.id, edit] = now()
+            await self.timed('edit', self.dispatch('on_message_edit', before, after))
+        else:
+            kind = self.random.choices(['short', 'long', 'reply', 'attachment'], [65, 8, 15, 12])[0]
+            message = self.new_message(kind)
+            self.recorder.sent_at[message.id] = now()
+            self.originals.append(message)
+            await self.timed(kind, self.dispatch('on_message', message))
+
+
+def queues_idle(bridge, rest):
+    return rest.in_flight == 0 and all(not send_queue.jobs and not send_queue.wakeup.is_set() for send_queue in bridge.send_queues.values())
+
+
+async def run(args):
+    rest = FakeRest(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit, rate_period=args.rate_period, seed=args.seed)
+    channels = []
+    for bridge_index in range(args.bridges):
+        for channel_index in range(args.channels):
+            channels.append(FakeChannel(rest, 'bridge' + str(bridge_index) + '-' + str(channel_index), FakeGuild('server' + str(channel_index))))
+
+    bot = FakeBot(channels)
+    bridge = ServerBridge(bot)
+    bridge.bridges = [[channel.id for channel in channels[i * args.channels:(i + 1) * args.channels]] for i in range(args.bridges)]
+    bridge.coalesce_messages = args.coalesce
+
+    transport = None
+    if args.worker:
+        transport = LocalTransport(bot)
+        transport.worker.bridge = bridge
+        with contextlib.redirect_stdout(io.StringIO()):
+            await transport.start()
+
+        async def dispatch(event, *event_args):
+            transport.put(event, *event_args)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await bridge.on_ready()
+
+        async def dispatch(event, *event_args):
+            await getattr(bridge, event)(*event_args)
+
+    recorder = Recorder()
+    for channel in channels:
+        for webhook in channel.channel_webhooks:
+            webhook.observer = recorder.observe
+    setup_requests = rest.requests
+
+    traffic = Traffic(dispatch, recorder, channels, args.seed)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for _ in range(args.messages):
+        await traffic.step()
+        if args.rate:
+            await asyncio.sleep(traffic.random.expovariate(args.rate))
+    traffic_end = loop.time()
+
+    # Wait until everything has been forwarded
+    if transport is not None:
+        await asyncio.wait_for(transport.join(), args.timeout)
+    idle_checks = 0
+    while idle_checks < 3 and loop.time() - traffic_end < args.timeout:
+        await asyncio.sleep(0.01)
+        idle_checks = idle_checks + 1 if queues_idle(bridge, rest) else 0
+    drained = idle_checks >= 3
+    end = max(recorder.last_request, traffic_end)
+
+    cache_bytes = deep_size([bridge.message_cache, bridge.message_index, bridge.reply_cache], set())
+    if transport is not None:
+        transport.stop()
+    else:
+        bridge.cog_unload()
+
+    originals = len(recorder.sent_at)
+    handler_times = [duration for durations in traffic.handler_times.values() for duration in durations]
+    return {
+        'arguments': vars(args),
+        'drained': drained,
+        'events': dict(traffic.counts),
+        'duration': end - start,
+        'forwarded_messages': len(recorder.forwarded),
+        'messages_per_second': len(recorder.forwarded) / (end - start) if end > start else 0.0,
+        'forward_latency_samples': len(recorder.forward_latencies),
+        'forward_latency_p50': percentile(recorder.forward_latencies, 0.5),
+        'forward_latency_p99': percentile(recorder.forward_latencies, 0.99),
+        'edit_latency_samples': len(recorder.edit_latencies),
+        'edits_without_sample': len(recorder.edited_at) - len(recorder.sampled_edits),
+        'edit_latency_p50': percentile(recorder.edit_latencies, 0.5),
+        'edit_latency_p99': percentile(recorder.edit_latencies, 0.99),
+        'delete_latency_samples': len(recorder.delete_latencies),
+        'delete_latency_p50': percentile(recorder.delete_latencies, 0.5),
+        'delete_latency_p99': percentile(recorder.delete_latencies, 0.99),
+        'handler_time_samples': len(handler_times),
+        'handler_time_p50': percentile(handler_times, 0.5),
+        'handler_time_p99': percentile(handler_times, 0.99),
+        'rest_requests': rest.requests - setup_requests,
+        'rate_limited_requests': rest.rate_limited,
+        'max_queue_depth': max((send_queue.max_depth for send_queue in bridge.send_queues.values()), default=0),
+        'cached_messages': len(bridge.message_index),
+        'cache_bytes': cache_bytes,
+        'cache_bytes_per_message': cache_bytes / max(1, len(bridge.message_index)),
+        'reply_cache_hits': bridge.reply_cache.hits,
+        'reply_cache_fetches': bridge.reply_cache.fetches,
+        'log_channel_messages': len(bot.log_channel.sent),
+        'original_messages': originals,
+    }
+
+
+def report(result):
+    print('Forwarded {} of {} messages{} in {:.2f}s: {:.1f} messages/s'.format(result['forwarded_messages'], result['original_messages'], '' if result['drained'] else ' (NOT DRAINED)', result['duration'], result['messages_per_second']))
+    print('Events: ' + ', '.join(str(count) + ' ' + name for name, count in sorted(result['events'].items())))
+    print()
+    print('                      samples    p50 (ms)    p99 (ms)')
+    for name in ['forward_latency', 'edit_latency', 'delete_latency', 'handler_time']:
+        print('{:<20}  {:>7}    {:>8.2f}    {:>8.2f}'.format(name.replace('_', ' '), result[name + '_samples'], result[name + '_p50'] * 1000, result[name + '_p99'] * 1000))
+    if result['edits_without_sample']:
+        print('Edits that never showed up in a destination channel (e.g. of messages no longer in the bridge cache): {}'.format(result['edits_without_sample']))
+    print()
+    print('REST requests: {} ({} waited for rate limits), max send queue depth: {}'.format(result['rest_requests'], result['rate_limited_requests'], result['max_queue_depth']))
+    print('Cache: {} messages, {:.1f} KiB ({:.0f} bytes/message), reply cache hits: {}, fetches: {}'.format(result['cached_messages'], result['cache_bytes'] / 1024, result['cache_bytes_per_message'], result['reply_cache_hits'], result['reply_cache_fetches']))
+    if result['log_channel_messages']:
+        print('Errors and warnings posted to the log channel: {}'.format(result['log_channel_messages']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the server bridge against fake discord channels.')
+    parser.add_argument('--messages', type=int, default=1000, help='number of gateway events to generate')
+    parser.add_argument('--bridges', type=int, default=1)
+    parser.add_argument('--channels', type=int, default=3, help='channels per bridge')
+    parser.add_argument('--rate', type=float, default=0.0, help='average events per second (0: as fast as possible)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per REST request')
+    parser.add_argument('--jitter', type=float, default=0.01, help='additional random seconds per REST request')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per webhook/channel and rate period (0: unlimited)')
+    parser.add_argument('--rate-period', type=float, default=2.0, help='seconds per rate limit period')
+    parser.add_argument('--coalesce', action='store_true', help='enable coalescing of short messages')
+    parser.add_argument('--worker', action='store_true', help='pass events through the bridge worker\'s local transport')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds to wait for the send queues to drain')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(result, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
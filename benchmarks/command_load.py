@@ -0,0 +1,225 @@
+"""Load benchmark of the bot's commands against databases of different sizes.
+
+Runs entirely offline. Run from the bot's root directory, e.g.:
+
+    python -m benchmarks.command_load --users 100,10000 --commands 500 --concurrency 4
+
+For every database size, a real EconomyBot (see benchmarks/offline_bot.py) is started on a freshly generated database with that many users, and a reproducible mix of commands is replayed against it: !give, !check, !top, label shows (!show <label> and the !<label> shortcut) and horse race bets. --mix changes the weights.
+Horse races are started in the background whenever a bet finds no race to join, and bets wait for a race to open. Neither the races nor that waiting count towards the latencies.
+Reported are the throughput, the latency percentiles per command kind, and the bytes and number of database writes (TinyDB rewrites the whole file on every write). Each size stops after --commands commands or --duration seconds, whichever comes first; --json writes the results to a file to compare them run to run.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.fake_discord import FakeRest
+from benchmarks.offline_bot import OfflineBot, prepare_bot_config, populate_database, user_name
+
+# Expected errors (unknown labels, empty balances) would flood the output; they are counted as failed commands instead
+logging.disable(logging.CRITICAL)
+
+DEFAULT_MIX = 'give=35,check=25,top=10,show=20,bet=10'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, weight = item.split('=')
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - set(CommandMix.kinds)
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown command kinds: ' + ', '.join(sorted(unknown)))
+    return mix
+
+
+class CommandMix:
+    """Generates a reproducible sequence of (kind, author, command text) in the given proportions."""
+
+    kinds = ('give', 'check', 'top', 'show', 'bet')
+
+    def __init__(self, mix, users, labels, active_users, seed):
+        self.random = random.Random(seed)
+        self.kinds_by_weight = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds_by_weight]
+        self.users = users
+        self.labels = labels
+        # Most activity comes from a small part of the users, as on the real server
+        self.active_users = min(users, active_users)
+
+    def author(self):
+        return user_name(self.random.randrange(self.active_users))
+
+    def other_user(self):
+        return user_name(self.random.randrange(self.users))
+
+    def next(self):
+        kind = self.random.choices(self.kinds_by_weight, self.weights)[0]
+        author = self.author()
+
+        if kind == 'give':
+            text = '!give ' + self.other_user() + ' ' + str(self.random.randint(1, 5)) + ' "for the help"'
+        elif kind == 'check':
+            roll = self.random.random()
+            text = '!check' if roll < 0.5 else '!check ' + self.other_user() if roll < 0.9 else '!check all'
+        elif kind == 'top':
+            text = '!top' if self.random.random() < 0.7 else '!top ' + self.random.choice(['given', 'received', 'race_winnings', 'br_wins'])
+        elif kind == 'show':
+            label = 'label' + str(self.random.randrange(self.labels)) if self.random.random() < 0.9 else 'nolabel'
+            text = ('!show ' + label) if self.random.random() < 0.5 else '!' + label
+        else:
+            text = '!bet ' + str(self.random.randint(1, 10)) + ' ' + str(self.random.randint(1, 10))
+        return kind, author, text
+
+
+async def run_size(args, users, directory):
+    prepare_bot_config(directory)
+    populate_database(os.path.join(directory, 'economy.json'), users, args.labels, args.seed)
+
+    rest = FakeRest(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    offline = OfflineBot(rest)
+    bot = await offline.start()
+    horserace = bot.get_cog('Horserace')
+
+    mix = CommandMix(args.mix, users, args.labels, args.active_users, args.seed)
+    latencies = collections.defaultdict(list)
+    failures = collections.Counter()
+    races = []
+    issued = 0
+    deadline = time.perf_counter() + args.duration
+
+    def failed(message):
+        return '\U0000274C' in message.reactions or '\U00002753' in message.reactions
+
+    async def worker():
+        nonlocal issued
+        while issued < args.commands and time.perf_counter() < deadline:
+            issued += 1
+            kind, author, text = mix.next()
+
+            if kind == 'bet' and horserace.race_closed:
+                if not races or races[-1].done():
+                    # Nobody to bet with, so open a race like a real user would; it runs in the background
+                    races.append(asyncio.get_running_loop().create_task(offline.command(author, '!horserace' + text[len('!bet'):])))
+                    continue
+                # Wait for the next race to open rather than placing a bet that is too late
+                while horserace.race_closed and not races[-1].done():
+                    await asyncio.sleep(0.01)
+                if horserace.race_closed:
+                    continue
+
+            start = time.perf_counter()
+            message = await offline.command(author, text)
+            latencies[kind].append(time.perf_counter() - start)
+            if failed(message):
+                failures[kind] += 1
+
+    def database_writes():
+        """(bytes, writes, seconds) of all database writes so far."""
+        write_bytes = bot.metrics.get('database_write_bytes').values.values()
+        write_seconds = bot.metrics.get('database_write_seconds').values.values()
+        return sum(total for buckets, total, count in write_bytes), sum(count for buckets, total, count in write_bytes), sum(total for buckets, total, count in write_seconds)
+
+    # Setting up the cogs writes to the database as well
+    setup_writes = database_writes()
+    setup_requests = rest.requests
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    end = time.perf_counter()
+
+    # Let running races finish, so that their database writes are counted too
+    if races:
+        await asyncio.wait(races, timeout=args.race_timeout)
+    for race in races:
+        race.cancel()
+
+    database_bytes, database_write_count, database_write_time = (total - setup for total, setup in zip(database_writes(), setup_writes))
+    instrumentation = bot.instrumentation.dump()
+    await offline.stop()
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    commands = len(all_latencies)
+    result = {
+        'users': users,
+        'database_file_bytes': os.path.getsize(os.path.join(directory, 'economy.json')),
+        'commands': commands,
+        'races_started': len(races),
+        'duration': end - start,
+        'commands_per_second': commands / (end - start) if end > start else 0.0,
+        'database_bytes_written': database_bytes,
+        'database_writes': database_write_count,
+        'database_write_seconds': database_write_time,
+        'rest_requests': rest.requests - setup_requests,
+        'kinds': {},
+        'instrumentation': instrumentation,
+    }
+    for kind, values in sorted(latencies.items()) + [('all', all_latencies)]:
+        result['kinds'][kind] = {
+            'count': len(values),
+            'failed': failures[kind] if kind != 'all' else sum(failures.values()),
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': max(values, default=0.0),
+        }
+    return result
+
+
+async def run(args):
+    results = []
+    for users in args.users:
+        with tempfile.TemporaryDirectory(prefix='command_load') as directory:
+            results.append(await run_size(args, users, directory))
+        report(results[-1])
+    return {'arguments': {name: value for name, value in vars(args).items()}, 'results': results}
+
+
+def report(result):
+    print('{} users ({:.1f} MiB database): {} commands in {:.2f}s: {:.1f} commands/s'.format(result['users'], result['database_file_bytes'] / 1048576, result['commands'], result['duration'], result['commands_per_second']))
+    print()
+    print('            count  failed    p50 (ms)    p95 (ms)    p99 (ms)    max (ms)')
+    for kind, stats in result['kinds'].items():
+        print('{:<10}  {:>5}  {:>6}    {:>8.1f}    {:>8.1f}    {:>8.1f}    {:>8.1f}'.format(kind, stats['count'], stats['failed'], stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+    print()
+    print('Database: {:.1f} MiB written in {} writes ({:.1f} KiB/command), {:.2f}s spent writing'.format(result['database_bytes_written'] / 1048576, result['database_writes'], result['database_bytes_written'] / 1024 / max(1, result['commands']), result['database_write_seconds']))
+    print('REST requests: {} ({:.2f}/command), horse races started: {}'.format(result['rest_requests'], result['rest_requests'] / max(1, result['commands']), result['races_started']))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot\'s commands offline against databases of different sizes.')
+    parser.add_argument('--users', type=lambda text: [int(users) for users in text.split(',')], default=[100, 10000, 100000], help='comma separated database sizes (registered users) to run against')
+    parser.add_argument('--labels', type=int, default=200, help='labels in the database')
+    parser.add_argument('--active-users', type=int, default=200, help='users that issue commands (recipients of !give and !check are drawn from all users)')
+    parser.add_argument('--commands', type=int, default=500, help='commands per database size')
+    parser.add_argument('--duration', type=float, default=60.0, help='maximum seconds per database size')
+    parser.add_argument('--concurrency', type=int, default=1, help='commands in flight at once')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help='weights of the command kinds (default: ' + DEFAULT_MIX + ')')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per REST request of the bot')
+    parser.add_argument('--jitter', type=float, default=0.0, help='additional random seconds per REST request')
+    parser.add_argument('--race-timeout', type=float, default=60.0, help='seconds to wait for running horse races at the end')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(result, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
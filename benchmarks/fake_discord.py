@@ -0,0 +1,314 @@
+"""In-process stand-ins for the discord objects the server bridge and the bot's commands use, so that they can be benchmarked without any discord servers.
+
+Only what the bridge and the commands actually touch is implemented. All REST calls go through a FakeRest instance, which adds artificial latency and enforces per-route rate limits the way discord.py does (by waiting them out).
+"""
+
+import asyncio
+import datetime
+import itertools
+import random
+import types
+
+import discord
+from conf import config
+from metrics import MetricsRegistry
+
+
+def prepare_config():
+    """Fill in the few settings of the main config the bridge needs, so that benchmarks don't require a bot.ini."""
+
+    for name, value in (('additional_error_message', ''), ('repost_attempts', 1)):
+        if not hasattr(config, name):
+            setattr(config, name, value)
+
+
+_ids = itertools.count(100000)
+
+def next_id():
+    return next(_ids)
+
+
+def http_error(error_type, status, reason, code=0):
+    """Build a discord.py HTTP exception without a real response."""
+
+    response = types.SimpleNamespace(status=status, reason=reason, headers={})
+    return error_type(response, {'code': code, 'message': reason})
+
+
+class FakeRest:
+    """Simulates the timing of discord's REST API. Every request takes _latency_ seconds (plus up to _jitter_) and each route (a webhook or channel) allows _rate_limit_ requests per _rate_period_ seconds; further requests wait for the next period, as discord.py would. A _rate_limit_ of 0 disables rate limits."""
+
+    def __init__(self, latency=0.02, jitter=0.0, rate_limit=0, rate_period=2.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.random = random.Random(seed)
+        self.windows = {} # route -> (window start, requests in window)
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+
+    async def request(self, route):
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            if self.rate_limit:
+                loop = asyncio.get_running_loop()
+                while True:
+                    now = loop.time()
+                    window_start, count = self.windows.get(route, (now, 0))
+                    if now - window_start >= self.rate_period:
+                        window_start, count = now, 0
+                    if count < self.rate_limit:
+                        self.windows[route] = (window_start, count + 1)
+                        break
+                    self.rate_limited += 1
+                    await asyncio.sleep(window_start + self.rate_period - now)
+
+            await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+        finally:
+            self.in_flight -= 1
+
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeUser:
+    def __init__(self, name, user_id=None):
+        self.id = user_id if user_id is not None else next_id()
+        self.name = name
+        self.display_name = name
+        self.display_avatar = FakeAsset('https://cdn.example.com/avatars/' + str(self.id) + '.png')
+        self.avatar = self.display_avatar
+        self.mention = '<@' + str(self.id) + '>'
+        self.bot = False
+
+
+class FakeRole:
+    def __init__(self, name, role_id=None):
+        self.id = role_id if role_id is not None else next_id()
+        self.name = name
+        self.mention = '<@&' + str(self.id) + '>'
+
+
+class FakeMember(FakeUser):
+    """A member of a guild who issues commands. Private messages to them end up in their own FakeDMChannel."""
+
+    def __init__(self, rest, name, guild, roles=()):
+        super().__init__(name)
+        self.guild = guild
+        self.roles = list(roles)
+        self.dm_channel = FakeDMChannel(rest, self)
+
+    async def send(self, content=None, embed=None, file=None):
+        return await self.dm_channel.send(content, embed=embed)
+
+
+class FakeAttachment:
+    def __init__(self, filename, content_type, size):
+        self.id = next_id()
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.description = None
+        self.url = 'https://cdn.example.com/attachments/' + str(self.id) + '/' + filename
+
+    def is_spoiler(self):
+        return self.filename.startswith('SPOILER_')
+
+
+class FakeReference:
+    def __init__(self, message):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.cached_message = None # Like a reply to a message discord.py doesn't have cached
+
+
+class FakeMessage:
+    _state = None # discord.py's commands.Context only stores it
+
+    def __init__(self, channel, author, content, webhook_id=None, reference=None, attachments=None, embeds=None):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.webhook_id = webhook_id
+        self.reference = FakeReference(reference) if reference is not None else None
+        self.type = discord.MessageType.reply if reference is not None else discord.MessageType.default
+        self.attachments = attachments or []
+        self.embeds = embeds or []
+        self.mentions = []
+        self.pinned = False
+        self.reactions = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    @property
+    def clean_content(self):
+        return self.content
+
+    async def add_reaction(self, emoji):
+        await self.channel.rest.request(('channel', self.channel.id))
+        self.reactions.append(emoji)
+
+    async def delete(self):
+        await self.channel.rest.request(('channel', self.channel.id))
+        self.channel.messages.pop(self.id, None)
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def pin(self):
+        await self.channel.rest.request(('channel', self.channel.id))
+        self.channel.get_message(self.id).pinned = True
+
+    async def unpin(self):
+        await self.channel.rest.request(('channel', self.channel.id))
+        self.channel.get_message(self.id).pinned = False
+
+
+class FakeWebhook:
+    """A channel webhook. _observer_ (if set) is called with (action, webhook message, time) after every send, edit and delete."""
+
+    def __init__(self, channel, name):
+        self.id = next_id()
+        self.name = name
+        self.channel = channel
+        self.channel_id = channel.id
+        self.observer = None
+
+    def notify(self, action, message):
+        if self.observer:
+            self.observer(action, message, asyncio.get_running_loop().time())
+
+    async def send(self, content=None, wait=False, username=None, avatar_url=None, tts=False, embed=None, embeds=None, allowed_mentions=None, files=None):
+        await self.channel.rest.request(('webhook', self.id))
+        if not content and not embeds and not embed and not files:
+            raise http_error(discord.HTTPException, 400, 'Cannot send an empty message', 50006)
+        if content and len(content) > 2000:
+            raise http_error(discord.HTTPException, 400, 'Invalid Form Body', 50035)
+
+        message = FakeMessage(self.channel, FakeUser(username or self.name, self.id), content or '', webhook_id=self.id, embeds=list(embeds or []))
+        self.channel.messages[message.id] = message
+        self.notify('send', message)
+        return message
+
+    async def edit_message(self, message_id, content=None, embeds=None, embed=None, allowed_mentions=None, attachments=None):
+        await self.channel.rest.request(('webhook', self.id))
+        message = self.channel.get_message(message_id)
+        if content is not None:
+            message.content = content
+        if embeds is not None:
+            message.embeds = list(embeds)
+        self.notify('edit', message)
+        return message
+
+    async def delete_message(self, message_id):
+        await self.channel.rest.request(('webhook', self.id))
+        message = self.channel.messages.pop(message_id, None)
+        if message is None:
+            raise http_error(discord.NotFound, 404, 'Unknown Message', 10008)
+        self.notify('delete', message)
+
+
+class FakeGuild:
+    def __init__(self, name):
+        self.id = next_id()
+        self.name = name
+        self.roles = []
+
+
+class FakeChannel:
+    def __init__(self, rest, name, guild=None):
+        self.id = next_id()
+        self.name = name
+        self.guild = guild or FakeGuild(name + '-server')
+        self.rest = rest
+        self.messages = {}
+        self.channel_webhooks = []
+
+    def get_message(self, message_id):
+        message = self.messages.get(message_id)
+        if message is None:
+            raise http_error(discord.NotFound, 404, 'Unknown Message', 10008)
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+    async def fetch_message(self, message_id):
+        await self.rest.request(('channel', self.id))
+        return self.get_message(message_id)
+
+    async def webhooks(self):
+        await self.rest.request(('channel', self.id))
+        return list(self.channel_webhooks)
+
+    async def create_webhook(self, name):
+        await self.rest.request(('channel', self.id))
+        webhook = FakeWebhook(self, name)
+        self.channel_webhooks.append(webhook)
+        return webhook
+
+    def history(self, limit=100):
+        async def iterate():
+            for message in sorted(self.messages.values(), key=lambda message: message.id, reverse=True)[:limit]:
+                yield message
+        return iterate()
+
+    async def delete_messages(self, messages):
+        await self.rest.request(('channel', self.id))
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+    async def send(self, content=None, embed=None):
+        await self.rest.request(('channel', self.id))
+        message = FakeMessage(self, FakeUser('bot'), content or '', embeds=[embed] if embed else None)
+        self.messages[message.id] = message
+        return message
+
+
+class FakeDMChannel(FakeChannel):
+    def __init__(self, rest, recipient):
+        super().__init__(rest, recipient.name + '-dm')
+        self.guild = None
+        self.recipient = recipient
+
+
+class FakeLogChannel:
+    """Collects everything the bot would post in its log channel."""
+
+    def __init__(self):
+        self.id = next_id()
+        self.name = 'log'
+        self.sent = []
+
+    async def send(self, content=None, embed=None):
+        self.sent.append(content)
+
+
+class FakeBot:
+    def __init__(self, channels=()):
+        self.loop = asyncio.get_running_loop()
+        self.log_channel = FakeLogChannel()
+        self.info_text = ''
+        self.http_session = None
+        self.metrics = MetricsRegistry()
+        self.channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_cog(self, name):
+        return None
+
+    def post_log(self, text):
+        # Collected right away rather than batched like LogSink does, so that every entry is counted
+        self.log_channel.sent.append(text)
@@ -0,0 +1,197 @@
+"""Fuzz check and benchmark of the shared message chunker against the two splitters it replaced.
+
+Run from the bot's root directory:
+
+    python -m benchmarks.message_chunking --messages 2000 --seed 0
+
+First, split_text is run over a random corpus of markdown-ish messages (code blocks with and without language, mentions, custom emoji, emoji sequences, surrogate pairs, long URLs and words, blank lines) at several limits, and every result is checked:
+  - no chunk is longer than the limit or empty,
+  - every chunk has balanced code fences, and fences are only added where a code block was cut,
+  - no chunk starts or ends inside a surrogate pair, emoji sequence or a mention that would fit into a chunk,
+  - chunks cover the message in order, dropping nothing but whitespace at split points.
+Then the time per message is compared with the former bridge and bot splitters for growing message sizes, as well as the number of chunks that change after a one-word edit at the end of a message.
+"""
+
+import argparse
+import random
+import time
+
+from chunking import split_text, _split_spans, _TOKEN, _joined
+
+LIMITS = [2000, 500, 100, 40]
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'points', 'bridge', 'horse', 'duel', 'season', '**bold**', '_italic_', '`inline`', '||spoiler||', '> quote']
+TOKENS = ['<@123456789012345678>', '<@!123456789012345678>', '<@&987654321098765432>', '<#111111111111111111>', '<:pt:222222222222222222>', '<a:dance:333333333333333333>', '<t:1700000000:R>', '</points check:444444444444444444>']
+SEQUENCES = ['\U0001f468\u200d\U0001f469\u200d\U0001f467', '\U0001f44d\U0001f3fd', '\u2764\ufe0f', 'e\u0301', '\ud83d\ude00', '\U0001f600']
+LANGUAGES = ['', 'py', 'cpp', 'json', 'diff']
+
+
+def random_line(rng):
+    parts = []
+    for _ in range(rng.randint(0, 20)):
+        roll = rng.random()
+        if roll < 0.1:
+            parts.append(rng.choice(TOKENS))
+        elif roll < 0.2:
+            parts.append(rng.choice(SEQUENCES) * rng.randint(1, 3))
+        elif roll < 0.22:
+            parts.append('https://example.com/' + 'a' * rng.randint(10, 300))
+        elif roll < 0.24:
+            # Words without any break opportunity
+            parts.append(rng.choice(SEQUENCES + TOKENS + ['x']) * rng.randint(10, 100))
+        else:
+            parts.append(rng.choice(WORDS))
+    return ' '.join(parts)
+
+
+def random_message(rng):
+    blocks = []
+    for _ in range(rng.randint(1, 8)):
+        lines = [random_line(rng) for _ in range(rng.randint(1, 8))]
+        if rng.random() < 0.3:
+            lines = ['```' + rng.choice(LANGUAGES)] + lines + ['```']
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def check(text, limit):
+    chunks = split_text(text, limit)
+    if len(text) <= limit:
+        assert chunks == ([text] if text else []), 'short message was changed'
+        return chunks
+
+    spans = list(_split_spans(text, limit))
+    assert chunks == [prefix + text[start:end] + suffix for prefix, start, end, suffix in spans]
+
+    # Mentions are only cut if they don't fit into a chunk of their own
+    chunk_starts = set(start for prefix, start, end, suffix in spans)
+    inside_tokens = set()
+    for match in _TOKEN.finditer(text):
+        if match.start() not in chunk_starts:
+            inside_tokens.update(range(match.start() + 1, match.end()))
+
+    position = 0
+    fences = 0
+    for chunk, (prefix, start, end, suffix) in zip(chunks, spans):
+        assert 0 < len(chunk) <= limit, 'bad chunk length ' + str(len(chunk))
+        assert chunk.strip(), 'empty chunk'
+        assert chunk.count('```') % 2 == 0, 'unbalanced code fences'
+
+        # Only whitespace is dropped between chunks
+        assert not text[position:start].strip(), 'content lost'
+
+        # Code blocks are re-opened exactly where the original text is inside one
+        fences += text.count('```', position, start)
+        assert bool(prefix) == (fences % 2 == 1), 'code block not re-opened'
+        fences += text.count('```', start, end)
+        assert bool(suffix) == (fences % 2 == 1 and end < len(text)), 'code block not closed'
+        position = end
+
+        for boundary in (start, end):
+            if 0 < boundary < len(text):
+                before, after = text[boundary - 1], text[boundary]
+                assert not ('\ud800' <= before <= '\udbff' and '\udc00' <= after <= '\udfff'), 'split surrogate pair'
+                assert boundary not in inside_tokens, 'split mention'
+                if _joined(before, after):
+                    # Only overly long runs of joined characters may be cut
+                    run = text[max(0, boundary - 33):boundary + 1]
+                    assert all(_joined(a, b) for a, b in zip(run, run[1:])), 'split character sequence'
+    assert not text[position:].strip(), 'content lost'
+    return chunks
+
+
+def legacy_bridge_split(final_content):
+    """ServerBridge.split_message before the shared chunker."""
+    out_messages = []
+    chunk_size = 2000
+    if len(final_content) <= chunk_size:
+        out_messages.append(final_content)
+    else:
+        increment = chunk_size
+        i = 0
+        while i < len(final_content):
+            chunk = final_content[i:i+increment]
+            newline = chunk.rfind('\n')
+            if newline == -1 or newline >= i+chunk_size-1:
+                increment = min(chunk_size, len(final_content) - 1 - i)
+            else:
+                chunk = final_content[i:i+newline]
+                increment = newline + 1
+            i += increment
+            if chunk:
+                out_messages.append(chunk)
+    return out_messages
+
+
+def legacy_bot_split(message_text):
+    """The splitting in EconomyBot.post_message before the shared chunker."""
+    out_messages = []
+    chunk_size = 2000
+    if message_text.endswith('```'):
+        message_text = message_text[:-3]
+        chunk_size = 1994
+    for i in range(0, len(message_text), chunk_size):
+        text_chunk = message_text[i:i+chunk_size]
+        if chunk_size == 1994:
+            if i > 0:
+                text_chunk = '```' + text_chunk
+            text_chunk += '```'
+        out_messages.append(text_chunk)
+    return out_messages
+
+
+def time_per_call(function, texts):
+    function(texts[0])
+    start = time.perf_counter()
+    for text in texts:
+        function(text)
+    return (time.perf_counter() - start) / len(texts) * 1e6
+
+
+def changed_chunks(function, text):
+    """Number of chunks that differ after editing the last word of _text_."""
+    before = function(text)
+    after = function(text[:text.rstrip().rfind(' ') + 1] + 'edited\n')
+    return sum(1 for index in range(max(len(before), len(after))) if index >= len(before) or index >= len(after) or before[index] != after[index])
+
+
+def run(corpus_size, seed):
+    rng = random.Random(seed)
+    corpus = [random_message(rng) for _ in range(corpus_size)]
+
+    start = time.perf_counter()
+    chunk_count = 0
+    for text in corpus:
+        for limit in LIMITS:
+            chunk_count += len(check(text, limit))
+    print('Checked {} messages ({} characters) at limits {}: {} chunks, all properties hold ({:.1f}s).'.format(len(corpus), sum(map(len, corpus)), LIMITS, chunk_count, time.perf_counter() - start))
+    print()
+
+    print('size (chars)  split_text (us)  old bridge (us)  old bot (us)  edit changes (new / old bridge)')
+    for size in [1000, 4000, 16000, 64000, 256000]:
+        texts = []
+        while len(texts) < 20:
+            text = ''
+            while len(text) < size:
+                text += random_message(rng) + '\n\n'
+            # Bridged messages always end with a line break, which the old bridge splitter relies on to terminate
+            texts.append(text[:size - 1] + '\n')
+        new = time_per_call(split_text, texts)
+        bridge = time_per_call(legacy_bridge_split, texts)
+        bot = time_per_call(legacy_bot_split, texts)
+        edits_new = sum(changed_chunks(split_text, text) for text in texts) / len(texts)
+        edits_bridge = sum(changed_chunks(legacy_bridge_split, text) for text in texts) / len(texts)
+        print('{:>12}  {:>15.1f}  {:>15.1f}  {:>12.1f}  {:>10.1f} / {:.1f}'.format(size, new, bridge, bot, edits_new, edits_bridge))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz check and benchmark the shared message chunker against the splitters it replaced.')
+    parser.add_argument('--messages', type=int, default=2000, help='size of the random corpus that is checked at every limit')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random corpus and benchmark texts')
+    args = parser.parse_args()
+
+    run(args.messages, args.seed)
+
+
+if __name__ == '__main__':
+    main()
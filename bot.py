@@ -10,7 +10,17 @@ from dependency_load_error import DependencyLoadError
 import discord
 from discord.ext import commands
 from conf import config
+from chunking import split_text
+from metrics import MetricsRegistry
+from outbound import OutboundScheduler
+from log_sink import LogSink
+from event_pipeline import EventPipeline
+from cog_loader import CogLoader
+from lifecycle import Lifecycle
+from metrics_server import MetricsServer
+from instrumentation import CommandInstrumentation, InstrumentedStorage, instrument_http
 from tinydb import TinyDB, Query
+from tinydb.storages import JSONStorage
 
 logging.basicConfig()
 
@@ -32,11 +42,38 @@ class EconomyBot(commands.Bot):
             )
 
             self.log_channel = None
+            self.metrics = MetricsRegistry() # Shared by all cogs
+            self.log_sink = LogSink(self, float(config.get('Private', 'log_window', fallback='5')))
+
+            # Short messages posted with coalesce=True in quick succession are merged per channel
+            self.outbound = OutboundScheduler(self, self.send_text_chunk, float(config.get('General', 'coalesce_window', fallback='0.5')))
+
+            # Bridge forwarding and command processing run as separate tasks, so neither waits for the other. Minigame commands run for minutes, hence the generous limit.
+            self.bridge_events = EventPipeline(self, 'server bridge', int(config.get('ServerBridge', 'max_concurrent_events', fallback='8')))
+            self.command_events = EventPipeline(self, 'commands', int(config.get('General', 'max_concurrent_commands', fallback='32')))
+
+            # Wall time, REST calls and database accesses per command, see !commandstats
+            self.instrumentation = CommandInstrumentation(self, int(config.get('General', 'command_stats_window', fallback='200')))
+            instrument_http(self.http)
+            self.before_invoke(self.instrumentation.before_invoke)
+            self.after_invoke(self.instrumentation.after_invoke)
+
+            # on_ready is called again after reconnects, so what it does is split into phases (see lifecycle.py)
+            self.lifecycle = Lifecycle(self)
+            self.lifecycle.register_startup(self.load_cogs)
+            self.lifecycle.register_connect(self.get_channels)
+
+            # Optional Prometheus endpoint, only reachable from the machine itself by default
+            self.metrics_server = None
+            metrics_port = config.get('General', 'metrics_port', fallback='')
+            if metrics_port:
+                self.metrics_server = MetricsServer(self, config.get('General', 'metrics_host', fallback='127.0.0.1'), int(metrics_port))
+
             self.admin_roles = [int(admin_role_id) for admin_role_id in config.admin_roles]
             self.dev_roles = [int(dev_role_id) for dev_role_id in config.dev_roles]
 
             # Main database for current season
-            self.database = TinyDB(config.database)
+            self.database = TinyDB(config.database, storage=InstrumentedStorage(JSONStorage, self.metrics))
             self.message_cache = self.database.table('messages')
             self.query = Query()
             log.info('Main database loaded')
@@ -46,33 +83,50 @@ class EconomyBot(commands.Bot):
             self.info_text += linesep + linesep + config.additional_info_text
             self.info_text += linesep + linesep + 'Type !help to see a list of available commands.' + linesep + linesep
 
-            # TimedTask must be started first if at all
-            if 'timed_task' in config.cogs and config.cogs[0] != 'timed_task':
-                log.fatal('TimedTask is specified to be loaded; has to be loaded first!')
-                sys.exit()
-
         except Exception as e:
             # If any exception occurs at this point, better not execute the thing and let the bot admin figure out what's going on.
             log.exception(e)
             sys.exit()
 
 
+    async def setup_hook(self):
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except Exception as e:
+                # Not worth taking the bot down for
+                log.exception(e)
+                print('Failed to start metrics server with error ' + str(e))
+
+
+    async def close(self):
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await super().close()
+
+
+    def post_log(self, text):
+        """Post _text_ to the log channel in the background. Identical entries are merged and entries are batched (see LogSink), so this is safe to call on every error."""
+        self.log_sink.post(text)
+
+
     async def clear_message_cache(self):
         """Clear message cache once a day. This means that users cannot auto-delete bot messages by removing their own commands in hindsight after 24 hours."""
         self.message_cache.truncate()
 
 
+    def dispatch_to_bridge(self, channel_id, event, *args):
+        """Hand a gateway event in the channel with _channel_id_ to the server bridge if that channel is bridged. Events of the same channel are handled in the order they arrived."""
+        bridge_cog = self.get_cog('ServerBridge')
+        if bridge_cog is not None and channel_id in bridge_cog.webhooks:
+            self.bridge_events.submit(channel_id, getattr(bridge_cog, event), *args)
+
+
     async def on_message_delete(self, message):
         """Delete bot messages corresponding to deleted user commands."""
-        try:
-            try:
-                bridge_cog = self.get_cog('ServerBridge')
-                if bridge_cog is not None:
-                    await bridge_cog.on_message_delete(message)
-            except Exception as e:
-                await self.log_channel.send('**[ERROR]** A critical error occurred while handling deleted message on server bridge. Check logs. ' + config.additional_error_message)
-                log.exception(e)
+        self.dispatch_to_bridge(message.channel.id, 'on_message_delete', message)
 
+        try:
             message_minus_forbidden = message.content.replace('@', '')
             message_minus_forbidden = message_minus_forbidden.replace('`', '')
             if self.message_cache.contains(self.query.id == message.id):
@@ -84,75 +138,84 @@ class EconomyBot(commands.Bot):
                         message_minus_forbidden = message.content.replace('@', '')
                         message_minus_forbidden = message_minus_forbidden.replace('`', '')
         except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred while handling deleted message. Check logs. ' + config.additional_error_message)
+            self.post_log('**[ERROR]** A critical error occurred while handling deleted message. Check logs. ' + config.additional_error_message)
             log.exception(e)
 
 
     async def on_message(self, message):
-        """Scan messages in specific channels and broadcast them to all other channels that are being scanned."""
-        try:
-            bridge_cog = self.get_cog('ServerBridge')
-            if bridge_cog is not None:
-                await bridge_cog.on_message(message)
-        except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred while handling message on server bridge. Check logs. ' + config.additional_error_message)
-            log.exception(e)
+        """Scan messages in specific channels and broadcast them to all other channels that are being scanned, and process commands. Most messages are neither, so both are filtered before anything is scheduled."""
+        self.dispatch_to_bridge(message.channel.id, 'on_message', message)
 
         # NOTE: overriding on_message breaks command processing, so do this now
-        try:
-            await self.process_commands(message)
-        except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred while processing commands. Check logs. ' + config.additional_error_message)
-            log.exception(e)
+        if not message.author.bot and message.content.startswith(config.prefix):
+            self.command_events.submit(None, self.process_commands, message)
 
 
     async def on_message_edit(self, before, after):
         """Handle edited messages."""
-        try:
-            bridge_cog = self.get_cog('ServerBridge')
-            if bridge_cog is not None:
-                await bridge_cog.on_message_edit(before, after)
-        except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred while handling edited message. Check logs. ' + config.additional_error_message)
-            log.exception(e)
+        self.dispatch_to_bridge(after.channel.id, 'on_message_edit', before, after)
+
+
+    async def on_raw_message_edit(self, payload):
+        """Handle edited messages that are not in discord.py's message cache."""
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_message_edit', payload)
+
+
+    async def on_raw_message_delete(self, payload):
+        """Handle deleted messages that are not in discord.py's message cache."""
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_message_delete', payload)
+
+
+    async def on_raw_bulk_message_delete(self, payload):
+        """Handle bulk deleted messages."""
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_bulk_message_delete', payload)
 
 
     async def on_ready(self):
-        # Go through cogs and load them as extensions
+        await self.lifecycle.ready()
+
+
+    async def on_resumed(self):
+        await self.lifecycle.resumed()
+
+
+    async def load_cogs(self):
+        """Load cogs as extensions, in the order given by their dependencies (see cog_loader.py), and start the server bridge. Done once at startup."""
         # NOTE: Each cog adds its own bit to _self.info_text_
-        amnt_failed = 0
-        for cog_name in config.cogs:
-            try:
-                cog_name = 'Cogs.' + cog_name
-                await self.load_extension(cog_name)
-            except Exception as e:
-                amnt_failed += 1
-                print('Failed to load extension ' + cog_name + ' with error ' + str(e))
-            else:
-                log.info('Loading extension ' + cog_name)
-        
+        cog_names = list(config.cogs)
+        if 'bridge' in cog_names and config.get('ServerBridge', 'worker_process', fallback='false').lower() == 'true':
+            # The bridge is run by bridge_worker.py instead, with its own gateway connection
+            print('Server bridge runs in a separate worker process, not loading it.')
+            cog_names.remove('bridge')
+
+        failed_cogs = await CogLoader(self).load_all(cog_names)
+
         timed_events_cog = self.get_cog('TimedTasks')
         if timed_events_cog is not None:
-            timed_events_cog.register_timed_event(self.clear_message_cache)
+            timed_events_cog.register_timed_event(self.clear_message_cache, retries=2)
  
         # If any cogs aren't loaded, bot behaviour is undefined because many cogs depend on each other - better not execute the thing and let the bot admin figure out what's going on.
-        if amnt_failed > 0:
-            log.exception('Summary:\n Num failed extension loads:', amnt_failed)
+        if failed_cogs:
+            log.fatal('Failed to load extensions: ' + ', '.join(failed_cogs))
             sys.exit()
 
         print('Ready for use.')
         print('--------------')
+
+        # The bridge looks up its webhooks and checks its channels only once, its caches survive reconnects
+        bridge_cog = self.get_cog('ServerBridge')
+        if bridge_cog is not None:
+            await bridge_cog.on_ready()
+
+
+    async def get_channels(self):
+        """Look up the bot and log channels. A new gateway session replaces the channel objects, so this is done on every connect."""
         self.bot_channel = self.get_channel(config.bot_channel_id)
         print('Bot channel: ' + str(self.bot_channel))
         if config.log_channel_id != 0:
             self.log_channel = self.get_channel(config.log_channel_id)
             print('Log channel: ' + str(self.log_channel))
 
-        # This could be generic at some point, but for now only bridge needs to react to this event
-        bridge_cog = self.get_cog('ServerBridge')
-        if bridge_cog is not None:
-            await bridge_cog.on_ready()
-
 
     async def on_command_error(self, context, error):
         try:
@@ -203,7 +266,7 @@ class EconomyBot(commands.Bot):
         except Exception as e:
             log.exception(e)
             await self.post_error(context, 'Oh no, something went wrong. ' + config.additional_error_message)
-            await self.log_channel.send('**[ERROR]** A critical error occurred handling the following command (Check logs ' + config.additional_error_message + '):')
+            self.post_log('**[ERROR]** A critical error occurred handling the following command (Check logs ' + config.additional_error_message + '):')
             await self.log_command(context)
 
     async def post_error_private(self, context, error_text, add_error_message = ''):
@@ -261,7 +324,7 @@ class EconomyBot(commands.Bot):
                 quote = '`' + context.message.author.name + ' (' + context.guild.name + '|' + context.message.channel.name + '):` `' + message_minus_forbidden + '`' + linesep + linesep
             await self.post_message(context, context.message.author, quote + message_text, embed)
         except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred in a private message response.' + ' ' + config.additional_error_message)
+            self.post_log('**[ERROR]** A critical error occurred in a private message response.' + ' ' + config.additional_error_message)
             log.fatal('EXCEPTION OCCURRED WHILE POSTING MESSAGE:')
             log.exception(e)
 
@@ -274,74 +337,75 @@ class EconomyBot(commands.Bot):
                 quote = '`' + ctx.message.author.name + ' (PM):` `' + message_minus_forbidden + '`' + linesep + linesep
             else:
                 quote = '`' + ctx.message.author.name + ' (' + ctx.guild.name + '|' + ctx.message.channel.name + '): ` `' + message_minus_forbidden + '`' + linesep + linesep
-            await self.log_channel.send('**[LOG]** ' + quote)
+            self.post_log('**[LOG]** ' + quote)
         except Exception as e:
-            await self.log_channel.send('**[ERROR]** A critical error occurred while logging commands. ' + config.additional_error_message)
+            self.post_log('**[ERROR]** A critical error occurred while logging commands. ' + config.additional_error_message)
             log.fatal('EXCEPTION OCCURRED WHILE LOGGING:')
             log.exception(e)
 
 
-    async def post_message(self, ctx, channel, message_text, embed = None):
-        """Post a message in the respective channel."""
+    async def post_message(self, ctx, channel, message_text, embed = None, coalesce = False):
+        """Post a message in the respective channel. With _coalesce_, short texts are merged with others posted to the same channel within a short time and nothing is returned since the message isn't sent yet; don't use this if you need the posted messages (e.g. to edit them). Otherwise, everything queued for merging in this channel is posted first."""
 
         try:
-            sent_messages = []
+            if coalesce and embed is None and self.outbound.can_coalesce(message_text):
+                self.outbound.queue(channel, message_text)
+                return []
 
-            if embed is None:
-                # Discord character limit is 2000; split up the message if it's too long
-                chunk_size = 2000
+            return await self.outbound.send(channel, lambda: self.post_message_internal(channel, message_text, embed))
+        except Exception as e:
+            await self.bot_channel.send('**[ERROR]** A critical error occurred.' + ' ' + config.additional_error_message)
+            log.fatal('EXCEPTION OCCURRED WHILE POSTING MESSAGE:')
+            log.exception(e)
+
+
+    async def send_text_chunk(self, channel, text_chunk):
+        """Send a single message of at most 2000 characters, retrying on HTTP errors. Returns the message or None."""
 
-                if message_text.endswith('```'):
-                    message_text = message_text[:-3]
-                    chunk_size = 1994
+        attempts = 0
+        while attempts < config.repost_attempts:
+            try:
+                return await channel.send(text_chunk)
+            except discord.errors.HTTPException as e:
+                self.post_log('**[ERROR]** HTTP exception occurred while posting message - check logs. ' + config.additional_error_message)
+                log.warning('HTTP EXCEPTION OCCURRED WHILE POSTING A MESSAGE:')
+                log.exception(e)
 
-                for i in range(0, len(message_text), chunk_size):
-                    text_chunk = message_text[i:i+chunk_size]
+                attempts += 1
+                await asyncio.sleep(2)
+        return None
 
-                    # Special case for markdown blocks
-                    if chunk_size == 1994:
-                        if i > 0:
-                            text_chunk = '```' + text_chunk
-                        text_chunk += '```'
 
-                    attempts = 0
+    async def post_message_internal(self, channel, message_text, embed = None):
+        """Post a message right away, splitting it if necessary. Returns the list of sent messages."""
 
-                    while attempts < config.repost_attempts:
-                        try:
-                            res = await channel.send(text_chunk)
-                            sent_messages.append(res)
-                        except discord.errors.HTTPException as e:
-                            await self.log_channel.send('**[ERROR]** HTTP exception occurred while posting message - check logs. ' + config.additional_error_message)
-                            log.warning('HTTP EXCEPTION OCCURRED WHILE POSTING A MESSAGE:')
-                            log.exception(e)
-
-                            attempts += 1
-                            await asyncio.sleep(2)
-                        else:
-                            break
-            else:
-                attempts = 0
-
-                while attempts < config.repost_attempts:
-                    try:
-                        res = await channel.send(embed=embed)
-                        sent_messages.append(res)
-                    except discord.errors.HTTPException as e:
-                        log.warning('HTTP EXCEPTION OCCURRED WHILE POSTING AN EMBED:')
-                        log.exception(e)
-
-                        if 'Invalid Form Body' in str(e):
-                            await self.log_channel.send('**[ERROR]** Failed to send an embed due to a form error - check logs. ' + config.additional_error_message)
-                            break
-                        else:
-                            await self.log_channel.send('**[ERROR]** HTTP exception occurred while posting embed - check logs. ' + config.additional_error_message)
-
-                        attempts += 1
-                        await asyncio.sleep(2)
-                    else:
+        sent_messages = []
+
+        if embed is None:
+            # Discord character limit is 2000; split up the message if it's too long
+            for text_chunk in split_text(message_text):
+                res = await self.send_text_chunk(channel, text_chunk)
+                if res is not None:
+                    sent_messages.append(res)
+        else:
+            attempts = 0
+
+            while attempts < config.repost_attempts:
+                try:
+                    res = await channel.send(embed=embed)
+                    sent_messages.append(res)
+                except discord.errors.HTTPException as e:
+                    log.warning('HTTP EXCEPTION OCCURRED WHILE POSTING AN EMBED:')
+                    log.exception(e)
+
+                    if 'Invalid Form Body' in str(e):
+                        self.post_log('**[ERROR]** Failed to send an embed due to a form error - check logs. ' + config.additional_error_message)
                         break
-            return sent_messages
-        except Exception as e:
-            await self.bot_channel.send('**[ERROR]** A critical error occurred.' + ' ' + config.additional_error_message)
-            log.fatal('EXCEPTION OCCURRED WHILE POSTING MESSAGE:')
-            log.exception(e)
+                    else:
+                        self.post_log('**[ERROR]** HTTP exception occurred while posting embed - check logs. ' + config.additional_error_message)
+
+                    attempts += 1
+                    await asyncio.sleep(2)
+                else:
+                    break
+        return sent_messages
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import socket
+from aiohttp import AsyncResolver, ClientSession, TCPConnector
+import discord
+from conf import config
+from metrics import MetricsRegistry
+from log_sink import LogSink
+from metrics_server import MetricsServer
+from lifecycle import Lifecycle
+from event_pipeline import EventPipeline
+from Cogs.bridge import ServerBridge
+
+log = logging.getLogger(__name__)
+
+log.setLevel(logging.INFO)
+
+__all__ = ('BridgeWorker', 'GatewayTransport', 'LocalTransport')
+
+
+class BridgeWorker:
+    """Runs the server bridge on its own, fed with events by a transport.
+
+    This allows running the bridge in a separate process, so that forwarding does not have to wait for anything else the economy bot is doing (minigame animations, database writes, ...).
+    The bridge keeps its own caches and forwards independently; the economy bot must not load the bridge cog in this case (set worker_process in the [ServerBridge] section).
+    _client_ has to provide what the bridge expects from a bot: loop, info_text, http_session, metrics, post_log(), get_channel() and get_cog().
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.bridge = None
+
+    async def start(self):
+        """Create the bridge and connect it to its channels. Done once, the bridge keeps its caches across reconnects."""
+        if self.bridge is None:
+            self.bridge = ServerBridge(self.client)
+        await self.bridge.on_ready()
+
+    def stop(self):
+        if self.bridge is not None:
+            self.bridge.cog_unload()
+
+    async def handle(self, event, *args):
+        """Pass a gateway event (e.g. 'on_message') on to the bridge."""
+        try:
+            await getattr(self.bridge, event)(*args)
+        except Exception as e:
+            log.exception(e)
+            self.client.post_log('**[ERROR]** A critical error occurred in bridge worker while handling ' + event + '. Check logs. ' + config.additional_error_message)
+
+
+class GatewayTransport(discord.Client):
+    """A gateway connection of its own for the bridge worker, with nothing but the bridge running on it."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.log_channel = None
+        self.info_text = ''
+        self.http_session = None
+        self.metrics = MetricsRegistry()
+        self.log_sink = LogSink(self, float(config.get('Private', 'log_window', fallback='5')))
+        self.worker = BridgeWorker(self)
+        # Like in the economy bot, events of the same channel are handled in the order they arrived, so an edit or delete never overtakes its message
+        self.bridge_events = EventPipeline(self, 'server bridge', int(config.get('ServerBridge', 'max_concurrent_events', fallback='8')))
+        self.lifecycle = Lifecycle(self)
+        self.lifecycle.register_startup(self.worker.start)
+        self.lifecycle.register_connect(self.get_log_channel)
+        self.metrics_server = None
+        metrics_port = config.get('ServerBridge', 'worker_metrics_port', fallback='')
+        if metrics_port:
+            self.metrics_server = MetricsServer(self, config.get('General', 'metrics_host', fallback='127.0.0.1'), int(metrics_port))
+
+    def get_cog(self, name):
+        # There are no cogs in the worker
+        return None
+
+    def post_log(self, text):
+        self.log_sink.post(text)
+
+    async def setup_hook(self):
+        self.http_session = ClientSession(
+            connector=TCPConnector(resolver=AsyncResolver(), family=socket.AF_INET)
+        )
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+    async def close(self):
+        self.worker.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        if self.http_session is not None:
+            await self.http_session.close()
+        await super().close()
+
+    async def on_ready(self):
+        await self.lifecycle.ready()
+
+    async def on_resumed(self):
+        await self.lifecycle.resumed()
+
+    async def get_log_channel(self):
+        if config.log_channel_id != 0:
+            self.log_channel = self.get_channel(config.log_channel_id)
+            print('Log channel: ' + str(self.log_channel))
+
+    def dispatch_to_bridge(self, channel_id, event, *args):
+        """Hand a gateway event in the channel with _channel_id_ to the bridge if that channel is bridged."""
+        bridge = self.worker.bridge
+        if bridge is not None and channel_id in bridge.webhooks:
+            self.bridge_events.submit(channel_id, getattr(bridge, event), *args)
+
+    async def on_message(self, message):
+        self.dispatch_to_bridge(message.channel.id, 'on_message', message)
+
+    async def on_message_edit(self, before, after):
+        self.dispatch_to_bridge(after.channel.id, 'on_message_edit', before, after)
+
+    async def on_raw_message_edit(self, payload):
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_message_edit', payload)
+
+    async def on_message_delete(self, message):
+        self.dispatch_to_bridge(message.channel.id, 'on_message_delete', message)
+
+    async def on_raw_message_delete(self, payload):
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_message_delete', payload)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        self.dispatch_to_bridge(payload.channel_id, 'on_raw_bulk_message_delete', payload)
+
+
+class LocalTransport:
+    """Stand-in for the gateway connection that feeds events from within the same process, in order. Used to test and benchmark the worker without discord (see benchmarks/bridge_throughput.py)."""
+
+    def __init__(self, client):
+        self.worker = BridgeWorker(client)
+        self.events = asyncio.Queue()
+        self.task = None
+
+    async def start(self):
+        await self.worker.start()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.worker.stop()
+
+    def put(self, event, *args):
+        self.events.put_nowait((event, args))
+
+    async def join(self):
+        """Wait until all events put so far have been handled."""
+        await self.events.join()
+
+    async def run(self):
+        while True:
+            event, args = await self.events.get()
+            try:
+                await self.worker.handle(event, *args)
+            finally:
+                self.events.task_done()
+
+
+def main():
+    logging.basicConfig(filename=config.get('ServerBridge', 'worker_logfile', fallback='bridge_worker.log'), format='%(asctime)s - [%(levelname)s] %(name)s : %(message)s')
+
+    try:
+        intents = discord.Intents.default()
+        intents.members = False
+        intents.presences = False
+        intents.message_content = True
+        client = GatewayTransport(intents=intents, chunk_guilds_at_startup=False)
+        client.run(config.token)
+    except Exception as e:
+        log.exception(e)
+
+
+if __name__ == '__main__':
+    main()
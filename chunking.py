@@ -0,0 +1,149 @@
+import re
+import unicodedata
+
+__all__ = ('split_text')
+
+# Discord's character limit for message content
+MESSAGE_LIMIT = 2000
+
+_FENCE = '```'
+_CLOSE_FENCE = '\n' + _FENCE
+
+# Language tag of an opening code fence, e.g. ```py
+_FENCE_LANGUAGE = re.compile(r'[\w+#.-]{1,16}(?=\n)')
+
+# User, role and channel mentions, custom emoji, timestamps and slash command mentions must never be cut in half
+_TOKEN = re.compile(r'<(?:@[!&]?\d+|#\d+|a?:\w+:\d+|t:-?\d+(?::[tTdDfFR])?|/[\w -]+:\d+)>')
+_MAX_TOKEN_LENGTH = 128
+
+# How far to step back at most to keep characters together with their combining marks, modifiers and joiners
+_MAX_JOIN_BACKTRACK = 32
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    """Split _text_ into chunks of at most _limit_ characters. Splits on paragraph, then line, then word boundaries, and only cuts words if there is no other way. Code blocks cut by a split are closed at the end of the chunk and re-opened (with their language) at the start of the next one. Surrogate pairs are never split, and neither are mentions and custom emoji unless they are longer than a whole chunk.
+
+    A boundary is only used if it lies in the second half of the available space, so every chunk but the last consumes at least half the limit and the whole split runs in linear time. Since chunks are picked greedily from the start, an edit only changes the chunks from the edited one onwards.
+    """
+
+    if not text:
+        return []
+    if len(text) <= limit:
+        return [text]
+
+    return [prefix + text[start:end] + suffix for prefix, start, end, suffix in _split_spans(text, limit)]
+
+
+def _split_spans(text, limit):
+    """Generate the chunks of _text_ as (prefix, start, end, suffix), where the chunk is _text_[start:end] wrapped in code fences added to keep code blocks balanced."""
+
+    fence = None # Language of the code block open at the current position, or None
+    start = 0
+    while start < len(text):
+        prefix = '' if fence is None else _FENCE + fence + '\n'
+        budget = limit - len(prefix)
+
+        end, next_start = _find_split(text, start, budget)
+        body_fence = _fence_after(text, start, end, fence)
+        if body_fence is not None and end < len(text) and len(prefix) + end - start + len(_CLOSE_FENCE) > limit:
+            # Make room for closing the code block
+            end, next_start = _find_split(text, start, budget - len(_CLOSE_FENCE))
+            body_fence = _fence_after(text, start, end, fence)
+
+        if text[start:end].strip():
+            yield prefix, start, end, _CLOSE_FENCE if body_fence is not None and end < len(text) else ''
+
+        fence = body_fence
+        start = next_start
+
+
+def _find_split(text, start, budget):
+    """Find the end of the chunk starting at _start_ and the start of the next one. The separator a chunk is split on (if any) is dropped."""
+
+    end = start + budget
+    if end >= len(text):
+        return len(text), len(text)
+
+    half = start + budget // 2
+
+    # Split separators may begin at _end_, since they are not part of the chunk
+    paragraph = text.rfind('\n\n', half, end + 2)
+    if paragraph != -1:
+        return paragraph, paragraph + 2
+
+    line = text.rfind('\n', half, end + 1)
+    if line != -1:
+        return line, line + 1
+
+    # Slash command mentions contain spaces
+    word = text.rfind(' ', half, end + 1)
+    while word != -1:
+        token_start = _token_start(text, start + 1, word)
+        if token_start == -1:
+            return word, word + 1
+        word = text.rfind(' ', half, token_start)
+
+    cut = _safe_cut(text, start, end)
+    return cut, cut
+
+
+def _safe_cut(text, start, cut):
+    """Move a hard cut at _cut_ back so that it doesn't split a mention, code fence marker or character sequence. Never moves it back to _start_."""
+
+    original_cut = cut
+
+    token_start = _token_start(text, start + 1, cut)
+    if token_start != -1:
+        cut = token_start
+
+    while cut > start + 1 and text[cut - 1] == '`' and text[cut] == '`':
+        cut -= 1
+
+    steps = 0
+    while cut > start + 1 and steps < _MAX_JOIN_BACKTRACK and _joined(text[cut - 1], text[cut]):
+        cut -= 1
+        steps += 1
+
+    if _is_surrogate_pair(text[cut - 1], text[cut]):
+        cut -= 1
+
+    return cut if cut > start else original_cut
+
+
+def _token_start(text, lower, position):
+    """Return the start of the mention (or similar) _position_ lies within, or -1 if there is none starting at or after _lower_."""
+
+    token_start = text.rfind('<', max(lower, position - _MAX_TOKEN_LENGTH), position)
+    if token_start != -1:
+        token = _TOKEN.match(text, token_start)
+        if token and token.end() > position:
+            return token_start
+    return -1
+
+
+def _joined(before, after):
+    """Whether the characters _before_ and _after_ render as one."""
+
+    return (_is_surrogate_pair(before, after)
+        or before == '\u200d' or after == '\u200d' # Zero width joiner
+        or '\ufe00' <= after <= '\ufe0f' # Variation selectors
+        or '\U0001f3fb' <= after <= '\U0001f3ff' # Skin tone modifiers
+        or unicodedata.combining(after) != 0)
+
+
+def _is_surrogate_pair(before, after):
+    return '\ud800' <= before <= '\udbff' and '\udc00' <= after <= '\udfff'
+
+
+def _fence_after(text, start, end, fence):
+    """Return the language of the code block open at _end_ (empty if it has none), or None if no code block is open there. _fence_ is the state at _start_."""
+
+    position = text.find(_FENCE, start, end)
+    while position != -1:
+        if fence is None:
+            language = _FENCE_LANGUAGE.match(text, position + len(_FENCE))
+            fence = language.group(0) if language else ''
+        else:
+            fence = None
+        position = text.find(_FENCE, position + len(_FENCE), end)
+    return fence
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = ('CogLoader')
+
+# Extension -> extensions that have to be loaded before it if they are configured. '*' stands for all other configured extensions.
+# Only dependencies of the cogs' setup count here; cogs look each other up at runtime through load_dependency/get_cog anyway.
+DEPENDENCIES = {
+    'economy': ['timed_task'], # Registers its daily tasks
+    'holidays': ['timed_task'],
+    'test_cog': ['timed_task'],
+    'battleroyale': ['holidays'], # Registers itself as a minigame for holiday points
+    'horserace': ['holidays'],
+    'stats': ['*'], # Every cog may extend the trivia table and the outputs of !trivia and !season
+}
+
+
+class CogLoader:
+    """Loads the configured extensions in stages derived from DEPENDENCIES instead of one after the other in the order of the config. The extensions of a stage are loaded concurrently; an extension whose dependency failed to load is not loaded at all.
+
+    The time every extension took to load is printed as a table and kept in the cog_load_seconds metric.
+    """
+
+    def __init__(self, bot, dependencies=DEPENDENCIES):
+        self.bot = bot
+        self.dependencies = dependencies
+        self.load_seconds = bot.metrics.gauge('cog_load_seconds', 'Time it took to load an extension at startup', ('cog',))
+
+    def requirements(self, name, names):
+        """The extensions among _names_ that have to be loaded before _name_."""
+
+        requirements = self.dependencies.get(name, [])
+        if '*' in requirements:
+            return [other for other in names if other != name and '*' not in self.dependencies.get(other, [])]
+        return [requirement for requirement in requirements if requirement in names]
+
+    def stages(self, names):
+        """Group _names_ into lists that can be loaded concurrently, in order. Within a stage, the configured order is kept."""
+
+        remaining = {name: set(self.requirements(name, names)) for name in names}
+        stages = []
+        while remaining:
+            stage = [name for name in names if name in remaining and not remaining[name]]
+            if not stage:
+                raise ValueError('Circular cog dependencies between ' + ', '.join(remaining))
+            stages.append(stage)
+            for name in stage:
+                del remaining[name]
+            for requirements in remaining.values():
+                requirements.difference_update(stage)
+        return stages
+
+    async def load(self, name, requirements, failed):
+        failed_requirements = [requirement for requirement in requirements if requirement in failed]
+        if failed_requirements:
+            return 0.0, 'not loaded since ' + ', '.join(failed_requirements) + ' failed'
+
+        start = time.perf_counter()
+        try:
+            await self.bot.load_extension('Cogs.' + name)
+        except Exception as e:
+            log.exception(e)
+            return time.perf_counter() - start, 'failed with error ' + str(e)
+
+        log.info('Loaded extension Cogs.' + name)
+        return time.perf_counter() - start, None
+
+    async def load_all(self, names):
+        """Load the extensions _names_ and print how long each took. Returns the names of those that failed to load."""
+
+        start = time.perf_counter()
+        failed = set()
+        results = []
+        for index, stage in enumerate(self.stages(names)):
+            stage_results = await asyncio.gather(*(self.load(name, self.requirements(name, names), failed) for name in stage))
+            for name, (seconds, error) in zip(stage, stage_results):
+                results.append((index + 1, name, seconds, error))
+                self.load_seconds.set(name, value=seconds)
+                if error is not None:
+                    failed.add(name)
+
+        print(self.render(results, time.perf_counter() - start))
+        return [name for stage, name, seconds, error in results if error is not None]
+
+    def render(self, results, total):
+        indent = max([len('Cog')] + [len(name) for stage, name, seconds, error in results])
+        lines = ['Cog'.ljust(indent) + '  Stage  Time (ms)']
+        for stage, name, seconds, error in results:
+            lines.append(name.ljust(indent) + '  ' + str(stage).rjust(5) + '  ' + '{:9.1f}'.format(seconds * 1000) + ('  ' + error if error is not None else ''))
+        lines.append('Loaded ' + str(len(results)) + ' extensions in ' + '{:.1f}'.format(total * 1000) + ' ms')
+        return '\n'.join(lines)
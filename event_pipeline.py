@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from conf import config
+
+log = logging.getLogger(__name__)
+
+__all__ = ('EventPipeline')
+
+
+class EventPipeline:
+    """Runs event handlers as background tasks, at most _max_concurrency_ at a time, so that gateway events don't wait for unrelated work and a failing handler can't affect any other.
+
+    Handlers submitted with the same key (e.g. a channel id) run one after the other in the order they were submitted; handlers without a key run independently.
+    """
+
+    def __init__(self, bot, name, max_concurrency):
+        self.bot = bot
+        self.name = name
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tails = {} # Key -> task of the handler last submitted with that key
+        self.tasks = set()
+        self.running = 0
+
+        self.handled_counter = bot.metrics.counter('event_handlers_total', 'Event handlers run per pipeline', ('pipeline',))
+        self.failed_counter = bot.metrics.counter('event_handler_failures_total', 'Event handlers that raised per pipeline', ('pipeline',))
+        self.running_gauge = bot.metrics.gauge('event_handlers_running', 'Event handlers currently running per pipeline', ('pipeline',))
+        self.pending_gauge = bot.metrics.gauge('event_handlers_pending', 'Event handlers submitted but not finished per pipeline', ('pipeline',))
+
+    def submit(self, key, handler, *args):
+        """Schedule _handler_(*_args_) and return immediately."""
+
+        previous = self.tails.get(key) if key is not None else None
+        task = asyncio.get_running_loop().create_task(self.run(previous, handler, args))
+        self.tasks.add(task)
+        if key is not None:
+            self.tails[key] = task
+        task.add_done_callback(lambda task: self.finished(key, task))
+        self.pending_gauge.set(self.name, value=len(self.tasks))
+
+    def finished(self, key, task):
+        self.tasks.discard(task)
+        if key is not None and self.tails.get(key) is task:
+            del self.tails[key]
+        self.pending_gauge.set(self.name, value=len(self.tasks))
+
+    async def run(self, previous, handler, args):
+        if previous is not None:
+            # Only wait for it to finish, its errors are none of our business
+            await asyncio.wait([previous])
+
+        async with self.semaphore:
+            self.running += 1
+            self.running_gauge.set(self.name, value=self.running)
+            try:
+                await handler(*args)
+            except Exception as e:
+                self.failed_counter.inc(self.name)
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** A critical error occurred in ' + handler.__name__ + ' (' + self.name + '). Check logs. ' + config.additional_error_message)
+            finally:
+                self.running -= 1
+                self.running_gauge.set(self.name, value=self.running)
+                self.handled_counter.inc(self.name)
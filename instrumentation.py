@@ -0,0 +1,219 @@
+import contextvars
+import os
+import time
+from collections import deque
+from os import linesep
+from tinydb.middlewares import Middleware
+
+__all__ = ('CommandInstrumentation', 'InstrumentedStorage', 'instrument_http')
+
+# Measurement of the command running in the current task, if any. Tasks started by a command inherit it.
+_current_measurement = contextvars.ContextVar('current_measurement', default=None)
+
+
+class CommandMeasurement:
+    """What a single command invocation spent its time on."""
+
+    __slots__ = ('started', 'wall_time', 'rest_calls', 'rest_time', 'db_reads', 'db_writes', 'db_time', 'bytes_written')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_time = 0.0
+        self.rest_calls = 0
+        self.rest_time = 0.0
+        self.db_reads = 0
+        self.db_writes = 0
+        self.db_time = 0.0
+        self.bytes_written = 0
+
+
+class InstrumentedStorage(Middleware):
+    """TinyDB middleware that attributes reads and writes of the database (and their time and size) to the command currently running. Use as TinyDB(path, storage=InstrumentedStorage(JSONStorage, bot.metrics)).
+
+    With a metrics registry, the size and duration of every write are also recorded per database file, no matter who wrote.
+    """
+
+    def __init__(self, storage_cls, metrics=None):
+        super().__init__(storage_cls)
+        self.labels = ()
+        self.write_bytes = None
+        self.write_seconds = None
+        if metrics is not None:
+            self.write_bytes = metrics.histogram('database_write_bytes', 'Size of database files after a write', ('database',), buckets=(1024, 16384, 131072, 1048576, 4194304, 16777216, 67108864))
+            self.write_seconds = metrics.histogram('database_write_seconds', 'Time taken to write a database file', ('database',))
+
+    def __call__(self, *args, **kwargs):
+        if args:
+            self.labels = (os.path.basename(str(args[0])),)
+        return super().__call__(*args, **kwargs)
+
+    def read(self):
+        start = time.perf_counter()
+        try:
+            return self.storage.read()
+        finally:
+            measurement = _current_measurement.get()
+            if measurement is not None:
+                measurement.db_reads += 1
+                measurement.db_time += time.perf_counter() - start
+
+    def write(self, data):
+        start = time.perf_counter()
+        try:
+            self.storage.write(data)
+        finally:
+            duration = time.perf_counter() - start
+            # JSONStorage rewrites the whole file, so its size after the write is what was written
+            handle = getattr(self.storage, '_handle', None)
+            size = handle.tell() if handle is not None else 0
+
+            if self.write_seconds is not None:
+                self.write_seconds.observe(*self.labels, value=duration)
+                self.write_bytes.observe(*self.labels, value=size)
+
+            measurement = _current_measurement.get()
+            if measurement is not None:
+                measurement.db_writes += 1
+                measurement.db_time += duration
+                measurement.bytes_written += size
+
+    def close(self):
+        self.storage.close()
+
+
+def instrument_http(http):
+    """Wrap the request method of discord.py's HTTP client so that every REST call (and its time, including waiting for rate limits) is attributed to the command currently running."""
+
+    request = http.request
+
+    async def instrumented_request(*args, **kwargs):
+        measurement = _current_measurement.get()
+        if measurement is None:
+            return await request(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            measurement.rest_calls += 1
+            measurement.rest_time += time.perf_counter() - start
+
+    http.request = instrumented_request
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CommandStats:
+    """The last _window_ measurements of one command, plus totals since startup."""
+
+    def __init__(self, window):
+        self.calls = 0
+        self.failures = 0
+        self.measurements = deque(maxlen=window)
+
+    def values(self, name):
+        return [getattr(measurement, name) for measurement in self.measurements]
+
+
+class CommandInstrumentation:
+    """Measures wall time, REST calls, database accesses and bytes written per command invocation, using the bot's before_invoke and after_invoke hooks.
+
+    Rolling percentiles over the last _window_ invocations of every command are available through render() (used by !commandstats) and dump(); totals are exported as metrics.
+    """
+
+    # (attribute, label, scale, format) of every measure, in output order
+    measures = [
+        ('wall_time', 'wall ms', 1000, '{:.0f}'),
+        ('rest_calls', 'REST calls', 1, '{:.0f}'),
+        ('rest_time', 'REST ms', 1000, '{:.0f}'),
+        ('db_reads', 'DB reads', 1, '{:.0f}'),
+        ('db_writes', 'DB writes', 1, '{:.0f}'),
+        ('db_time', 'DB ms', 1000, '{:.0f}'),
+        ('bytes_written', 'KiB written', 1 / 1024, '{:.1f}'),
+    ]
+
+    def __init__(self, bot, window=200):
+        self.window = window
+        self.stats = {} # Qualified command name -> CommandStats
+
+        labels = ('command',)
+        self.duration_histogram = bot.metrics.histogram('command_duration_seconds', 'Wall time of command invocations', labels)
+        self.failure_counter = bot.metrics.counter('command_failures_total', 'Command invocations that raised', labels)
+        self.counters = {
+            'rest_calls': bot.metrics.counter('command_rest_calls_total', 'Discord REST calls made by commands', labels),
+            'rest_time': bot.metrics.counter('command_rest_seconds_total', 'Time spent in discord REST calls by commands', labels),
+            'db_reads': bot.metrics.counter('command_db_reads_total', 'Database reads by commands', labels),
+            'db_writes': bot.metrics.counter('command_db_writes_total', 'Database writes by commands', labels),
+            'db_time': bot.metrics.counter('command_db_seconds_total', 'Time spent reading and writing the database by commands', labels),
+            'bytes_written': bot.metrics.counter('command_bytes_written_total', 'Bytes of database files written by commands', labels),
+        }
+
+    async def before_invoke(self, context):
+        _current_measurement.set(CommandMeasurement())
+
+    async def after_invoke(self, context):
+        measurement = _current_measurement.get()
+        if measurement is None:
+            return
+        _current_measurement.set(None)
+        measurement.wall_time = time.perf_counter() - measurement.started
+
+        name = context.command.qualified_name
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CommandStats(self.window)
+        stats.calls += 1
+        stats.measurements.append(measurement)
+
+        self.duration_histogram.observe(name, value=measurement.wall_time)
+        if context.command_failed:
+            stats.failures += 1
+            self.failure_counter.inc(name)
+        for attribute, counter in self.counters.items():
+            counter.inc(name, amount=getattr(measurement, attribute))
+
+    def dump(self):
+        """All statistics as a JSON-serializable dict: per command the call and failure counts and the p50/p95/max of every measure over the last invocations."""
+
+        result = {}
+        for name, stats in sorted(self.stats.items()):
+            entry = {'calls': stats.calls, 'failures': stats.failures, 'window': len(stats.measurements)}
+            for attribute, label, scale, number_format in self.measures:
+                values = stats.values(attribute)
+                entry[attribute] = {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'max': max(values, default=0)}
+            result[name] = entry
+        return result
+
+    def render(self, command_name=None):
+        """A table of the p50/p95 of every measure per command (or all percentiles of a single one), slowest commands first."""
+
+        if command_name is not None:
+            stats = self.stats.get(command_name)
+            if stats is None:
+                return 'No invocations of ' + command_name + ' recorded yet.'
+
+            result = command_name + ': ' + str(stats.calls) + ' calls, ' + str(stats.failures) + ' failed (percentiles over the last ' + str(len(stats.measurements)) + ')' + linesep + linesep
+            result += 'Measure'.ljust(12) + '     p50      p95      p99      max' + linesep
+            for attribute, label, scale, number_format in self.measures:
+                values = stats.values(attribute)
+                result += label.ljust(12) + ''.join(number_format.format(value * scale).rjust(9) for value in (percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99), max(values, default=0))) + linesep
+            return result
+
+        if not self.stats:
+            return 'No commands recorded yet.'
+
+        indent = max(12, max(len(name) for name in self.stats))
+        result = 'p50/p95 over the last ' + str(self.window) + ' invocations per command' + linesep + linesep
+        result += 'Command'.ljust(indent) + '  Calls  Fail' + ''.join(label.rjust(14) for attribute, label, scale, number_format in self.measures) + linesep
+        for name, stats in sorted(self.stats.items(), key=lambda item: percentile(item[1].values('wall_time'), 0.95), reverse=True):
+            result += name.ljust(indent) + str(stats.calls).rjust(7) + str(stats.failures).rjust(6)
+            for attribute, label, scale, number_format in self.measures:
+                values = stats.values(attribute)
+                result += (number_format.format(percentile(values, 0.5) * scale) + '/' + number_format.format(percentile(values, 0.95) * scale)).rjust(14)
+            result += linesep
+        return result
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from conf import config
+
+log = logging.getLogger(__name__)
+
+__all__ = ('Lifecycle')
+
+
+class Lifecycle:
+    """Runs what has to happen when the gateway connection becomes ready, in three phases. discord.py calls on_ready again whenever it has to start a new session after a disconnect, and on_resumed when it could pick up the old one.
+
+    - startup: once per process, on the first on_ready (loading cogs, creating webhooks, scheduling stored timers).
+    - connect: on every on_ready. A new session rebuilds discord.py's caches, so channel objects have to be looked up again; nothing here should be expensive. On the first on_ready, the hooks registered by then run before startup, so that startup can use what they look up, and those registered during startup run right after it.
+    - resume: on every on_resumed. Caches and state survive a resume, so usually nothing has to be done.
+
+    The bot and cogs register coroutine functions for a phase, like timed events with TimedTasks. Hooks registered while startup runs (e.g. by cogs being loaded) are run in the same startup. A failing hook is logged and does not stop the others.
+    """
+
+    phases = ('startup', 'connect', 'resume')
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.hooks = {phase: [] for phase in self.phases}
+        self.started = False
+        # A reconnect may complete while startup is still awaiting, e.g. while creating webhooks
+        self.lock = asyncio.Lock()
+        self.phase_counter = bot.metrics.counter('lifecycle_phases_total', 'Times a lifecycle phase ran; connect and resume count gateway sessions', ('phase',))
+
+    def register_startup(self, hook):
+        self.hooks['startup'].append(hook)
+
+    def register_connect(self, hook):
+        self.hooks['connect'].append(hook)
+
+    def register_resume(self, hook):
+        self.hooks['resume'].append(hook)
+
+    def unregister(self, hook):
+        """Remove _hook_ from all phases, e.g. when the cog that registered it is unloaded."""
+        for hooks in self.hooks.values():
+            while hook in hooks:
+                hooks.remove(hook)
+
+    async def ready(self):
+        """To be called from on_ready."""
+
+        async with self.lock:
+            if self.started:
+                await self.run('connect')
+                return
+
+            self.started = True
+            registered = len(self.hooks['connect'])
+            await self.run('connect', 0, registered)
+            await self.run('startup')
+            await self.run('connect', registered)
+
+    async def resumed(self):
+        """To be called from on_resumed."""
+
+        async with self.lock:
+            await self.run('resume')
+
+    async def run(self, phase, index=0, stop=None):
+        """Run the hooks of _phase_ from _index_ up to _stop_ (all, including those registered meanwhile, if None)."""
+
+        start = time.perf_counter()
+        hooks = self.hooks[phase]
+        # Not a for loop over the list: it may grow while the hooks run
+        while index < (len(hooks) if stop is None else min(stop, len(hooks))):
+            hook = hooks[index]
+            index += 1
+            try:
+                await hook()
+            except Exception as e:
+                log.exception(e)
+                self.bot.post_log('**[ERROR]** Error in ' + phase + ' hook ' + getattr(hook, '__qualname__', str(hook)) + ' after connecting to discord. Check logs. ' + config.additional_error_message)
+
+        if stop is None:
+            self.phase_counter.inc(phase)
+        log.info('Lifecycle phase ' + phase + ' done in ' + '{:.2f}'.format(time.perf_counter() - start) + 's')
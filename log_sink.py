@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from chunking import split_text
+
+log = logging.getLogger(__name__)
+
+__all__ = ('LogSink')
+
+
+class LogSink:
+    """Posts to the log channel in the background, so that error paths never wait for discord.
+
+    Entries are collected for _window_ seconds and then posted together in as few messages as possible. Identical entries within a window are posted once with a repeat count, so an error that occurs on every message (e.g. a broken webhook) produces one line per window instead of an error storm that runs into rate limits.
+    At most _max_entries_ distinct entries are kept per window; further ones are only counted. Without a log channel (none configured or not connected yet), entries only go to the log file.
+    """
+
+    def __init__(self, bot, window=5.0, max_entries=100):
+        self.bot = bot
+        self.window = window
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # Text -> number of times it was posted in the current window
+        self.dropped = 0
+        self.wakeup = None
+        self.task = None
+
+        self.posted_counter = bot.metrics.counter('log_entries_posted_total', 'Entries posted to the log sink')
+        self.deduplicated_counter = bot.metrics.counter('log_entries_deduplicated_total', 'Log entries merged into an identical entry of the same window')
+        self.dropped_counter = bot.metrics.counter('log_entries_dropped_total', 'Log entries dropped because too many distinct entries were pending')
+
+    def post(self, text):
+        """Queue _text_ for the log channel. Never blocks and never raises."""
+
+        try:
+            self.posted_counter.inc()
+            if text in self.entries:
+                self.entries[text] += 1
+                self.deduplicated_counter.inc()
+            elif len(self.entries) < self.max_entries:
+                self.entries[text] = 1
+            else:
+                self.dropped += 1
+                self.dropped_counter.inc()
+                return
+
+            if self.task is None or self.task.done():
+                self.wakeup = asyncio.Event()
+                self.task = asyncio.get_running_loop().create_task(self.run())
+            self.wakeup.set()
+        except Exception as e:
+            log.exception(e)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def render(self):
+        """Take all pending entries and return them as the text to post."""
+
+        lines = []
+        for text, count in self.entries.items():
+            lines.append(text if count == 1 else text + ' (\u00d7' + str(count) + ')')
+        if self.dropped:
+            lines.append('**[WARNING]** ' + str(self.dropped) + ' more log entries were dropped.')
+
+        self.entries = OrderedDict()
+        self.dropped = 0
+        return '\n'.join(lines)
+
+    async def flush(self):
+        text = self.render()
+        if not text:
+            return
+
+        channel = self.bot.log_channel
+        if channel is None:
+            log.warning('No log channel to post to: ' + text)
+            return
+
+        for chunk in split_text(text):
+            try:
+                await channel.send(chunk)
+            except Exception as e:
+                log.exception(e)
+                log.warning('Failed to post to log channel: ' + chunk)
+
+    async def run(self):
+        """Worker loop: wait for the first entry, collect entries for a window, post them."""
+
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.window)
+            self.wakeup.clear()
+            await self.flush()
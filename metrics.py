@@ -0,0 +1,164 @@
+import bisect
+import math
+
+__all__ = ('MetricsRegistry', 'Counter', 'Gauge', 'Histogram')
+
+# Upper bounds (in seconds) of the default histogram buckets, good for latencies from a few milliseconds to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    """A monotonically increasing value per combination of label values. Label values are passed positionally in the order of _label_names_."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {} # Tuple of label values -> value
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def samples(self):
+        """Yield (sample name, label values, value) for every label combination."""
+        for label_values, value in self.values.items():
+            yield self.name, label_values, value
+
+
+class Gauge:
+    """A value that can go up and down per combination of label values. Instead of being set, a gauge may be read from a callback returning a dict of label value tuples to values whenever it is collected, so that sizes of queues and caches are never stale."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, label_names=(), callback=None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self.values = {}
+
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+    def get(self, *label_values):
+        return self.current().get(label_values, 0)
+
+    def current(self):
+        if self.callback is not None:
+            return self.callback()
+        return self.values
+
+    def samples(self):
+        for label_values, value in self.current().items():
+            yield self.name, label_values, value
+
+
+class Histogram:
+    """Counts observations into fixed buckets per combination of label values, along with their sum and count. Quantiles are estimated from the buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {} # Tuple of label values -> [bucket counts (the last one being +Inf), sum, count]
+
+    def observe(self, *label_values, value):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, *label_values):
+        entry = self.values.get(label_values)
+        return entry[2] if entry is not None else 0
+
+    def quantile(self, fraction, *label_values):
+        """Estimate the _fraction_ quantile as the upper bound of the bucket it falls into. Returns None without observations and math.inf if it lies beyond the last bucket."""
+
+        entry = self.values.get(label_values)
+        if entry is None or entry[2] == 0:
+            return None
+
+        rank = fraction * entry[2]
+        cumulative = 0
+        for index, bucket_count in enumerate(entry[0]):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else math.inf
+        return math.inf
+
+    def samples(self):
+        for label_values, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', label_values + (_format_value(upper_bound),), cumulative
+            yield self.name + '_sum', label_values, total
+            yield self.name + '_count', label_values, count
+
+
+class MetricsRegistry:
+    """All metrics of the bot by name. Cogs get (or create) their metrics here on load, so that values survive reloading a cog and everything can be rendered in one place."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, description, label_names=()):
+        return self.get_or_create(Counter, name, description, label_names)
+
+    def gauge(self, name, description, label_names=(), callback=None):
+        gauge = self.get_or_create(Gauge, name, description, label_names)
+        if callback is not None:
+            # A reloaded cog has to replace the callback of its previous instance
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.get_or_create(Histogram, name, description, label_names, buckets=buckets)
+
+    def get_or_create(self, metric_type, name, description, label_names, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = metric_type(name, description, label_names, **kwargs)
+        elif not isinstance(metric, metric_type) or metric.label_names != tuple(label_names):
+            raise ValueError('Metric ' + name + ' is already registered with a different type or labels.')
+        return metric
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render_text(self):
+        """Render all metrics in the Prometheus text exposition format."""
+
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP ' + metric.name + ' ' + metric.description.replace('\\', '\\\\').replace('\n', '\\n'))
+            lines.append('# TYPE ' + metric.name + ' ' + metric.kind)
+            label_names = metric.label_names
+            for sample_name, label_values, value in metric.samples():
+                names = label_names + ('le',) if len(label_values) > len(label_names) else label_names
+                labels = ','.join(label_name + '="' + _escape_label(label_value) + '"' for label_name, label_value in zip(names, label_values))
+                lines.append(sample_name + ('{' + labels + '}' if labels else '') + ' ' + _format_value(value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+__all__ = ('MetricsServer')
+
+
+def resident_memory_bytes():
+    """Resident set size of this process, or None if it cannot be determined on this platform."""
+
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+        # Peak rather than current usage, but better than nothing. Reported in KiB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class MetricsServer:
+    """Serves the metrics of the bot in the Prometheus text format at http://_host_:_port_/metrics.
+
+    Rendering happens only when the endpoint is scraped; everything the bot does on its own is limited to updating counters. Besides that, the server samples the lag of the event loop every _lag_interval_ seconds and exports process-wide gauges (gateway latency, memory, active minigames).
+    """
+
+    def __init__(self, bot, host, port, lag_interval=1.0):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.runner = None
+        self.lag_task = None
+
+        self.lag_histogram = bot.metrics.histogram('event_loop_lag_seconds', 'How much later than scheduled a sleeping task is woken up', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+        self.lag_gauge = bot.metrics.gauge('event_loop_lag_last_seconds', 'Lag of the event loop at the last sample')
+        bot.metrics.gauge('gateway_latency_seconds', 'Time between a heartbeat sent to discord and its acknowledgement', callback=self.gateway_latency)
+        bot.metrics.gauge('process_resident_memory_bytes', 'Resident memory of the bot process', callback=self.resident_memory)
+        bot.metrics.gauge('minigames_active', 'Minigames that are currently open or running', ('game',), callback=self.active_minigames)
+
+    def gateway_latency(self):
+        latency = self.bot.latency
+        return {} if math.isnan(latency) or math.isinf(latency) else {(): latency}
+
+    def resident_memory(self):
+        memory = resident_memory_bytes()
+        return {} if memory is None else {(): memory}
+
+    def active_minigames(self):
+        # Every minigame keeps its participants until it is over
+        result = {}
+        for cog_name, game, attribute in (('Horserace', 'horserace', 'race_participants'), ('BattleRoyale', 'battleroyale', 'br_participants'), ('Duel', 'duel', 'duels')):
+            cog = self.bot.get_cog(cog_name)
+            if cog is not None:
+                participants = getattr(cog, attribute)
+                result[(game,)] = len(participants) if game == 'duel' else int(len(participants) > 0)
+        return result
+
+    async def handle_metrics(self, request):
+        try:
+            text = self.bot.metrics.render_text()
+        except Exception as e:
+            log.exception(e)
+            raise web.HTTPInternalServerError()
+        return web.Response(text=text, content_type='text/plain', charset='utf-8', headers={'Cache-Control': 'no-cache'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.lag_task = asyncio.get_running_loop().create_task(self.sample_lag())
+        log.info('Serving metrics at http://' + self.host + ':' + str(self.port) + '/metrics')
+
+    async def stop(self):
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def sample_lag(self):
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag_histogram.observe(value=lag)
+            self.lag_gauge.set(value=lag)
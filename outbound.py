@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from collections import deque
+from conf import config
+from chunking import MESSAGE_LIMIT
+
+log = logging.getLogger(__name__)
+
+__all__ = ('OutboundScheduler')
+
+
+class ChannelOutbox:
+    """Outgoing messages of a single channel. Coalescible texts are collected into batches that are sent as one message each; everything else waits for the batches queued before it, so the channel sees messages in the order they were posted."""
+
+    def __init__(self, scheduler, channel):
+        self.scheduler = scheduler
+        self.channel = channel
+        self.labels = (str(channel.id),)
+        self.lock = asyncio.Lock() # Held while sending, so sends to this channel never overtake each other
+        self.open_batch = [] # Texts still waiting for more to be merged with
+        self.open_length = 0
+        self.batches = deque() # Closed batches waiting to be sent
+        self.timer = None
+        self.flush_task = None
+        self.unlocked_sends = 0 # Sends that went out without the lock because nothing was queued
+        self.unlocked_sends_done = asyncio.Event()
+        self.unlocked_sends_done.set()
+
+    def add(self, text):
+        if self.open_batch and self.open_length + 1 + len(text) > self.scheduler.limit:
+            self.close_batch()
+            self.start_flush()
+
+        self.open_batch.append(text)
+        self.open_length += len(text) + (1 if len(self.open_batch) > 1 else 0)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.scheduler.window, self.start_flush)
+
+    def close_batch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.open_batch:
+            self.batches.append(self.open_batch)
+            self.open_batch = []
+            self.open_length = 0
+
+    def start_flush(self):
+        self.timer = None
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        """Send everything that has been queued so far."""
+        async with self.lock:
+            await self.send_batches()
+
+    async def send_batches(self):
+        # NOTE: Must be called with the lock held
+        # Sends started while the outbox was idle may still be posting their chunks; merged texts come after them
+        await self.unlocked_sends_done.wait()
+        self.close_batch()
+        while self.batches:
+            batch = self.batches.popleft()
+            try:
+                await self.scheduler.send_text(self.channel, '\n'.join(batch))
+                self.scheduler.sent_counter.inc(*self.labels)
+                self.scheduler.batch_size.observe(*self.labels, value=len(batch))
+            except Exception as e:
+                log.exception(e)
+                self.scheduler.bot.post_log('**[ERROR]** A critical error occurred while posting merged messages. Check logs. ' + config.additional_error_message)
+
+    def idle(self):
+        """Whether nothing is queued or being sent under the lock, so that other messages can be sent right away with send_unlocked()."""
+        return not self.open_batch and not self.batches and not self.lock.locked()
+
+    async def send_unlocked(self, send_function):
+        """Send something while the outbox is idle without taking the lock. Merged texts queued meanwhile wait until it has been sent completely. Returns the result of _send_function_."""
+        self.unlocked_sends += 1
+        self.unlocked_sends_done.clear()
+        try:
+            return await send_function()
+        finally:
+            self.unlocked_sends -= 1
+            if self.unlocked_sends == 0:
+                self.unlocked_sends_done.set()
+
+    async def send(self, send_function):
+        """Send something that must not be merged once everything queued before has been sent. Returns the result of _send_function_."""
+        async with self.lock:
+            await self.send_batches()
+            return await send_function()
+
+
+class OutboundScheduler:
+    """Merges consecutive short messages the bot posts to the same channel within _window_ seconds into a single message, so that bursts (e.g. minigame announcements) cost one request instead of many.
+
+    Only texts posted with coalesce=True are merged, since those calls return before anything is sent. The merge ratio per channel is the ratio of the outbound_messages_queued_total and outbound_messages_sent_total metrics.
+    """
+
+    def __init__(self, bot, send_text, window, limit=MESSAGE_LIMIT):
+        self.bot = bot
+        self.send_text = send_text # Coroutine function (channel, text) that sends a single message
+        self.window = window
+        self.limit = limit
+        self.outboxes = {} # Channel id -> ChannelOutbox
+
+        self.queued_counter = bot.metrics.counter('outbound_messages_queued_total', 'Texts posted to a channel with coalescing enabled', ('channel',))
+        self.sent_counter = bot.metrics.counter('outbound_messages_sent_total', 'Messages sent to a channel for merged texts', ('channel',))
+        self.batch_size = bot.metrics.histogram('outbound_batch_size', 'Number of texts merged into a single message', ('channel',), buckets=(1, 2, 3, 5, 10, 20, 50))
+
+    def outbox(self, channel):
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self.outboxes[channel.id] = ChannelOutbox(self, channel)
+        return outbox
+
+    def can_coalesce(self, text):
+        return 0 < len(text) <= self.limit and self.window > 0
+
+    def queue(self, channel, text):
+        """Queue _text_ to be merged with other texts posted to _channel_ shortly before or after. Returns immediately."""
+        outbox = self.outbox(channel)
+        self.queued_counter.inc(*outbox.labels)
+        outbox.add(text)
+
+    async def send(self, channel, send_function):
+        """Call _send_function_ once all texts queued for _channel_ so far have been sent."""
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            return await send_function()
+        if outbox.idle():
+            # Nothing to wait for; sends to this channel only have to be serialized while merged texts are pending
+            return await outbox.send_unlocked(send_function)
+        return await outbox.send(send_function)
+
+    async def flush(self, channel):
+        outbox = self.outboxes.get(channel.id)
+        if outbox is not None:
+            await outbox.flush()
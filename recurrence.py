@@ -0,0 +1,166 @@
+import datetime
+import functools
+import re
+
+__all__ = ('parse_recurrence', 'CronRule', 'IntervalRule')
+
+WEEKDAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# How far ahead to look for the next occurrence of a cron rule before giving up (e.g. for 0 0 30 2 *)
+MAX_SEARCH_DAYS = 366 * 5
+
+
+class IntervalRule:
+    """Recurs every _seconds_ seconds, counted from the previous occurrence."""
+
+    def __init__(self, seconds):
+        if seconds < 60:
+            raise ValueError('The interval must be at least one minute.')
+        self.seconds = seconds
+
+    @property
+    def text(self):
+        for unit in ('d', 'h', 'm'):
+            if self.seconds % UNITS[unit] == 0:
+                return 'every ' + str(self.seconds // UNITS[unit]) + unit
+
+    def next_after(self, timestamp, previous=None, tz=None):
+        """The first occurrence later than the UTC timestamp _timestamp_, in step with the occurrence at _previous_ if given."""
+        if previous is None or previous > timestamp:
+            return timestamp + self.seconds
+        return previous + ((timestamp - previous) // self.seconds + 1) * self.seconds
+
+
+class CronRule:
+    """Recurs at the minutes matching a cron expression (minute hour day-of-month month day-of-week) in wall clock time, so occurrences keep their time of day across daylight saving time changes.
+
+    As with cron, a day matches either field if both day of month and day of week are restricted.
+    """
+
+    # (name, lowest, highest, names) of the fields, in order
+    fields = [
+        ('minute', 0, 59, None),
+        ('hour', 0, 23, None),
+        ('day of month', 1, 31, None),
+        ('month', 1, 12, MONTHS),
+        ('day of week', 0, 7, WEEKDAYS),
+    ]
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError('A cron expression has five fields: minute hour day-of-month month day-of-week.')
+
+        self.values = [parse_field(part, *field) for part, field in zip(parts, self.fields)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = self.values
+        # Sunday is 0 and 7
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        self.days_restricted = parts[2] != '*'
+        self.weekdays_restricted = parts[4] != '*'
+        self.text = ' '.join(parts)
+
+    def day_matches(self, day):
+        in_days = day.day in self.days
+        # datetime counts Monday as 0, cron Sunday
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, timestamp, previous=None, tz=None):
+        """The first matching minute later than the UTC timestamp _timestamp_, in wall clock time of _tz_ (the system's local time if None)."""
+
+        current = datetime.datetime.fromtimestamp(timestamp, tz).replace(tzinfo=None, second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        end = current + datetime.timedelta(days=MAX_SEARCH_DAYS)
+
+        while current < end:
+            if current.month not in self.months:
+                current = (current.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(current):
+                current = current.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif current.hour not in self.hours:
+                current = current.replace(minute=0) + datetime.timedelta(hours=1)
+            elif current.minute not in self.minutes:
+                current += datetime.timedelta(minutes=1)
+            else:
+                result = current.replace(tzinfo=tz).timestamp() if tz is not None else current.timestamp()
+                # Wall clock times repeated when daylight saving time ends may map to the past
+                if result > timestamp:
+                    return result
+                current += datetime.timedelta(minutes=1)
+
+        raise ValueError('The cron expression ' + self.text + ' never matches.')
+
+
+def parse_field(text, name, lowest, highest, names):
+    values = set()
+    for item in text.split(','):
+        step = 1
+        if '/' in item:
+            item, step_text = item.split('/', 1)
+            step = parse_number(step_text, name, 1, highest, None)
+        if item == '*':
+            start, stop = lowest, highest
+        elif '-' in item:
+            start_text, stop_text = item.split('-', 1)
+            start, stop = parse_number(start_text, name, lowest, highest, names), parse_number(stop_text, name, lowest, highest, names)
+        else:
+            start = parse_number(item, name, lowest, highest, names)
+            stop = highest if step > 1 else start
+        if start > stop:
+            raise ValueError('Invalid range ' + item + ' for ' + name + '.')
+        values.update(range(start, stop + 1, step))
+    return values
+
+
+def parse_number(text, name, lowest, highest, names):
+    if names is not None and text[:3] in names:
+        return names.index(text[:3]) + (1 if names is MONTHS else 0)
+    try:
+        value = int(text)
+    except ValueError:
+        raise ValueError('Invalid value ' + text + ' for ' + name + '.')
+    if value < lowest or value > highest:
+        raise ValueError('The ' + name + ' must be between ' + str(lowest) + ' and ' + str(highest) + '.')
+    return value
+
+
+def parse_time_of_day(text):
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', text)
+    if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError('Invalid time ' + text + ', use HH:MM.')
+    return int(match.group(1)), int(match.group(2))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_recurrence(text):
+    """Parse a schedule as users write it into a rule with a compact _text_ that parses to the same rule again. Raises ValueError with a message for users if _text_ is invalid.
+
+    Understood are hourly, daily HH:MM, weekly DAY HH:MM, every N(m|h|d) (or just N(m|h|d)) and cron expressions of five fields.
+    """
+
+    parts = text.lower().split()
+    if not parts:
+        raise ValueError('The schedule is empty.')
+
+    if parts == ['hourly']:
+        return IntervalRule(3600)
+    if parts[0] == 'daily' and len(parts) == 2:
+        hour, minute = parse_time_of_day(parts[1])
+        return CronRule(str(minute) + ' ' + str(hour) + ' * * *')
+    if parts[0] == 'weekly' and len(parts) == 3:
+        if parts[1][:3] not in WEEKDAYS:
+            raise ValueError('Invalid day of week ' + parts[1] + '.')
+        hour, minute = parse_time_of_day(parts[2])
+        return CronRule(str(minute) + ' ' + str(hour) + ' * * ' + str(WEEKDAYS.index(parts[1][:3])))
+    if parts[0] == 'every':
+        parts = parts[1:]
+    if len(parts) == 1:
+        match = re.fullmatch(r'(\d+)\s*([mhd])', parts[0])
+        if match is None:
+            raise ValueError('Invalid interval ' + parts[0] + ', use e.g. 30m, 6h or 2d.')
+        return IntervalRule(int(match.group(1)) * UNITS[match.group(2)])
+    return CronRule(' '.join(parts))